@@ -0,0 +1,6 @@
+# /benchmarks/__init__.py
+#
+# Entry point for benchmarks.
+#
+# See /LICENCE.md for Copyright information
+"""Entry point for benchmarks."""
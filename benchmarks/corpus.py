@@ -0,0 +1,343 @@
+# /benchmarks/corpus.py
+#
+# Generate a synthetic corpus of PubMed articles.
+#
+# See /LICENCE.md for Copyright information
+"""Generate a synthetic corpus of PubMed articles.
+
+Articles are generated from a seed, so the same seed and size always
+give the same corpus. Each article is generated as the ArticleRecord
+the parser should produce for it, then rendered as PubMed XML with
+the surrounding elements a real article has. How often each field is
+present is modelled on the representative sample of parsed articles.
+
+Run with python -m benchmarks.corpus.
+"""
+
+import argparse
+import io
+import random
+import sys
+from xml.sax.saxutils import escape
+
+from importer.record import (ArticleRecord,
+                             date_value,
+                             encode_date,
+                             unpack_date)
+from importer.store import ensure_directory, open_store
+
+
+SIZES = {
+    "1k": 1000,
+    "100k": 100000,
+    "1M": 1000000
+}
+
+# Chance of each field being present. Every article in the sample has
+# a pubDate, ISSN, country and author, and most have a reviseDate.
+FIELD_CHANCES = {
+    "pubDate": 0.98,
+    "reviseDate": 0.9,
+    "ISSN": 0.97,
+    "country": 0.99,
+    "MeshHeadingList": 0.8
+}
+
+# The sample spans these publication years evenly.
+YEAR_RANGE = (1975, 2016)
+
+# Chance of a date having only a year, or a year and month.
+DATE_PRECISION_CHANCES = ((1, 0.03), (2, 0.05))
+
+# Countries, with the mix of upper and title case found in the sample.
+COUNTRIES = (("UNITED STATES", 18),
+             ("United States", 8),
+             ("ENGLAND", 6),
+             ("England", 3),
+             ("China", 2),
+             ("Japan", 2),
+             ("NETHERLANDS", 1),
+             ("Germany", 1),
+             ("India", 1),
+             ("New Zealand", 1),
+             ("SWITZERLAND", 1),
+             ("Australia", 1),
+             ("Not Available", 1))
+
+AUTHOR_COUNT_RANGE = (1, 12)
+COLLECTIVE_AUTHOR_CHANCE = 0.02
+HEADING_COUNT_RANGE = (0, 18)
+ABSTRACT_WORD_RANGE = (80, 250)
+
+SYLLABLES = ("an", "be", "chi", "do", "el", "fa", "gu", "ha", "in", "jo",
+             "ka", "li", "mo", "na", "or", "pe", "qu", "ro", "sa", "ti",
+             "ul", "ve", "wa", "xi", "yo", "ze")
+
+WORDS = ("acute", "analysis", "blood", "cancer", "cell", "chronic",
+         "clinical", "disease", "effect", "factor", "gene", "human",
+         "infection", "injury", "liver", "model", "muscle", "patient",
+         "protein", "receptor", "risk", "syndrome", "therapy", "tissue",
+         "tumor", "vascular", "virus")
+
+QUALIFIERS = ("metabolism", "pathology", "therapy", "genetics",
+              "drug effects", "physiology")
+
+# Sizes of the pools that names are drawn from. Names are drawn with a
+# long tailed distribution, so a few are very common.
+AUTHOR_POOL_SIZE = 50000
+TOPIC_POOL_SIZE = 5000
+JOURNAL_POOL_SIZE = 3000
+
+
+def capitalised_name(rnd, syllables):
+    """Generate a capitalised name of :syllables: syllables."""
+    return "".join(rnd.choice(SYLLABLES)
+                   for _ in range(syllables)).capitalize()
+
+
+def long_tailed_index(rnd, size):
+    """Choose an index in range(size), favouring low indices."""
+    return int(rnd.paretovariate(1.1) - 1) % size
+
+
+class CorpusGenerator(object):
+    """Generate articles from a seed."""
+
+    def __init__(self, seed=0):
+        """Initialize this CorpusGenerator and its pools of names."""
+        self._seed = seed
+        rnd = random.Random(seed)
+        self.authors = [
+            "{} {}".format(capitalised_name(rnd, rnd.randint(1, 3)),
+                           capitalised_name(rnd, rnd.randint(2, 4)))
+            for _ in range(AUTHOR_POOL_SIZE)
+        ]
+        self.topics = [
+            " ".join(rnd.choice(WORDS)
+                     for _ in range(rnd.randint(1, 3))).capitalize() +
+            " {}".format(index)
+            for index in range(TOPIC_POOL_SIZE)
+        ]
+        self.journals = [
+            "{:04d}-{:03d}{}".format(rnd.randint(0, 9999),
+                                     rnd.randint(0, 999),
+                                     rnd.choice("0123456789X"))
+            for _ in range(JOURNAL_POOL_SIZE)
+        ]
+        self._countries = [c for c, w in COUNTRIES for _ in range(w)]
+
+    def _date(self, rnd, after=None):
+        """Generate a packed date, later than the packed date after."""
+        if after is None:
+            year = rnd.randint(*YEAR_RANGE)
+        else:
+            year = min(unpack_date(after).year + rnd.randint(0, 15),
+                       YEAR_RANGE[1] + 10)
+
+        precision = 3
+        chance = rnd.random()
+        for candidate, candidate_chance in DATE_PRECISION_CHANCES:
+            if chance < candidate_chance:
+                precision = candidate
+                break
+            chance -= candidate_chance
+
+        month = rnd.randint(1, 12) if precision > 1 else 1
+        day = rnd.randint(1, 28) if precision > 2 else 1
+        packed = encode_date(year, month, day, precision)
+        if after is not None and date_value(packed) < date_value(after):
+            return after
+
+        return packed
+
+    def records(self, count):
+        """Yield count ArticleRecords."""
+        rnd = random.Random(self._seed)
+        for index in range(count):
+            pub_date = (self._date(rnd)
+                        if rnd.random() < FIELD_CHANCES["pubDate"]
+                        else None)
+            revise_date = (self._date(rnd, pub_date)
+                           if rnd.random() < FIELD_CHANCES["reviseDate"]
+                           else None)
+            authors = [
+                ("Collective {}".format(rnd.choice(WORDS))
+                 if rnd.random() < COLLECTIVE_AUTHOR_CHANCE else
+                 self.authors[long_tailed_index(rnd, AUTHOR_POOL_SIZE)])
+                for _ in range(rnd.randint(*AUTHOR_COUNT_RANGE))
+            ]
+            topics = None
+            if rnd.random() < FIELD_CHANCES["MeshHeadingList"]:
+                topics = [
+                    self.topics[long_tailed_index(rnd, TOPIC_POOL_SIZE)]
+                    for _ in range(rnd.randint(*HEADING_COUNT_RANGE))
+                ]
+
+            yield ArticleRecord(
+                str(1000000 + index),
+                pub_date,
+                revise_date,
+                (self.journals[long_tailed_index(rnd, JOURNAL_POOL_SIZE)]
+                 if rnd.random() < FIELD_CHANCES["ISSN"] else None),
+                (rnd.choice(self._countries)
+                 if rnd.random() < FIELD_CHANCES["country"] else None),
+                authors,
+                topics
+            )
+
+    def documents(self, count):
+        """Yield a (pmid, document) tuple for count articles.
+
+        Each document is a PubmedArticleSet containing one article, as
+        bytes.
+        """
+        rnd = random.Random(self._seed + 1)
+        for record in self.records(count):
+            yield (record.pmid, article_set([article_xml(record, rnd)]))
+
+
+def date_xml(tag, packed):
+    """Render the packed date as the element tag."""
+    date = unpack_date(packed)
+    precision = packed & 3
+    values = (("Year", "{:04d}".format(date.year)),
+              ("Month", "{:02d}".format(date.month)),
+              ("Day", "{:02d}".format(date.day)))[:precision]
+    return "<{0}>{1}</{0}>".format(tag, "".join(
+        "<{0}>{1}</{0}>".format(t, v) for t, v in values
+    ))
+
+
+def author_xml(name):
+    """Render the author called name."""
+    if name.startswith("Collective "):
+        return ("<Author ValidYN=\"Y\"><CollectiveName>{}</CollectiveName>"
+                "</Author>").format(escape(name))
+
+    forename, lastname = name.split(" ", 1)
+    return ("<Author ValidYN=\"Y\"><LastName>{}</LastName>"
+            "<ForeName>{}</ForeName><Initials>{}</Initials>"
+            "<AffiliationInfo><Affiliation>Department of {}, University "
+            "of {}</Affiliation></AffiliationInfo></Author>").format(
+                escape(lastname),
+                escape(forename),
+                forename[0],
+                lastname,
+                forename
+            )
+
+
+def article_xml(record, rnd):
+    """Render record as a PubmedArticle element, as text.
+
+    rnd is used to generate text which the parser does not read.
+    """
+    words = " ".join(rnd.choice(WORDS)
+                     for _ in range(rnd.randint(*ABSTRACT_WORD_RANGE)))
+    parts = ["<PubmedArticle><MedlineCitation Status=\"MEDLINE\" "
+             "Owner=\"NLM\"><PMID Version=\"1\">{}</PMID>".format(
+                 record.pmid
+             )]
+    if record.pub_date is not None:
+        parts.append(date_xml("DateCompleted", record.pub_date))
+    if record.revise_date is not None:
+        parts.append(date_xml("DateRevised", record.revise_date))
+
+    parts.append("<Article PubModel=\"Print\"><Journal>")
+    if record.issn is not None:
+        parts.append("<ISSN IssnType=\"Print\">{}</ISSN>".format(
+            record.issn
+        ))
+    parts.append("<JournalIssue CitedMedium=\"Print\"><Volume>{}</Volume>"
+                 "</JournalIssue><Title>Journal of {}</Title></Journal>"
+                 "<ArticleTitle>Retracted: {}.</ArticleTitle>"
+                 "<Abstract><AbstractText>{}.</AbstractText></Abstract>"
+                 "<AuthorList CompleteYN=\"Y\">".format(
+                     rnd.randint(1, 120),
+                     rnd.choice(WORDS),
+                     words[:120],
+                     words
+                 ))
+    parts.extend(author_xml(a) for a in record.authors or ())
+    parts.append("</AuthorList><Language>eng</Language>"
+                 "<PublicationTypeList><PublicationType>Retraction of "
+                 "Publication</PublicationType></PublicationTypeList>"
+                 "</Article>")
+    if record.country is not None:
+        parts.append("<MedlineJournalInfo><Country>{}</Country>"
+                     "<NlmUniqueID>{}</NlmUniqueID>"
+                     "</MedlineJournalInfo>".format(escape(record.country),
+                                                    rnd.randint(0, 99999)))
+    if record.topics is not None:
+        parts.append("<MeshHeadingList>")
+        parts.extend(
+            "<MeshHeading><DescriptorName MajorTopicYN=\"N\">{}"
+            "</DescriptorName><QualifierName MajorTopicYN=\"N\">{}"
+            "</QualifierName></MeshHeading>".format(escape(t),
+                                                    rnd.choice(QUALIFIERS))
+            for t in record.topics
+        )
+        parts.append("</MeshHeadingList>")
+    parts.append("</MedlineCitation><PubmedData><PublicationStatus>ppublish"
+                 "</PublicationStatus><ArticleIdList><ArticleId "
+                 "IdType=\"pubmed\">{}</ArticleId></ArticleIdList>"
+                 "</PubmedData></PubmedArticle>".format(record.pmid))
+    return "".join(parts)
+
+
+def article_set(articles):
+    """Wrap the article elements in a PubmedArticleSet, as bytes."""
+    return ("<?xml version=\"1.0\"?>\n<PubmedArticleSet>{}"
+            "</PubmedArticleSet>\n").format("".join(articles)).encode("utf-8")
+
+
+def corpus_size(value):
+    """Convert a size name like 100k, or a number, to an article count."""
+    return SIZES[value] if value in SIZES else int(value)
+
+
+def main(argv=None):
+    """Write a synthetic corpus of articles."""
+    parser = argparse.ArgumentParser(description="Generate a synthetic "
+                                                 "corpus of PubMed articles")
+    parser.add_argument("location",
+                        metavar="PATH",
+                        help="Directory to store articles in, or file to "
+                             "write a single PubmedArticleSet to")
+    parser.add_argument("--size",
+                        type=corpus_size,
+                        default="1k",
+                        help="Number of articles, or one of {}".format(
+                            ", ".join(sorted(SIZES))
+                        ))
+    parser.add_argument("--seed",
+                        type=int,
+                        default=0)
+    parser.add_argument("--store",
+                        choices=("pack", "directory", "set"),
+                        default="pack",
+                        help="Store articles in a pack, as XML files in a "
+                             "directory, or as one PubmedArticleSet")
+    parse_result = parser.parse_args(argv or sys.argv[1:])
+
+    generator = CorpusGenerator(parse_result.seed)
+    if parse_result.store == "set":
+        rnd = random.Random(parse_result.seed + 1)
+        with io.open(parse_result.location, "wb") as out_file:
+            out_file.write(b"<?xml version=\"1.0\"?>\n<PubmedArticleSet>")
+            for record in generator.records(parse_result.size):
+                out_file.write(article_xml(record, rnd).encode("utf-8"))
+            out_file.write(b"</PubmedArticleSet>\n")
+        return
+
+    ensure_directory(parse_result.location)
+    store = open_store(parse_result.location, parse_result.store)
+    try:
+        for pmid, document in generator.documents(parse_result.size):
+            store.write(pmid, document)
+    finally:
+        store.close()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,104 @@
+# /benchmarks/parse_element.py
+#
+# Benchmark single pass article parsing against the old multi pass parser.
+#
+# See /LICENCE.md for Copyright information
+"""Benchmark single pass article parsing against the old multi pass parser.
+
+Run with python -m benchmarks.parse_element.
+"""
+
+import argparse
+import sys
+import timeit
+import xml.etree.ElementTree as ET
+
+from benchmarks import baseline_parsexml
+
+from importer import parsexml
+
+
+def multi_pass_parse_element(root):
+    """Parse :root: with the parser from before it was single pass."""
+    return baseline_parsexml.parse_element_tree(ET.ElementTree(root))
+
+
+def generate_article(authors, headings, heading_lists=1):
+    """Generate an article element with authors and MeSH headings.
+
+    The headings are split evenly between heading_lists MeshHeadingList
+    elements.
+    """
+    return ET.fromstring(
+        "<PubmedArticle><MedlineCitation><PMID>1</PMID>"
+        "<DateCompleted><Year>2011</Year><Month>11</Month><Day>11</Day>"
+        "</DateCompleted>"
+        "<DateRevised><Year>2012</Year><Month>11</Month><Day>11</Day>"
+        "</DateRevised>"
+        "<Article><Journal><ISSN>0000-0000</ISSN></Journal><AuthorList>{}"
+        "</AuthorList></Article>"
+        "<MedlineJournalInfo><Country>Australia</Country>"
+        "</MedlineJournalInfo>"
+        "{}</MedlineCitation></PubmedArticle>".format(
+            "".join([
+                "<Author><LastName>Last{0}</LastName>"
+                "<ForeName>First{0}</ForeName></Author>".format(i)
+                for i in range(authors)
+            ]),
+            "".join([
+                "<MeshHeadingList>{}</MeshHeadingList>".format("".join([
+                    "<MeshHeading><DescriptorName>Topic {}</DescriptorName>"
+                    "<QualifierName>Qualifier</QualifierName>"
+                    "</MeshHeading>".format(i)
+                    for i in range(headings // heading_lists)
+                ]))
+                for _ in range(heading_lists)
+            ])
+        )
+    )
+
+
+def time_per_article(function, article, number):
+    """Get the best time in seconds for function to parse article."""
+    return min(timeit.repeat(lambda: function(article),
+                             number=number,
+                             repeat=3)) / number
+
+
+def main(argv=None):
+    """Print time taken per article by both parsers."""
+    parser = argparse.ArgumentParser(description="Benchmark parse_element")
+    parser.add_argument("--number",
+                        type=int,
+                        default=2000,
+                        metavar="N",
+                        help="How many times to parse each article")
+    parse_result = parser.parse_args(argv or sys.argv[1:])
+
+    print("authors headings lists  multi-pass  single-pass  speedup")
+    for authors, headings, lists in [(1, 0, 1),
+                                     (4, 10, 1),
+                                     (8, 25, 1),
+                                     (20, 60, 1),
+                                     (20, 60, 6)]:
+        article = generate_article(authors, headings, lists)
+        assert (multi_pass_parse_element(article) ==
+                parsexml.parse_element(article).to_json())
+        before = time_per_article(multi_pass_parse_element,
+                                  article,
+                                  parse_result.number)
+        after = time_per_article(parsexml.parse_element,
+                                 article,
+                                 parse_result.number)
+        print("{:7d} {:8d} {:5d} {:9.1f}us {:10.1f}us {:7.2f}x".format(
+            authors,
+            headings,
+            lists,
+            before * 1e6,
+            after * 1e6,
+            before / after
+        ))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,240 @@
+# /benchmarks/run.py
+#
+# Measure the throughput and memory use of each stage of the pipeline.
+#
+# See /LICENCE.md for Copyright information
+"""Measure the throughput and memory use of each stage of the pipeline.
+
+Each stage runs in a new process, so that its peak resident set size
+is not affected by the other stages. Only the stage itself is timed,
+not generating or reading its input. Results are written as JSON, so
+that runs can be compared with --compare.
+
+Run with python -m benchmarks.run.
+"""
+
+import argparse
+import io
+import json
+import multiprocessing
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import timeit
+
+from benchmarks.corpus import CorpusGenerator, corpus_size
+
+from importer import csvexport, generate_representative_sample, parsexml
+from importer.store import open_store
+
+
+STAGES = ("parse_element_tree",
+          "commands_from_data",
+          "statements_from_data",
+          "export_csv",
+          "sample_fields")
+
+
+def peak_rss_kb():
+    """Get the peak resident set size of this process in KiB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports bytes, other platforms report KiB.
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def corpus_records(size, seed, corpus):
+    """Get a list of ArticleRecords for the corpus."""
+    if corpus is None:
+        return list(CorpusGenerator(seed).records(size))
+
+    return list(parsexml.parse_store(open_store(corpus),
+                                     parsexml.select_backend()))
+
+
+def bench_parse_element_tree(size, seed, corpus):
+    """Time parsing each document, returning (articles, seconds)."""
+    if corpus is None:
+        documents = CorpusGenerator(seed).documents(size)
+    else:
+        documents = open_store(corpus).articles()
+
+    articles = 0
+    elapsed = 0.0
+    for _, document in documents:
+        start = timeit.default_timer()
+        parsexml.parse_element_tree(
+            parsexml.file_to_element_tree(io.BytesIO(document))
+        )
+        elapsed += timeit.default_timer() - start
+        articles += 1
+
+    return (articles, elapsed)
+
+
+def bench_commands_from_data(size, seed, corpus):
+    """Time generating Neo4j commands, returning (articles, seconds)."""
+    # Imported here, since the Neo4j driver may not be installed
+    from importer import load
+
+    records = corpus_records(size, seed, corpus)
+    start = timeit.default_timer()
+    for _ in load.commands_from_data(records):
+        pass
+
+    return (len(records), timeit.default_timer() - start)
+
+
+def bench_statements_from_data(size, seed, corpus):
+    """Time generating batched statements, returning (articles, seconds)."""
+    # Imported here, since the Neo4j driver may not be installed
+    from importer import load
+
+    records = corpus_records(size, seed, corpus)
+    start = timeit.default_timer()
+    for _ in load.statements_from_data(records):
+        pass
+
+    return (len(records), timeit.default_timer() - start)
+
+
+def bench_export_csv(size, seed, corpus):
+    """Time exporting bulk import CSV files, returning (articles, seconds)."""
+    records = corpus_records(size, seed, corpus)
+    directory = tempfile.mkdtemp()
+    try:
+        start = timeit.default_timer()
+        csvexport.export_csv(records, directory)
+        return (len(records), timeit.default_timer() - start)
+    finally:
+        shutil.rmtree(directory)
+
+
+def bench_sample_fields(size, seed, corpus):
+    """Time sampling articles, returning (articles, seconds)."""
+    records = corpus_records(size, seed, corpus)
+    start = timeit.default_timer()
+    generate_representative_sample.sample_fields(
+        generate_representative_sample.FIELDS_TO_SAMPLE,
+        generate_representative_sample.determine_year_range(records),
+        records
+    )
+    return (len(records), timeit.default_timer() - start)
+
+
+def run_stage(stage, size, seed, corpus):
+    """Run the benchmark for stage, returning its results as a dict."""
+    try:
+        articles, seconds = globals()["bench_" + stage](size, seed, corpus)
+    except ImportError as error:
+        return {"skipped": str(error)}
+
+    return {
+        "articles": articles,
+        "seconds": seconds,
+        "articles_per_second": articles / seconds if seconds else None,
+        "peak_rss_kb": peak_rss_kb()
+    }
+
+
+def run_stage_in_new_process(stage, size, seed, corpus):
+    """Run the benchmark for stage in a new process."""
+    pool = multiprocessing.Pool(1)
+    try:
+        return pool.apply(run_stage, (stage, size, seed, corpus))
+    finally:
+        pool.close()
+        pool.join()
+
+
+def format_result(stage, result, previous=None):
+    """Format the result for stage as a line of text.
+
+    If previous is set, the change from the previous result is shown.
+    """
+    if "skipped" in result:
+        return "{:20s} skipped: {}".format(stage, result["skipped"])
+
+    line = "{:20s} {:9d} {:14.1f} {:12d}".format(
+        stage,
+        result["articles"],
+        result["articles_per_second"] or 0.0,
+        result["peak_rss_kb"]
+    )
+    if previous and previous.get("articles_per_second"):
+        line += " {:8.2f}x {:8.2f}x".format(
+            (result["articles_per_second"] or 0.0) /
+            previous["articles_per_second"],
+            float(result["peak_rss_kb"]) / previous["peak_rss_kb"]
+        )
+
+    return line
+
+
+def main(argv=None):
+    """Benchmark each stage of the pipeline."""
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline")
+    parser.add_argument("--size",
+                        type=corpus_size,
+                        default="1k",
+                        help="Number of articles to generate, or 1k, 100k "
+                             "or 1M")
+    parser.add_argument("--seed",
+                        type=int,
+                        default=0)
+    parser.add_argument("--corpus",
+                        metavar="DIR",
+                        help="Read articles from a store instead of "
+                             "generating them")
+    parser.add_argument("--stage",
+                        action="append",
+                        choices=STAGES,
+                        help="Stage to run, can be given more than once "
+                             "(default is all stages)")
+    parser.add_argument("--output",
+                        metavar="FILE",
+                        help="Write results as JSON to FILE")
+    parser.add_argument("--compare",
+                        metavar="FILE",
+                        help="Show the change from results in FILE")
+    parse_result = parser.parse_args(argv or sys.argv[1:])
+
+    previous = dict()
+    if parse_result.compare:
+        with open(parse_result.compare) as compare_file:
+            previous = json.load(compare_file)["stages"]
+
+    results = {
+        "size": parse_result.size,
+        "seed": parse_result.seed,
+        "corpus": parse_result.corpus,
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "stages": dict()
+    }
+
+    print("{:20s} {:>9s} {:>14s} {:>12s}{}".format(
+        "stage",
+        "articles",
+        "articles/sec",
+        "peak RSS KiB",
+        "    speed   memory" if previous else ""
+    ))
+    for stage in parse_result.stage or STAGES:
+        result = run_stage_in_new_process(stage,
+                                          parse_result.size,
+                                          parse_result.seed,
+                                          parse_result.corpus)
+        results["stages"][stage] = result
+        print(format_result(stage, result, previous.get(stage, None)))
+        sys.stdout.flush()
+
+    if parse_result.output:
+        with open(parse_result.output, "w") as output_file:
+            json.dump(results, output_file, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,214 @@
+# /importer/cache.py
+#
+# Cache of parsed records for stored articles.
+#
+# See /LICENCE.md for Copyright information
+"""Cache of parsed records for stored articles.
+
+The cache is an SQLite database mapping the name of each stored
+document to the records parsed from it. An entry is only used if the
+document still has the same size and SHA-1 digest, and was parsed by
+the same parser version, so changed documents are parsed again.
+
+Entries also keep the stamp the store gave the document, such as its
+size and modification time. While the stamp is the same, the entry is
+used without reading or hashing the document at all.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import time
+
+
+CACHE_FILE = ".parse-cache.sqlite"
+
+# How many new entries to write before committing them.
+COMMIT_INTERVAL = 500
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS parsed (
+    name TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    digest TEXT NOT NULL,
+    version TEXT NOT NULL,
+    records TEXT NOT NULL,
+    used REAL NOT NULL,
+    stamp TEXT
+)
+"""
+
+
+def default_cache_path(location):
+    """Get the default path of the cache for articles in location."""
+    return os.path.join(location, CACHE_FILE)
+
+
+def fingerprint(document):
+    """Get the (size, digest) tuple identifying the bytes in document."""
+    return (len(document), hashlib.sha1(document).hexdigest())
+
+
+class ParseCache(object):
+    """Cache of records parsed by a given parser version."""
+
+    def __init__(self, path, version, clock=time.time):
+        """Initialize this ParseCache at path, for parser version."""
+        self.path = path
+        self.version = version
+        self.hits = 0
+        self.misses = 0
+        self._clock = clock
+        self._now = clock()
+        self._pending = 0
+        self._connection = sqlite3.connect(path)
+        self._connection.execute(SCHEMA)
+        columns = [row[1] for row in self._connection.execute(
+            "PRAGMA table_info(parsed)"
+        )]
+        if "stamp" not in columns:
+            self._connection.execute("ALTER TABLE parsed "
+                                     "ADD COLUMN stamp TEXT")
+
+    def get_unchanged(self, name, stamp):
+        """Get (size, records) for name if it still has the same stamp.
+
+        Returns None if stamp is None or is not the stamp of the entry
+        for name, in which case the document should be read and looked
+        up with get instead, so no miss is counted.
+        """
+        if stamp is None:
+            return None
+
+        row = self._connection.execute(
+            "SELECT size, records FROM parsed "
+            "WHERE name = ? AND stamp = ? AND version = ?",
+            (name, stamp, self.version)
+        ).fetchone()
+        if row is None:
+            return None
+
+        self._used(name, stamp)
+        return (row[0], json.loads(row[1]))
+
+    def get(self, name, key, stamp=None):
+        """Get the records for name if it has the fingerprint key.
+
+        Returns None if there is no valid entry for name. Using an
+        entry marks it as used by this run, so it is not evicted, and
+        records stamp as its new stamp.
+        """
+        size, digest = key
+        row = self._connection.execute(
+            "SELECT records FROM parsed "
+            "WHERE name = ? AND size = ? AND digest = ? AND version = ?",
+            (name, size, digest, self.version)
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+
+        self._used(name, stamp)
+        return json.loads(row[0])
+
+    def _used(self, name, stamp):
+        """Count a hit for name, marking it as used with stamp."""
+        self.hits += 1
+        self._connection.execute("UPDATE parsed SET used = ?, stamp = ? "
+                                 "WHERE name = ?",
+                                 (self._now, stamp, name))
+        self._written()
+
+    def put(self, name, key, records, stamp=None):
+        """Store records as parsed from name with the fingerprint key."""
+        size, digest = key
+        self._connection.execute(
+            "INSERT OR REPLACE INTO parsed "
+            "(name, size, digest, version, records, used, stamp) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (name, size, digest, self.version, json.dumps(records),
+             self._now, stamp)
+        )
+        self._written()
+
+    def _written(self):
+        """Commit every COMMIT_INTERVAL writes."""
+        self._pending += 1
+        if self._pending >= COMMIT_INTERVAL:
+            self._connection.commit()
+            self._pending = 0
+
+    def __len__(self):
+        """Get the number of entries in this cache."""
+        return self._connection.execute(
+            "SELECT COUNT(*) FROM parsed"
+        ).fetchone()[0]
+
+    def summary(self):
+        """Summarise cache hits and misses."""
+        return "Parse cache: {} hits, {} misses".format(self.hits,
+                                                        self.misses)
+
+    def compact(self, max_age):
+        """Evict entries unused for max_age seconds, then compact.
+
+        Entries for other parser versions are always evicted. Returns
+        the number of entries evicted.
+        """
+        cursor = self._connection.execute(
+            "DELETE FROM parsed WHERE used < ? OR version != ?",
+            (self._clock() - max_age, self.version)
+        )
+        self._connection.commit()
+        self._pending = 0
+        self._connection.execute("VACUUM")
+        return cursor.rowcount
+
+    def close(self):
+        """Commit any pending entries and close this cache."""
+        if self._connection is not None:
+            self._connection.commit()
+            self._connection.close()
+            self._connection = None
+
+
+def main(argv=None):
+    """Evict old entries from a parse cache and compact it."""
+    # Imported here, since the parser imports this module
+    from importer.parsexml import PARSER_VERSION
+
+    parser = argparse.ArgumentParser(description="Compact a parse cache")
+    parser.add_argument("location",
+                        default="Retractions",
+                        type=str,
+                        nargs="?",
+                        metavar="PATH",
+                        help="Cache file, or directory of downloaded "
+                             "articles containing one")
+    parser.add_argument("--max-age",
+                        type=float,
+                        default=30,
+                        metavar="DAYS",
+                        help="Evict entries not used for this many days")
+    parse_result = parser.parse_args(argv or sys.argv[1:])
+
+    path = parse_result.location
+    if os.path.isdir(path):
+        path = default_cache_path(path)
+
+    cache = ParseCache(path, PARSER_VERSION)
+    try:
+        evicted = cache.compact(parse_result.max_age * 24 * 60 * 60)
+        sys.stderr.write("Evicted {} entries, {} remain.\n".format(
+            evicted,
+            len(cache)
+        ))
+    finally:
+        cache.close()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,148 @@
+# /importer/charts.py
+#
+# Precompute the bar charts the backend draws.
+#
+# See /LICENCE.md for Copyright information
+"""Precompute the bar charts the backend draws.
+
+Each /get_bar_chart request counts the relationships of every node
+with a label, which scans the whole graph. Once a load is done, the
+answer to each unfiltered chart, and to each chart filtered on one of
+the names in the top of its filter's own chart, is computed once and
+stored as a ChartSummary node. The backend looks summaries up by key,
+and only runs the query itself for filters without one.
+"""
+
+import json
+import re
+
+from collections import OrderedDict
+
+
+# The label counted by each chart, and the label of each filter type,
+# as named by routes/index.js.
+CHARTS = {
+    "topicRetraction": "Topic",
+    "authorRetraction": "Author",
+    "countryRetraction": "Country",
+    "retractionsOverTime": "Year"
+}
+
+FILTERS = {
+    "country": "Country",
+    "author": "Author",
+    "topic": "Topic",
+    "year": "Year"
+}
+
+SUMMARY_LABEL = "ChartSummary"
+
+# Keys which JavaScript treats as array indices, and orders first.
+ARRAY_INDEX = re.compile(r"^(0|[1-9][0-9]{0,9})$")
+
+# How many names each chart shows, and how many of the names in the
+# chart for each filter type get a filtered summary.
+CHART_LIMIT = 10
+SUMMARY_FILTERS = 10
+
+TOP_STATEMENT = (u"MATCH (a:{0})-[r]-() "
+                 "RETURN a.name AS name, count(r) AS rel_count "
+                 "ORDER BY rel_count DESC LIMIT {{limit}}")
+
+FILTERED_TOP_STATEMENT = (u"MATCH (f:{0} {{name: {{filterString}}}})"
+                          "-[fr]-(t:Article)-[r]-(a:{1}) "
+                          "RETURN a.name AS name, count(r) AS rel_count "
+                          "ORDER BY rel_count DESC LIMIT {{limit}}")
+
+# Summaries are replaced in one transaction, so the backend sees either
+# the old ones or the new ones.
+DELETE_SUMMARIES_STATEMENT = u"MATCH (s:{0}) DELETE s".format(SUMMARY_LABEL)
+
+CREATE_SUMMARIES_STATEMENT = (u"UNWIND {{summaries}} AS summary "
+                              "CREATE (:{0} {{key: summary.key, "
+                              "data: summary.data}})").format(SUMMARY_LABEL)
+
+
+def summary_key(chart, filter_type=None, filter_string=None):
+    """Get the key of the summary of chart, filtered if filter_type is set.
+
+    This is the same as JSON.stringify gives for the key routes/index.js
+    looks summaries up by.
+    """
+    return json.dumps([chart,
+                       filter_type or None,
+                       filter_string if filter_type else None],
+                      separators=(",", ":"),
+                      ensure_ascii=False)
+
+
+def normalise_name(name):
+    """Put name in title case, as normaliseName in routes/index.js does."""
+    return u" ".join(section[:1].upper() + section[1:]
+                     for section in name.lower().split(u" "))
+
+
+def _is_array_index(key):
+    """Check if JavaScript treats key as an array index."""
+    return ARRAY_INDEX.match(key) is not None and int(key) < 2 ** 32 - 1
+
+
+def chart_data(rows):
+    """Merge (name, count) rows into chart data as the backend does.
+
+    Rows whose names only differ by capitalisation are added together.
+    The names are ordered as JavaScript orders the keys of an object:
+    array indices such as years first, in ascending order, then the
+    rest in the order they were first seen.
+    """
+    accumulator = OrderedDict()
+    for name, count in rows:
+        name = normalise_name(name)
+        accumulator[name] = accumulator.get(name, 0) + count
+
+    names = (sorted((k for k in accumulator if _is_array_index(k)), key=int) +
+             [k for k in accumulator if not _is_array_index(k)])
+    return [{"name": name, "value": accumulator[name]} for name in names]
+
+
+def _top(runner, statement, parameters):
+    """Get (name, count) rows for statement, run with runner."""
+    results = runner.run([(statement,
+                           dict(parameters, limit=CHART_LIMIT))])
+    return [(record["name"], record["rel_count"]) for record in results[0]]
+
+
+def chart_summaries(runner):
+    """Compute a {key: data} dict of chart summaries with runner."""
+    summaries = dict()
+    top_names = dict()
+    for chart, label in CHARTS.items():
+        rows = _top(runner, TOP_STATEMENT.format(label), {})
+        top_names[label] = [name for name, _ in rows[:SUMMARY_FILTERS]]
+        summaries[summary_key(chart)] = chart_data(rows)
+
+    for filter_type, filter_label in FILTERS.items():
+        for name in top_names[filter_label]:
+            for chart, label in CHARTS.items():
+                rows = _top(runner,
+                            FILTERED_TOP_STATEMENT.format(filter_label,
+                                                          label),
+                            {"filterString": name})
+                summaries[summary_key(chart,
+                                      filter_type,
+                                      name)] = chart_data(rows)
+
+    return summaries
+
+
+def write_chart_summaries(runner):
+    """Replace the ChartSummary nodes with ones for the current graph."""
+    summaries = chart_summaries(runner)
+    runner.run([
+        (DELETE_SUMMARIES_STATEMENT, {}),
+        (CREATE_SUMMARIES_STATEMENT, {
+            "summaries": [{"key": key, "data": json.dumps(data)}
+                          for key, data in sorted(summaries.items())]
+        })
+    ])
+    return len(summaries)
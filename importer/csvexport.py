@@ -0,0 +1,266 @@
+# /importer/csvexport.py
+#
+# Export articles as CSV files for the offline Neo4j bulk importer.
+#
+# See /LICENCE.md for Copyright information
+"""Export articles as CSV files for the offline Neo4j bulk importer.
+
+Building a fresh graph with neo4j-admin import (or neo4j-import on
+older releases) is much faster than merging each article into a live
+database. Articles are written as they are read. Each node is written
+once, identified by its natural key within an ID space for its label,
+so the IDs are the same between runs.
+
+The keys already written are kept in memory so that nodes are not
+written twice, so memory use grows with the number of distinct pmids
+and names exported, at roughly 100 bytes each. For the whole of
+PubMed that is a few gigabytes. Records repeating a pmid are also kept
+until the export is closed, when they are merged into what was
+written.
+"""
+
+from collections import OrderedDict
+import io
+import os
+
+from importer.record import as_article_record, unpack_date
+
+
+ARTICLE_FILE = "article.csv"
+
+# The label of each kind of node articles are related to, and the type
+# of the relationship, in the same order the loader merges them.
+RELATED_NODES = (("Author", "AUTHORED_BY"),
+                 ("Country", "ORIGINATED_IN"),
+                 ("Topic", "DISCUSSES"),
+                 ("Month", "PUBLISHED_IN"),
+                 ("Year", "PUBLISHED_IN"))
+RELATIONSHIP_TYPES = dict(RELATED_NODES)
+
+
+def node_file(label):
+    """Get the name of the file of nodes with label."""
+    return "{}.csv".format(label.lower())
+
+
+def relationship_file(label, relationship):
+    """Get the name of the file of relationships to nodes with label."""
+    return "{}_{}.csv".format(relationship.lower(), label.lower())
+
+
+def related_names(record):
+    """Yield (label, name) for each node the ArticleRecord is related to."""
+    for author in record.authors or ():
+        yield ("Author", author)
+    if record.country:
+        yield ("Country", record.country)
+    for topic in record.topics or ():
+        yield ("Topic", topic)
+    if record.pub_date is not None:
+        date = unpack_date(record.pub_date)
+        yield ("Month", date.strftime("%B"))
+        yield ("Year", str(date.year))
+
+
+def csv_line(values):
+    """Format values as a line of CSV, leaving None values empty.
+
+    Every other value is quoted, so that names containing commas or
+    quotes are read back as they are.
+    """
+    return u",".join([
+        u"\"{}\"".format(value.replace(u"\"", u"\"\""))
+        if value is not None else u""
+        for value in values
+    ]) + u"\n"
+
+
+class CSVExporter(object):
+    """Writes articles into a directory of bulk import CSV files."""
+
+    def __init__(self, directory):
+        """Initialize this CSVExporter, creating files in directory."""
+        self.directory = directory
+        self.articles = 0
+        self.duplicates = 0
+        self.nodes = 0
+        self.relationships = 0
+        self._articles = set()
+        self._names = {label: set() for label, _ in RELATED_NODES}
+        self._repeated = OrderedDict()
+        self._files = dict()
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        self._open(ARTICLE_FILE, ["title:ID(Article)", "ISSN", ":LABEL"])
+        for label, relationship in RELATED_NODES:
+            self._open(node_file(label),
+                       ["name:ID({})".format(label), ":LABEL"])
+            self._open(relationship_file(label, relationship),
+                       [":START_ID(Article)",
+                        ":END_ID({})".format(label),
+                        ":TYPE"])
+
+    def _open(self, name, header):
+        """Open the file called name, writing its header."""
+        fileobj = io.open(os.path.join(self.directory, name),
+                          "w",
+                          encoding="utf-8",
+                          newline="")
+        fileobj.write(u",".join(header) + u"\n")
+        self._files[name] = fileobj
+
+    def add(self, record):
+        """Write record, an ArticleRecord or its JSON form.
+
+        Records without a pmid are skipped. The loader merges records
+        with the same pmid into one article, so records repeating a
+        pmid are kept and merged into the first when this CSVExporter
+        is closed.
+        """
+        record = as_article_record(record)
+        if record.pmid is None:
+            return
+
+        related = self._write_nodes(record)
+        if record.pmid in self._articles:
+            self.duplicates += 1
+            repeated = self._repeated.setdefault(record.pmid, [None, []])
+            repeated[0] = record.issn or repeated[0]
+            repeated[1].extend(related)
+            return
+
+        self._articles.add(record.pmid)
+        self._files[ARTICLE_FILE].write(
+            csv_line([record.pmid, record.issn or None, u"Article"])
+        )
+        self.articles += 1
+
+        for label, name in related:
+            relationship = RELATIONSHIP_TYPES[label]
+            self._files[relationship_file(label, relationship)].write(
+                csv_line([record.pmid, name, relationship])
+            )
+            self.relationships += 1
+
+    def _write_nodes(self, record):
+        """Write nodes record is related to which were not yet written.
+
+        Returns a list of (label, name) for each node record is related
+        to, without repeats.
+        """
+        related = OrderedDict()
+        for label, name in related_names(record):
+            if (label, name) in related:
+                continue
+
+            related[(label, name)] = True
+            if name not in self._names[label]:
+                self._names[label].add(name)
+                self._files[node_file(label)].write(csv_line([name, label]))
+                self.nodes += 1
+
+        return list(related)
+
+    def _read_lines(self, name):
+        """Yield each line written to the file called name."""
+        self._files[name].flush()
+        with io.open(os.path.join(self.directory, name),
+                     encoding="utf-8",
+                     newline="") as fileobj:
+            for line in fileobj:
+                yield line
+
+    def _merge_repeated(self):
+        """Merge records repeating a pmid into the articles written.
+
+        Like the loader, an article is related to every node any of its
+        records are, and keeps the last ISSN any of them have. Each
+        relationship file is read once to find which relationships
+        were not yet written, and the article file is only rewritten
+        if a repeated record has an ISSN.
+        """
+        for label, relationship in RELATED_NODES:
+            name = relationship_file(label, relationship)
+            missing = OrderedDict()
+            for pmid, (_, related) in self._repeated.items():
+                for related_label, related_name in related:
+                    if related_label == label:
+                        missing[csv_line([pmid,
+                                          related_name,
+                                          relationship])] = True
+
+            if missing:
+                for line in self._read_lines(name):
+                    missing.pop(line, None)
+
+                for line in missing:
+                    self._files[name].write(line)
+                    self.relationships += 1
+
+        issns = {
+            csv_line([pmid])[:-1]: csv_line([pmid, issn, u"Article"])
+            for pmid, (issn, _) in self._repeated.items() if issn
+        }
+        if issns:
+            path = os.path.join(self.directory, ARTICLE_FILE)
+            temporary = path + ".tmp"
+            with io.open(temporary,
+                         "w",
+                         encoding="utf-8",
+                         newline="") as fileobj:
+                for line in self._read_lines(ARTICLE_FILE):
+                    fileobj.write(issns.get(line.split(u",", 1)[0], line))
+
+            self._files.pop(ARTICLE_FILE).close()
+            os.rename(temporary, path)
+
+    def import_arguments(self):
+        """Get the arguments to pass neo4j-admin import for the files."""
+        arguments = ["--nodes={}".format(os.path.join(self.directory,
+                                                      ARTICLE_FILE))]
+        arguments.extend(
+            "--nodes={}".format(os.path.join(self.directory,
+                                             node_file(label)))
+            for label, _ in RELATED_NODES
+        )
+        arguments.extend(
+            "--relationships={}".format(
+                os.path.join(self.directory,
+                             relationship_file(label, relationship))
+            )
+            for label, relationship in RELATED_NODES
+        )
+        return arguments
+
+    def summary(self):
+        """Summarise what was written."""
+        return ("{} articles, {} other nodes, {} relationships, "
+                "{} duplicate articles merged".format(self.articles,
+                                                       self.nodes,
+                                                       self.relationships,
+                                                       self.duplicates))
+
+    def close(self):
+        """Merge records repeating a pmid, then close all files."""
+        try:
+            if self._repeated:
+                self._merge_repeated()
+        finally:
+            for fileobj in self._files.values():
+                fileobj.close()
+            self._files = dict()
+            self._repeated = OrderedDict()
+
+
+def export_csv(records, directory):
+    """Export each of records into directory, returning the CSVExporter."""
+    exporter = CSVExporter(directory)
+    try:
+        for record in records:
+            exporter.add(record)
+    finally:
+        exporter.close()
+
+    return exporter
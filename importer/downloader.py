@@ -6,18 +6,58 @@
 """Download PubMed articles."""
 
 import argparse
-import contextlib
+from datetime import date, datetime
+import errno
+import functools
 import json
+import itertools
 import os
-import errno
+import random
+import socket
 import sys
+import threading
+import time
+import xml.etree.ElementTree as ET
+import zlib
+
+from importer import instrument
+from importer.store import ensure_directory, open_store
+
+from six.moves import http_client, queue, urllib
+
+
+# efetch rejects very long query strings, so ID lists longer than this
+# are sent in the body of a POST request instead.
+POST_ID_THRESHOLD = 200
+
+ARTICLE_SET_HEADER = (b"<?xml version=\"1.0\" encoding=\"UTF-8\"?>\n"
+                      b"<PubmedArticleSet>\n")
+ARTICLE_SET_FOOTER = b"</PubmedArticleSet>\n"
+
+# NCBI allows three requests per second without an API key and ten
+# requests per second with one.
+DEFAULT_RATE = 3.0
+DEFAULT_API_KEY_RATE = 10.0
+
+# Name of the file in the download directory recording the date of the
+# last successful --sync run.
+LAST_SYNC_FILE = ".last-sync"
 
-from six.moves import urllib
+# Date format used by the E-utilities mindate and maxdate parameters.
+PUBMED_DATE_FORMAT = "%Y/%m/%d"
+
+# HTTP status codes which mean that the server wants us to slow down.
+THROTTLE_STATUS_CODES = (429, 500, 502, 503, 504)
+
+# Redirects are followed up to MAX_REDIRECTS times per request. Only
+# 303 changes a POST request into a GET request.
+REDIRECT_STATUS_CODES = (301, 302, 303, 307, 308)
+MAX_REDIRECTS = 5
 
 
 def pubmed_api(function):
     """Get entry point for PubMed API."""
-    pubmed_api_url = "http://eutils.ncbi.nlm.nih.gov/entrez/eutils/{}.fcgi?"
+    pubmed_api_url = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/{}.fcgi?"
     return pubmed_api_url.format(function)
 
 
@@ -31,6 +71,42 @@ def pubmed_search_for_articles_url(term, retmax=10):
     })
 
 
+def pubmed_search_history_url(term, retmax=10, mindate=None, maxdate=None):
+    """Get a URL to search PubMed, storing results on the history server.
+
+    If mindate and maxdate are set, only articles modified between
+    those dates are returned.
+    """
+    params = {
+        "db": "pubmed",
+        "term": term,
+        "usehistory": "y",
+        "retmax": str(retmax),
+        "retmode": "json"
+    }
+    if mindate:
+        params.update({
+            "datetype": "mdat",
+            "mindate": mindate,
+            "maxdate": maxdate
+        })
+
+    return pubmed_api("esearch") + urllib.parse.urlencode(params)
+
+
+def pubmed_search_history_page_url(webenv, query_key, retstart, retmax=10):
+    """Get a URL for a page of search results on the history server."""
+    return pubmed_api("esearch") + urllib.parse.urlencode({
+        "db": "pubmed",
+        "term": "#{}".format(query_key),
+        "WebEnv": webenv,
+        "usehistory": "y",
+        "retstart": str(retstart),
+        "retmax": str(retmax),
+        "retmode": "json"
+    })
+
+
 def pubmed_fetch_article_url(article):
     """Get a URL to fetch a single PubMed article."""
     return pubmed_api("efetch") + urllib.parse.urlencode({
@@ -40,6 +116,23 @@ def pubmed_fetch_article_url(article):
     })
 
 
+def pubmed_fetch_articles_request(articles):
+    """Get a (url, data) pair to fetch several PubMed articles at once.
+
+    If there are many articles, the ID list is sent as POST data,
+    otherwise data is None and the IDs are in the URL.
+    """
+    query = urllib.parse.urlencode({
+        "db": "pubmed",
+        "id": ",".join([str(a) for a in articles]),
+        "rettype": "xml"
+    })
+    if len(articles) > POST_ID_THRESHOLD:
+        return (pubmed_api("efetch"), query.encode("utf-8"))
+
+    return (pubmed_api("efetch") + query, None)
+
+
 def pubmed_count_articles_url(term):
     """Get a URL to fetch a single PubMed article."""
     return pubmed_api("esearch") + urllib.parse.urlencode({
@@ -50,23 +143,499 @@ def pubmed_count_articles_url(term):
     })
 
 
-def attempt_download(url, retries=0):
-    """Attempt to download the given url, exits after 5 failed attempts."""
-    if retries > 5:
-        sys.stderr.write("Connection failed.")
-        sys.exit(1)
-    try:
-        print(url)
-        with contextlib.closing(urllib.request.urlopen(url)) as response:
-            return response.read().decode("utf-8")
-    except urllib.error.URLError:
-        sys.stderr.write("Connection error.. retrying {}\n".format(retries))
-        return attempt_download(url, retries + 1)
+class RateLimiter(object):
+    """Token bucket which adapts its rate to throttling by the server.
+
+    The rate increases additively on each successful request, up
+    to max_rate, and decreases multiplicatively each time the server
+    throttles us (AIMD).
+    """
+
+    def __init__(self,
+                 max_rate,
+                 min_rate=0.1,
+                 increase=0.1,
+                 decrease=0.5,
+                 clock=time.time,
+                 sleep=time.sleep):
+        """Initialize this RateLimiter, starting at max_rate."""
+        self.max_rate = max_rate
+        self.min_rate = min(min_rate, max_rate)
+        self.rate = max_rate
+        self._increase = increase
+        self._decrease = decrease
+        self._clock = clock
+        self._sleep = sleep
+        self._tokens = 1.0
+        self._last = clock()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a request may be made."""
+        while True:
+            with self._lock:
+                now = self._clock()
+                self._tokens = min(1.0,
+                                   self._tokens + (now - self._last) *
+                                   self.rate)
+                self._last = now
+                if self._tokens >= 1.0:
+                    self._tokens -= 1.0
+                    return
+
+                wait = (1.0 - self._tokens) / self.rate
+
+            self._sleep(wait)
+
+    def succeeded(self):
+        """Record a successful request, increasing the rate."""
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self._increase)
+
+    def throttled(self):
+        """Record a throttled request, decreasing the rate."""
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate * self._decrease)
+
+
+def with_api_key(url, data, api_key):
+    """Add api_key to the query in url, or to data if it is set."""
+    if not api_key:
+        return (url, data)
+
+    key = urllib.parse.urlencode({"api_key": api_key})
+    if data is not None:
+        return (url, data + b"&" + key.encode("utf-8"))
+
+    return (url + "&" + key, data)
+
+
+class DownloadError(Exception):
+    """Exception raised if a URL could not be downloaded."""
+
+    def __init__(self, url, reason):
+        """Initialize this exception with the url and reason for failure."""
+        Exception.__init__(self)
+        self.url = url
+        self.reason = reason
+
+    def __str__(self):
+        """Convert to string."""
+        return "Failed to download {}: {}".format(self.url, self.reason)
+
+
+class ClientStats(object):
+    """Counters for requests made by a HTTPClient."""
+
+    def __init__(self):
+        """Initialize all counters to zero."""
+        self.requests = 0
+        self.retries = 0
+        self.failures = 0
+        self.bytes_received = 0
+        self.bytes_decoded = 0
+        self.latency = 0.0
+        self.max_latency = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, latency, received, decoded):
+        """Record a request which took latency seconds."""
+        with self._lock:
+            self.requests += 1
+            self.bytes_received += received
+            self.bytes_decoded += decoded
+            self.latency += latency
+            self.max_latency = max(self.max_latency, latency)
+
+    def record_retry(self):
+        """Record that a request is being retried."""
+        with self._lock:
+            self.retries += 1
+
+    def record_failure(self):
+        """Record that a request failed for good."""
+        with self._lock:
+            self.failures += 1
+
+    def summary(self):
+        """Get a human readable summary of these counters."""
+        return ("{} requests, {} retries, {} failures, {} bytes received "
+                "({} decoded), {:.3f}s mean latency, {:.3f}s max latency"
+                "".format(self.requests,
+                          self.retries,
+                          self.failures,
+                          self.bytes_received,
+                          self.bytes_decoded,
+                          self.latency / max(self.requests, 1),
+                          self.max_latency))
+
+
+class HTTPClient(object):
+    """HTTP client which keeps connections alive and retries with backoff.
+
+    Each thread keeps one persistent connection per host. Responses are
+    requested with gzip compression. Failed requests are retried with
+    exponential backoff and jitter, and a DownloadError is raised if
+    all retries fail. If limiter is set, it is used to pace requests
+    and told about throttling.
+    """
+
+    def __init__(self,
+                 retries=5,
+                 timeout=30.0,
+                 backoff=1.0,
+                 max_backoff=60.0,
+                 limiter=None,
+                 api_key=None,
+                 sleep=time.sleep):
+        """Initialize this HTTPClient."""
+        self.retries = retries
+        self.timeout = timeout
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.limiter = limiter
+        self.api_key = api_key
+        self.stats = ClientStats()
+        self._sleep = sleep
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+
+    def _pool(self):
+        """Get the connections for the current thread, keyed by host."""
+        try:
+            return self._local.pool
+        except AttributeError:
+            self._local.pool = dict()
+            return self._local.pool
+
+    def _connection(self, scheme, host):
+        """Get a persistent connection to host for the current thread."""
+        pool = self._pool()
+        if (scheme, host) not in pool:
+            connection_class = (http_client.HTTPSConnection
+                                if scheme == "https"
+                                else http_client.HTTPConnection)
+            connection = connection_class(host, timeout=self.timeout)
+            pool[(scheme, host)] = connection
+            with self._lock:
+                self._connections.append(connection)
+
+        return pool[(scheme, host)]
+
+    def _drop_connection(self, scheme, host):
+        """Close the current thread's connection to host."""
+        connection = self._pool().pop((scheme, host), None)
+        if connection is not None:
+            connection.close()
+
+    def _request_once(self, url, data):
+        """Make a single request, returning (status, response, body)."""
+        parsed = urllib.parse.urlparse(url)
+        path = parsed.path + ("?" + parsed.query if parsed.query else "")
+        headers = {"Accept-Encoding": "gzip"}
+        if data is not None:
+            headers["Content-Type"] = "application/x-www-form-urlencoded"
+
+        connection = self._connection(parsed.scheme, parsed.netloc)
+        started = time.time()
+        try:
+            connection.request("POST" if data is not None else "GET",
+                               path,
+                               body=data,
+                               headers=headers)
+            response = connection.getresponse()
+            body = response.read()
+        except (socket.error, http_client.HTTPException):
+            self._drop_connection(parsed.scheme, parsed.netloc)
+            raise
+
+        received = len(body)
+        if response.getheader("Content-Encoding", "") == "gzip":
+            body = zlib.decompress(body, 16 + zlib.MAX_WBITS)
+
+        self.stats.record(time.time() - started, received, len(body))
+        return (response.status, response, body)
+
+    def _request(self, url, data):
+        """Make a request, returning (status, retry_after, body).
+
+        Redirects are followed, so the status is that of the last
+        response.
+        """
+        for _ in range(MAX_REDIRECTS + 1):
+            status, response, body = self._request_once(url, data)
+            location = response.getheader("Location")
+            if status not in REDIRECT_STATUS_CODES or not location:
+                break
 
+            url = urllib.parse.urljoin(url, location)
+            if status == 303:
+                data = None
 
-def attempt_download_json(url):
+        return (status, response.getheader("Retry-After"), body)
+
+    def _backoff(self, attempt, retry_after):
+        """Sleep before retrying a request for the attempt'th time."""
+        self.stats.record_retry()
+        delay = random.uniform(0, min(self.max_backoff,
+                                      self.backoff * (2 ** attempt)))
+        try:
+            delay = max(delay, float(retry_after))
+        except (TypeError, ValueError):
+            pass
+
+        self._sleep(delay)
+
+    def download(self, url, data=None):
+        """Download the given url, returning its body as text.
+
+        If data is set, it is sent as the body of a POST request.
+        """
+        request_url, request_data = with_api_key(url, data, self.api_key)
+        for attempt in range(self.retries + 1):
+            if self.limiter:
+                self.limiter.acquire()
+            try:
+                status, retry_after, body = self._request(request_url,
+                                                          request_data)
+            except (socket.error,
+                    http_client.HTTPException,
+                    zlib.error) as error:
+                reason = str(error) or type(error).__name__
+                status, retry_after = (None, None)
+            else:
+                if status == 200:
+                    if self.limiter:
+                        self.limiter.succeeded()
+                    return body.decode("utf-8")
+
+                reason = "HTTP status {}".format(status)
+                if status in THROTTLE_STATUS_CODES:
+                    if self.limiter:
+                        self.limiter.throttled()
+                else:
+                    self.stats.record_failure()
+                    raise DownloadError(url, reason)
+
+            if attempt < self.retries:
+                sys.stderr.write("Connection error ({}).. retrying {}\n"
+                                 "".format(reason, attempt))
+                self._backoff(attempt, retry_after)
+
+        self.stats.record_failure()
+        raise DownloadError(url, reason)
+
+    def close(self):
+        """Close all connections made by this HTTPClient."""
+        with self._lock:
+            for connection in self._connections:
+                connection.close()
+            self._connections = []
+
+
+def attempt_download(url, data=None, client=None):
+    """Attempt to download the given url, raising DownloadError on failure.
+
+    If client is not set, a new HTTPClient is used for this request.
+    """
+    return (client or HTTPClient()).download(url, data)
+
+
+def attempt_download_json(url, fetch=attempt_download):
     """Attempt to download the given url, returning JSON."""
-    return json.loads(attempt_download(url))
+    return json.loads(fetch(url))
+
+
+def run_jobs(function, items, jobs):
+    """Call function on each of items using a pool of jobs threads.
+
+    Items are consumed lazily. If any call raises an exception, no more
+    items are started and the exception is re-raised once all threads
+    have stopped.
+    """
+    if jobs <= 1:
+        for item in items:
+            function(item)
+        return
+
+    pending = queue.Queue(maxsize=jobs * 2)
+    errors = []
+    stop = threading.Event()
+
+    def _worker():
+        """Run function on items from the queue until told to stop."""
+        while True:
+            item = pending.get()
+            if item is stop:
+                return
+            if stop.is_set():
+                continue
+            try:
+                function(item)
+            except BaseException as error:  # suppress(blind-except)
+                errors.append(error)
+                stop.set()
+
+    threads = [threading.Thread(target=_worker) for _ in range(jobs)]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+
+    try:
+        for item in items:
+            if stop.is_set():
+                break
+            pending.put(item)
+    finally:
+        for _ in threads:
+            pending.put(stop)
+        for thread in threads:
+            thread.join()
+
+    if errors:
+        raise errors[0]
+
+
+def search_article_ids(term,
+                       page_size,
+                       limit=None,
+                       fetch=attempt_download,
+                       mindate=None,
+                       maxdate=None):
+    """Yield the ID of each article matching term, one page at a time.
+
+    The search is stored on the E-utilities history server and then
+    paged through, so that IDs can be consumed before the search is done.
+    If limit is set, at most that many IDs are yielded. If mindate is
+    set, only articles modified between mindate and maxdate are yielded.
+    """
+    url = pubmed_search_history_url(term, page_size, mindate, maxdate)
+    result = attempt_download_json(url, fetch)["esearchresult"]
+    count = int(result["count"])
+    if limit:
+        count = min(count, limit)
+
+    webenv = result["webenv"]
+    query_key = result["querykey"]
+    retstart = 0
+    id_list = result["idlist"]
+
+    while id_list and retstart < count:
+        for article_id in id_list[:count - retstart]:
+            yield article_id
+
+        retstart += len(id_list)
+        if retstart >= count:
+            return
+
+        id_list = attempt_download_json(
+            pubmed_search_history_page_url(webenv,
+                                           query_key,
+                                           retstart,
+                                           page_size),
+            fetch
+        )["esearchresult"]["idlist"]
+
+
+def article_pmid(article):
+    """Get the PMID of a PubmedArticle or PubmedBookArticle element."""
+    for path in ("MedlineCitation/PMID", "BookDocument/PMID"):
+        pmid = article.find(path)
+        if pmid is not None:
+            return pmid.text.strip()
+
+    return None
+
+
+def split_article_set(data):
+    """Split a PubmedArticleSet document into single article documents.
+
+    Yields a (pmid, document) tuple for each article in the set, where
+    document is a PubmedArticleSet containing only that article, encoded
+    as UTF-8 bytes. This is the same shape as the response to an efetch
+    request for a single article.
+    """
+    root = ET.fromstring(data.encode("utf-8"))
+    for article in list(root):
+        pmid = article_pmid(article)
+        if pmid is None:
+            continue
+
+        yield (pmid, b"".join([ARTICLE_SET_HEADER,
+                               ET.tostring(article, encoding="utf-8"),
+                               ARTICLE_SET_FOOTER]))
+
+
+def chunks(iterable, size):
+    """Split iterable into lists of at most size elements."""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+
+        yield chunk
+
+
+def download_article(store, article_id, fetch=attempt_download):
+    """Download a single article into store."""
+    downloadurl = pubmed_fetch_article_url(article_id)
+    print("Downloading article " + article_id)
+    data = fetch(downloadurl)
+    store.write(article_id, data.encode("utf-8"))
+
+
+def download_article_batch(store, article_ids, fetch=attempt_download):
+    """Download several articles with one request into store.
+
+    Returns a sorted list of the IDs of articles missing from the
+    response.
+    """
+    url, data = pubmed_fetch_articles_request(article_ids)
+    print("Downloading {} articles".format(len(article_ids)))
+    remaining = set(article_ids)
+    for pmid, document in split_article_set(fetch(url, data=data)):
+        store.write(pmid, document)
+        remaining.discard(pmid)
+
+    missing = sorted(remaining)
+    for article_id in missing:
+        sys.stderr.write("Article {} missing from response\n".format(
+            article_id
+        ))
+
+    return missing
+
+
+def pubmed_date(value):
+    """Convert YYYY-MM-DD or YYYY/MM/DD to an E-utilities date."""
+    for date_format in ("%Y-%m-%d", PUBMED_DATE_FORMAT):
+        try:
+            return datetime.strptime(value,
+                                     date_format).strftime(PUBMED_DATE_FORMAT)
+        except ValueError:
+            continue
+
+    raise argparse.ArgumentTypeError("{} is not a date".format(value))
+
+
+def read_last_sync(location):
+    """Read the date of the last sync into location, or None."""
+    try:
+        with open(os.path.join(location, LAST_SYNC_FILE), "r") as sync_file:
+            return pubmed_date(sync_file.read().strip())
+    except IOError as error:
+        if error.errno != errno.ENOENT:
+            raise error
+
+    return None
+
+
+def write_last_sync(location, sync_date):
+    """Record sync_date as the date of the last sync into location."""
+    with open(os.path.join(location, LAST_SYNC_FILE), "w") as sync_file:
+        sync_file.write(sync_date + "\n")
 
 
 def main(argv=None):
@@ -83,35 +652,143 @@ def main(argv=None):
                         type=int,
                         metavar="COUNT",
                         help="How many articles to download (default is all)")
+    parser.add_argument("--batch-size",
+                        type=int,
+                        default=1,
+                        metavar="N",
+                        help="How many articles to fetch per request")
+    parser.add_argument("--page-size",
+                        type=int,
+                        default=5000,
+                        metavar="N",
+                        help="How many article IDs to get per search request")
+    parser.add_argument("--jobs",
+                        type=int,
+                        default=1,
+                        metavar="JOBS",
+                        help="How many requests to make concurrently")
+    parser.add_argument("--rate",
+                        type=float,
+                        metavar="RATE",
+                        help="Maximum requests per second (default is {} "
+                             "or {} with an API key)".format(
+                                 DEFAULT_RATE,
+                                 DEFAULT_API_KEY_RATE
+                             ))
+    parser.add_argument("--api-key",
+                        type=str,
+                        default=os.environ.get("NCBI_API_KEY", None),
+                        metavar="KEY",
+                        help="NCBI API key (default is $NCBI_API_KEY)")
+    parser.add_argument("--since",
+                        type=pubmed_date,
+                        metavar="DATE",
+                        help="Only download articles added or revised "
+                             "since DATE (YYYY-MM-DD), replacing any "
+                             "existing copies")
+    parser.add_argument("--sync",
+                        action="store_true",
+                        help="Only download articles added or revised "
+                             "since the last --sync, then record today "
+                             "as the last sync")
+    parser.add_argument("--store",
+                        choices=("directory", "pack"),
+                        help="Store articles as one XML file each, or "
+                             "append them to a pack file (default is pack "
+                             "if DIR already has one)")
+    instrument.add_arguments(parser)
     result = parser.parse_args(argv)
 
-    article_count = result.article_count
-    if not article_count:
-        article_count_data = attempt_download_json(
-            pubmed_count_articles_url("Retracted+Publications")
-        )
-        article_count = article_count_data["esearchresult"]["count"]
+    with instrument.instrumented("download-pubmed-articles",
+                                 result) as metrics:
+        download_articles(result, metrics)
+
+
+def download_articles(result, metrics):
+    """Download articles as set by the parsed arguments in result."""
+    limiter = RateLimiter(result.rate or (DEFAULT_API_KEY_RATE
+                                          if result.api_key
+                                          else DEFAULT_RATE))
+    client = HTTPClient(limiter=limiter, api_key=result.api_key)
+    fetch = client.download
+
+    # Take the date before searching, so that articles revised during
+    # this run are picked up again by the next one.
+    today = date.today().strftime(PUBMED_DATE_FORMAT)
+    mindate = result.since
+    if result.sync and not mindate:
+        mindate = read_last_sync(result.location)
 
-    id_list_data = attempt_download_json(
-        pubmed_search_for_articles_url("Retracted+Publications",
-                                       retmax=article_count)
+    id_list = metrics.timed("search",
+                            search_article_ids("Retracted+Publications",
+                                               result.page_size,
+                                               limit=result.article_count,
+                                               fetch=fetch,
+                                               mindate=mindate,
+                                               maxdate=(today if mindate
+                                                        else None)))
+
+    ensure_directory(result.location)
+    store = open_store(result.location, result.store)
+
+    # This is a generator, so that downloads can start while we
+    # are still paging through search results. Articles we already
+    # have are only downloaded again if they were revised since mindate.
+    pending = (
+        article_id for article_id in id_list
+        if mindate or article_id not in store
     )
-    id_list = id_list_data["esearchresult"]["idlist"]
+
+    failed = []
+
+    def _download(download, articles):
+        """Download articles, recording the ones which were not."""
+        article_ids = articles if result.batch_size > 1 else [articles]
+        try:
+            missing = download(store, articles, fetch=fetch) or []
+        except DownloadError as error:
+            sys.stderr.write("{}\n".format(error))
+            failed.extend(article_ids)
+            return
+
+        metrics.count("articles", len(article_ids) - len(missing))
+        failed.extend(missing)
 
     try:
-        os.makedirs(result.location)
-    except OSError as error:
-        if error.errno != errno.EEXIST:
-            raise error
+        # Searching is interleaved with downloading, so this includes
+        # the search stage.
+        with metrics.stage("download"):
+            if result.batch_size > 1:
+                run_jobs(functools.partial(_download,
+                                           download_article_batch),
+                         chunks(pending, result.batch_size),
+                         result.jobs)
+            else:
+                run_jobs(functools.partial(_download, download_article),
+                         pending,
+                         result.jobs)
+    finally:
+        store.close()
+        client.close()
+        metrics.merge({
+            "requests": client.stats.requests,
+            "retries": client.stats.retries,
+            "failures": client.stats.failures,
+            "bytes": client.stats.bytes_received,
+            "bytes_decoded": client.stats.bytes_decoded
+        })
+        sys.stderr.write("Downloader: {}\n".format(client.stats.summary()))
+
+    if failed:
+        # Don't record the sync, so that failed articles are
+        # picked up again by the next one.
+        sys.stderr.write("Failed to download {} articles\n".format(
+            len(failed)
+        ))
+        sys.exit(1)
 
-    for article_id in id_list:
-        out_name = os.path.join(result.location, article_id + ".xml")
-        if not os.path.isfile(out_name):
-            downloadurl = pubmed_fetch_article_url(article_id)
-            print("Downloading article " + article_id)
-            data = attempt_download(downloadurl)
-            with open(out_name, "wb") as out_file:
-                out_file.write(data.encode("utf-8"))
+    if result.sync:
+        write_last_sync(result.location, today)
 
 if __name__ == "__main__":
     main(sys.argv[1:])
@@ -8,11 +8,14 @@
 import argparse
 from contextlib import contextmanager
 import errno
-from datetime import datetime
 import itertools
 import json
 import sys
 
+from importer import instrument
+from importer.ndjson import read_records
+from importer.record import ArticleRecord, date_year
+
 
 FIELDS_TO_SAMPLE = [
     "reviseDate",
@@ -24,15 +27,13 @@ FIELDS_TO_SAMPLE = [
 
 
 def determine_year_range(data):
-    """Given an array of PubMed retraction data, determine the year range."""
-    dates = [
-        datetime.strptime(a["date"], "%Y-%m-%d")
-        for a in [d.get("pubDate", None) for d in data]
-        if a is not None
+    """Given ArticleRecords of retraction data, determine the year range."""
+    years = [
+        date_year(d.pub_date) for d in data if d.pub_date is not None
     ]
 
     # I guess O(2N) is probably better than having to sort the list
-    return (min(dates).year, max(dates).year)
+    return (min(years), max(years))
 
 
 def allowable_fields(fields, year_range):
@@ -51,25 +52,36 @@ def allowable_fields(fields, year_range):
 
 
 def sample_fields(fields, year_range, data):
-    """Determine a representative sample of data."""
+    """Determine a representative sample of ArticleRecords in data."""
     cartesian_product = allowable_fields(fields, year_range)
     sampled_data = {
         k: None for k in cartesian_product
     }
 
     for entry in data:
-        found_fields = tuple(sorted(k for k in entry.keys() if k != "pmid"))
-        pub_date = entry.get("pubDate", None) or {
-            "date": datetime.strptime("2016", "%Y").strftime("%Y-%m-%d")
-        }
-        publication_year = datetime.strptime(pub_date["date"],
-                                             "%Y-%m-%d").year
+        # Only fields which are being sampled are considered, so that
+        # records with other fields can still be sampled.
+        found_fields = tuple(sorted(f for f in entry.fields()
+                                    if f in fields))
+        publication_year = (date_year(entry.pub_date)
+                            if entry.pub_date is not None else 2016)
         if not sampled_data[(found_fields, publication_year)]:
             sampled_data[(found_fields, publication_year)] = entry
 
     return [v for v in sampled_data.values() if v is not None]
 
 
+def present_fields_json(record):
+    """Convert record into its JSON form, leaving out fields without values.
+
+    The pmid is always kept.
+    """
+    return {
+        k: v for k, v in record.to_json().items()
+        if v is not None or k == "pmid"
+    }
+
+
 @contextmanager
 def open_or_stdin(path):
     """Open path or yield the stdin."""
@@ -88,17 +100,27 @@ def main(argv=None):
     parser = argparse.ArgumentParser(description="Generate representative "
                                                  "sample of data")
     parser.add_argument("file",
-                        help="File to read",
+                        help="File to read, a JSON array or NDJSON",
                         nargs="?",
                         type=str,
                         metavar="FILE")
+    instrument.add_arguments(parser)
     parse_result = parser.parse_args(argv or sys.argv[1:])
 
-    with open_or_stdin(parse_result.file) as fileobj:
-        data = json.load(fileobj)
-        print(json.dumps(sample_fields(FIELDS_TO_SAMPLE,
-                                       determine_year_range(data),
-                                       data)))
+    with instrument.instrumented("generate-representative-pubmed-sample",
+                                 parse_result) as metrics:
+        with open_or_stdin(parse_result.file) as fileobj:
+            data = list(metrics.timed("read", (
+                ArticleRecord.from_json(r) for r in read_records(fileobj)
+            ), "articles"))
+
+        with metrics.stage("sample"):
+            sample = sample_fields(FIELDS_TO_SAMPLE,
+                                   determine_year_range(data),
+                                   data)
+
+        metrics.count("samples", len(sample))
+        print(json.dumps([present_fields_json(r) for r in sample]))
 
 
 if __name__ == "__main__":
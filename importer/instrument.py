@@ -0,0 +1,278 @@
+# /importer/instrument.py
+#
+# Stage timers, counters and profiling for the console scripts.
+#
+# See /LICENCE.md for Copyright information
+"""Stage timers, counters and profiling for the console scripts.
+
+Each console script runs inside instrumented(), which makes a Metrics
+object active for the run. Code anywhere in the importer can then call
+count() without being passed the Metrics. At exit, the metrics can be
+written to a JSON file or a Prometheus textfile, and a cProfile of the
+run can be dumped.
+"""
+
+from contextlib import contextmanager
+import cProfile
+import json
+import os
+import re
+import sys
+import threading
+import time
+import timeit
+
+
+PROMETHEUS_PREFIX = "pubmed_importer"
+
+
+class Metrics(object):
+    """Stage timers and counters for one run of a command.
+
+    Stages are timed in seconds, and the time spent in a stage entered
+    more than once is added up. Counting is thread safe.
+    """
+
+    def __init__(self, command, clock=timeit.default_timer):
+        """Initialize this Metrics for command."""
+        self.command = command
+        self.started = time.time()
+        self.stages = dict()
+        self.counters = dict()
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def count(self, name, amount=1):
+        """Add amount to the counter called name."""
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def merge(self, counters):
+        """Add each counter in the dict counters to this Metrics."""
+        for name, amount in counters.items():
+            self.count(name, amount)
+
+    def add_time(self, name, seconds):
+        """Add seconds to the time spent in the stage called name."""
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    @contextmanager
+    def stage(self, name):
+        """Time the body of this context as the stage called name."""
+        start = self._clock()
+        try:
+            yield
+        finally:
+            self.add_time(name, self._clock() - start)
+
+    def timed(self, name, iterable, counter=None):
+        """Yield each item in iterable, timing how long each takes.
+
+        This is used to time lazy stages, which only do their work as
+        their items are consumed by the next stage. Time spent in timed
+        stages which iterable itself consumes is not included, so each
+        stage of a pipeline of generators is timed separately. If
+        counter is set, the counter with that name counts the items.
+        """
+        iterator = iter(iterable)
+        while True:
+            # Time spent in nested timed stages is added to
+            # self._local.nested while the item is being produced.
+            outer_nested = getattr(self._local, "nested", 0.0)
+            self._local.nested = 0.0
+            start = self._clock()
+            try:
+                item = next(iterator)
+                done = False
+            except StopIteration:
+                done = True
+            finally:
+                elapsed = self._clock() - start
+                self.add_time(name, elapsed - self._local.nested)
+                self._local.nested = outer_nested + elapsed
+
+            if done:
+                return
+
+            if counter is not None:
+                self.count(counter)
+            yield item
+
+    def to_json(self):
+        """Get these metrics as a JSON object."""
+        with self._lock:
+            return {
+                "command": self.command,
+                "started": self.started,
+                "stages": dict(self.stages),
+                "counters": dict(self.counters)
+            }
+
+    def to_prometheus(self):
+        """Get these metrics in the Prometheus text exposition format."""
+        metrics = self.to_json()
+        label = "command=\"{}\"".format(self.command)
+        lines = [
+            "# TYPE {}_last_run_timestamp_seconds gauge".format(
+                PROMETHEUS_PREFIX
+            ),
+            "{}_last_run_timestamp_seconds{{{}}} {}".format(
+                PROMETHEUS_PREFIX,
+                label,
+                metrics["started"]
+            ),
+            "# TYPE {}_stage_seconds gauge".format(PROMETHEUS_PREFIX)
+        ]
+        lines.extend(
+            "{}_stage_seconds{{{},stage=\"{}\"}} {}".format(
+                PROMETHEUS_PREFIX,
+                label,
+                stage,
+                seconds
+            )
+            for stage, seconds in sorted(metrics["stages"].items())
+        )
+        for name, value in sorted(metrics["counters"].items()):
+            metric = "{}_{}_total".format(PROMETHEUS_PREFIX,
+                                          re.sub(r"[^a-zA-Z0-9_]", "_", name))
+            lines.append("# TYPE {} counter".format(metric))
+            lines.append("{}{{{}}} {}".format(metric, label, value))
+
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """Write these metrics to path.
+
+        Files ending in .prom are written in the Prometheus textfile
+        format, and anything else as JSON. The file is replaced in one
+        step, so that collectors never read a partly written file.
+        """
+        if path.endswith(".prom"):
+            text = self.to_prometheus()
+        else:
+            text = json.dumps(self.to_json(), indent=2, sort_keys=True)
+
+        temporary = path + ".tmp"
+        with open(temporary, "w") as metrics_file:
+            metrics_file.write(text)
+        os.rename(temporary, path)
+
+
+class Progress(object):
+    """Report progress through a stage at most every interval seconds."""
+
+    def __init__(self,
+                 label,
+                 total=None,
+                 interval=5.0,
+                 stream=None,
+                 clock=timeit.default_timer):
+        """Initialize this Progress for label, out of total if known."""
+        self.label = label
+        self.total = total
+        self.done = 0
+        self._interval = interval
+        self._stream = stream
+        self._clock = clock
+        self._started = clock()
+        self._reported = self._started
+
+    def _report(self, now):
+        """Write the progress so far."""
+        elapsed = now - self._started
+        (self._stream or sys.stderr).write("{}: {}{} ({:.1f}/s)\n".format(
+            self.label,
+            self.done,
+            " of {}".format(self.total) if self.total is not None else "",
+            self.done / elapsed if elapsed > 0 else 0.0
+        ))
+        self._reported = now
+
+    def update(self, amount=1):
+        """Add amount to the progress, reporting it if it is time to."""
+        self.done += amount
+        now = self._clock()
+        if now - self._reported >= self._interval:
+            self._report(now)
+
+    def finish(self):
+        """Report the final progress."""
+        self._report(self._clock())
+
+
+# The Metrics for the current run, which count() adds to.
+_ACTIVE = Metrics(None)
+
+
+def active():
+    """Get the Metrics for the current run."""
+    return _ACTIVE
+
+
+def activate(metrics):
+    """Make metrics the Metrics for the current run, returning the old."""
+    global _ACTIVE
+    previous = _ACTIVE
+    _ACTIVE = metrics
+    return previous
+
+
+def count(name, amount=1):
+    """Add amount to the counter called name for the current run."""
+    _ACTIVE.count(name, amount)
+
+
+def collect_counters(function, *args):
+    """Call function with args, returning (result, counters).
+
+    This is used to run function in a worker process, returning what it
+    counted so that the parent process can merge it.
+    """
+    metrics = Metrics(None)
+    previous = activate(metrics)
+    try:
+        return (function(*args), metrics.counters)
+    finally:
+        activate(previous)
+
+
+def add_arguments(parser):
+    """Add the --profile and --metrics-file arguments to parser."""
+    parser.add_argument("--profile",
+                        metavar="FILE",
+                        help="Write cProfile stats for this process to "
+                             "FILE, which can be read with pstats")
+    parser.add_argument("--metrics-file",
+                        metavar="FILE",
+                        help="Write stage times and counters to FILE at "
+                             "exit, as a Prometheus textfile if it ends in "
+                             ".prom, otherwise as JSON")
+
+
+@contextmanager
+def instrumented(command, parse_result):
+    """Instrument the body of this context as a run of command.
+
+    parse_result is the result of parsing the arguments added by
+    add_arguments. The Metrics for the run are yielded, and the whole
+    run is timed as the "total" stage.
+    """
+    metrics = Metrics(command)
+    previous = activate(metrics)
+    profile = cProfile.Profile() if parse_result.profile else None
+    if profile is not None:
+        profile.enable()
+
+    try:
+        with metrics.stage("total"):
+            yield metrics
+    finally:
+        if profile is not None:
+            profile.disable()
+            profile.dump_stats(parse_result.profile)
+
+        activate(previous)
+        if parse_result.metrics_file:
+            metrics.write(parse_result.metrics_file)
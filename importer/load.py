@@ -6,48 +6,68 @@
 """Import article data from JSON into a Neo4j database."""
 
 import argparse
+import collections
 from contextlib import contextmanager
-from datetime import datetime
-import json
+import itertools
 import os
+import random
 import sys
+import threading
+import time
+import uuid
+import zlib
+
+from importer import instrument
+from importer.charts import SUMMARY_LABEL, write_chart_summaries
+from importer.csvexport import export_csv
+from importer.ndjson import read_records, write_records
+from importer.record import as_article_record, unpack_date
+from importer.snapshot import LoadSnapshot, SNAPSHOT_FILE
+from importer.sqlitesink import SQLiteSink
 
 from neo4j.v1 import GraphDatabase, basic_auth
+from neo4j.v1.exceptions import CypherError
+
+from six.moves import queue
 
 
 def generate_command_for_record(record):
-    """For a particular record, generate a database command."""
+    """For a particular record, generate a database command.
+
+    :record: is an ArticleRecord, or its JSON form.
+    """
+    record = as_article_record(record)
     # Assuming always has a pmid value to be valid article
-    if "pmid" in record:
+    if record.pmid is not None:
         commands = []
         commands.append(u"MERGE (article:Article "
-                        "{{title:'{0}'}})".format(record["pmid"]))
-        if record.get("ISSN", None):
+                        "{{title:'{0}'}})".format(record.pmid))
+        if record.issn:
             commands.append(u"SET article.ISSN = '{0}'"
-                            .format(record["ISSN"]))
-        if record.get("Author", None):
+                            .format(record.issn))
+        if record.authors:
             count = 0
-            for author in record.get("Author"):
+            for author in record.authors:
                 commands.append(u"MERGE (author{0}:Author {{name:\""
                                 "{1}\"}}) MERGE (article)-"
                                 "[:AUTHORED_BY]->(author{0})"
                                 .format(count, author))
                 count += 1
-        if record.get("country", None):
+        if record.country:
             commands.append(u"MERGE (country:Country {{name:"
                             "'{0}'}}) MERGE (article)"
                             "-[:ORIGINATED_IN]->(country)"
-                            .format(record["country"]))
-        if record.get("Topic", None):
+                            .format(record.country))
+        if record.topics:
             count = 0
-            for topic in record.get("Topic"):
+            for topic in record.topics:
                 commands.append(u"MERGE (topic{0}:Topic {{name:\""
                                 "{1}\"}}) MERGE (article)"
                                 "-[:DISCUSSES]->(topic{0})"
                                 .format(count, topic))
                 count += 1
-        if record.get("pubDate", None):
-            date = datetime.strptime(record["pubDate"]["date"], "%Y-%m-%d")
+        if record.pub_date is not None:
+            date = unpack_date(record.pub_date)
             year = str(date.year)
             month = date.strftime("%B")
             commands.append(u"MERGE (month:Month {{name:'{0}'}}) "
@@ -64,17 +84,293 @@ def generate_command_for_record(record):
 
 @contextmanager
 def open_or_default(path, default):
-    """A context with either path as an open file, or some default."""
+    """A context with either path as an open file, or some default.
+
+    Only failing to open path is caught, so that errors raised while
+    using the file are not mistaken for it.
+    """
     try:
-        with open(path or "", "r") as fileobj:
-            yield fileobj
+        fileobj = open(path or "", "r")
     except IOError:
         yield default
+        return
+
+    with fileobj:
+        yield fileobj
+
+
+# Deletes the whole graph in one transaction. This is only used by the
+# statements printed by --no-execute, since a large graph is reset in
+# batches by RESET_STATEMENTS instead, and only with --reset.
+RESET_STATEMENT = "MATCH (n) OPTIONAL MATCH (n)-[r]-() DELETE n, r"
+
+# Statements which delete up to {limit} relationships, then up to
+# {limit} nodes once no relationships are left, so that each
+# transaction only holds a bounded number of deletions and locks.
+RESET_STATEMENTS = (("relationships",
+                     "MATCH ()-[r]->() WITH r LIMIT {limit} DELETE r "
+                     "RETURN count(r) AS deleted"),
+                    ("nodes",
+                     "MATCH (n) WITH n LIMIT {limit} DELETE n "
+                     "RETURN count(n) AS deleted"))
+
+# How many relationships or nodes to delete per transaction when
+# resetting the graph.
+RESET_BATCH_SIZE = 10000
+
+# Parameters use the {name} syntax, which both Neo4j 2.x and 3.x
+# understand. Each statement is planned once, then reused for every
+# batch of rows.
+ARTICLE_STATEMENT = (u"UNWIND {rows} AS row "
+                     "MERGE (article:Article {title: row.pmid}) "
+                     "SET article.ISSN = coalesce(row.ISSN, article.ISSN)")
+
+# Changed articles are merged with their new ISSN, after removing their
+# relationships, so that they are related to the same nodes as if the
+# graph had been reset.
+UPSERT_ARTICLE_STATEMENT = (u"UNWIND {rows} AS row "
+                            "MERGE (article:Article {title: row.pmid}) "
+                            "SET article.ISSN = row.ISSN")
+
+# A full load replaces each article like an incremental one does, and
+# stamps it with the id of the load. Only once the whole input has been
+# read are the articles without that id deleted, so that input which
+# stops part of the way through never leaves the graph half empty.
+REPLACE_ARTICLE_STATEMENT = (u"UNWIND {rows} AS row "
+                             "MERGE (article:Article {title: row.pmid}) "
+                             "SET article.ISSN = row.ISSN, "
+                             "article.loadId = {loadId}")
+
+DELETE_STALE_ARTICLES_STATEMENT = (u"MATCH (article:Article) "
+                                   "WHERE article.loadId IS NULL "
+                                   "OR article.loadId <> {loadId} "
+                                   "WITH article LIMIT {limit} "
+                                   "OPTIONAL MATCH (article)-[r]-() "
+                                   "DELETE article, r "
+                                   "RETURN count(DISTINCT article) "
+                                   "AS deleted")
+
+COUNT_ARTICLES_STATEMENT = (u"MATCH (article:Article) "
+                            "RETURN count(article) AS articles")
+
+REMOVE_RELATIONSHIPS_STATEMENT = (u"UNWIND {pmids} AS pmid "
+                                  "MATCH (article:Article {title: pmid})"
+                                  "-[r]->() DELETE r")
+
+DELETE_ARTICLES_STATEMENT = (u"UNWIND {pmids} AS pmid "
+                             "MATCH (article:Article {title: pmid}) "
+                             "OPTIONAL MATCH (article)-[r]-() "
+                             "DELETE article, r")
+
+# The key of the rows for each kind of node articles are related to,
+# with its label and the type of the relationship.
+RELATIONSHIPS = (("authors", "Author", "AUTHORED_BY"),
+                 ("countries", "Country", "ORIGINATED_IN"),
+                 ("topics", "Topic", "DISCUSSES"),
+                 ("months", "Month", "PUBLISHED_IN"),
+                 ("years", "Year", "PUBLISHED_IN"))
+
+# Statements which relate articles to other nodes, by the key of their
+# rows. Each row has the article's pmid and the name of the other node.
+RELATIONSHIP_STATEMENTS = tuple(
+    (key, (u"UNWIND {{rows}} AS row "
+           "MATCH (article:Article {{title: row.pmid}}) "
+           "MERGE (node:{0} {{name: row.name}}) "
+           "MERGE (article)-[:{1}]->(node)").format(label, relationship))
+    for key, label, relationship in RELATIONSHIPS
+)
+RELATIONSHIP_KEYS = {statement: key
+                     for key, statement in RELATIONSHIP_STATEMENTS}
+
+# Statements which create the nodes of each kind articles are related
+# to, by the key of their rows.
+DIMENSION_STATEMENTS = {
+    key: (u"UNWIND {{names}} AS name "
+          "MERGE (node:{0} {{name: name}})").format(label)
+    for key, label, _ in RELATIONSHIPS
+}
+
+# The label of each kind of node, and the property MERGE matches it on.
+NODE_KEYS = (("Article", "title"),
+             ("Author", "name"),
+             ("Country", "name"),
+             ("Topic", "name"),
+             ("Month", "name"),
+             ("Year", "name"))
+
+# A uniqueness constraint is backed by an index, so MERGE looks nodes up
+# by their key instead of scanning every node with the label. Creating
+# a constraint which already exists does nothing.
+SCHEMA_STATEMENTS = tuple(
+    u"CREATE CONSTRAINT ON (node:{0}) ASSERT node.{1} IS UNIQUE".format(
+        label,
+        key
+    )
+    for label, key in NODE_KEYS + ((SUMMARY_LABEL, "key"),)
+)
+
+# Statements which delete up to {limit} nodes of each label which
+# articles are related to, once no article is related to them.
+DELETE_ORPHANS_STATEMENTS = tuple(
+    (u"MATCH (node:{0}) WHERE NOT (node)--() "
+     "WITH node LIMIT {{limit}} DELETE node "
+     "RETURN count(node) AS deleted").format(label)
+    for label, _ in NODE_KEYS[1:]
+)
+
+DEFAULT_BATCH_SIZE = 1000
+
+
+def rows_for_records(records):
+    """Get a dict of the rows for each statement for records.
+
+    Records without a pmid are skipped.
+    """
+    rows = {key: [] for key, _ in RELATIONSHIP_STATEMENTS}
+    rows["articles"] = []
+    for record in records:
+        record = as_article_record(record)
+        pmid = record.pmid
+        if pmid is None:
+            continue
+
+        rows["articles"].append({"pmid": pmid, "ISSN": record.issn or None})
+        rows["authors"].extend({"pmid": pmid, "name": author}
+                               for author in record.authors or ())
+        if record.country:
+            rows["countries"].append({"pmid": pmid, "name": record.country})
+        rows["topics"].extend({"pmid": pmid, "name": topic}
+                              for topic in record.topics or ())
+        if record.pub_date is not None:
+            date = unpack_date(record.pub_date)
+            rows["months"].append({"pmid": pmid,
+                                   "name": date.strftime("%B")})
+            rows["years"].append({"pmid": pmid, "name": str(date.year)})
+
+    # Relating an article to a node locks both of them. Sorting the
+    # rows means that concurrent transactions lock nodes in the same
+    # order, so they wait for each other instead of deadlocking.
+    rows["articles"].sort(key=lambda row: row["pmid"])
+    for key, _ in RELATIONSHIP_STATEMENTS:
+        rows[key].sort(key=lambda row: (row["name"], row["pmid"]))
+
+    return rows
+
+
+def statements_for_batch(records, article_statement=ARTICLE_STATEMENT):
+    """Yield (statement, parameters) tuples loading the batch records."""
+    rows = rows_for_records(records)
+    if not rows["articles"]:
+        return
+
+    # Articles are merged first, so that relationships can match them.
+    yield (article_statement, {"rows": rows["articles"]})
+    for key, statement in RELATIONSHIP_STATEMENTS:
+        if rows[key]:
+            yield (statement, {"rows": rows[key]})
+
+
+def statements_for_changed_batch(records,
+                                 article_statement=UPSERT_ARTICLE_STATEMENT):
+    """Yield (statement, parameters) tuples reloading the batch records.
+
+    The records may already have been loaded, so their relationships
+    are removed before they are loaded again.
+    """
+    statements = list(statements_for_batch(records, article_statement))
+    if statements:
+        yield (REMOVE_RELATIONSHIPS_STATEMENT, {
+            "pmids": [row["pmid"] for row in statements[0][1]["rows"]]
+        })
+        for statement in statements:
+            yield statement
+
+
+def statements_for_replaced_batch(records, load_id):
+    """Yield (statement, parameters) tuples replacing the batch records.
+
+    The records are reloaded as statements_for_changed_batch does, and
+    marked as loaded by the load with load_id.
+    """
+    for statement, parameters in statements_for_changed_batch(
+            records,
+            REPLACE_ARTICLE_STATEMENT
+    ):
+        if statement == REPLACE_ARTICLE_STATEMENT:
+            parameters = dict(parameters, loadId=load_id)
+        yield (statement, parameters)
+
+
+# The statements loading one batch of records in a transaction, with
+# the pmids of the records, so that failed batches can be reported.
+Batch = collections.namedtuple("Batch", "pmids statements")
+
+
+def partition_of(pmid, partitions):
+    """Get the partition of the article with pmid, out of partitions."""
+    if pmid is None or partitions == 1:
+        return 0
+
+    return (zlib.crc32(pmid.encode("utf-8")) & 0xffffffff) % partitions
+
+
+def batches_from_data(data,
+                      batch_size=DEFAULT_BATCH_SIZE,
+                      statements_for=statements_for_batch,
+                      partitions=1):
+    """Yield a Batch for each batch_size records in data.
+
+    The statements for each batch are generated by statements_for.
+    Records are split into partitions by their pmid, and each batch
+    only has records from one partition.
+    """
+    pending = [[] for _ in range(partitions)]
+
+    def _batch(records):
+        """Get a Batch loading records, or None if there is nothing to do."""
+        statements = list(statements_for(records))
+        if statements:
+            return Batch([r.pmid for r in records if r.pmid is not None],
+                         statements)
+
+        return None
+
+    for record in data:
+        record = as_article_record(record)
+        records = pending[partition_of(record.pmid, partitions)]
+        records.append(record)
+        if len(records) >= batch_size:
+            batch = _batch(records)
+            del records[:]
+            if batch is not None:
+                yield batch
+
+    for records in pending:
+        batch = _batch(records) if records else None
+        if batch is not None:
+            yield batch
+
+
+def statements_from_data(data, batch_size=DEFAULT_BATCH_SIZE):
+    """Yield (statement, parameters) tuples loading records in data.
+
+    Records are loaded batch_size at a time, using the same statements
+    for each batch. The graph is reset first.
+    """
+    yield (RESET_STATEMENT, {})
+
+    for batch in batches_from_data(data, batch_size):
+        for statement in batch.statements:
+            yield statement
 
 
 def commands_from_data(data):
-    """Given an iterable of JSON objects yield Neo4j commands."""
-    yield "MATCH (n) OPTIONAL MATCH (n)-[r]-() DELETE n, r"
+    """Given an iterable of records or JSON objects yield Neo4j commands.
+
+    Each command loads one record, with its values in the command. Use
+    statements_from_data to load records in batches instead.
+    """
+    yield RESET_STATEMENT
 
     for record in data:
         command = generate_command_for_record(record)
@@ -82,44 +378,759 @@ def commands_from_data(data):
             yield command
 
 
+TRANSIENT_ERROR_PREFIX = "Neo.TransientError."
+
+
+def is_transient(error):
+    """Check if error is a CypherError that may not happen again."""
+    return (getattr(error, "code", None) or "").startswith(
+        TRANSIENT_ERROR_PREFIX
+    )
+
+
+class TransactionRunner(object):
+    """Runs statements in explicit transactions, retrying with backoff.
+
+    Transactions which fail with a transient error, such as a deadlock,
+    are rolled back and run again from the start, so that each one is
+    committed whole or not at all.
+    """
+
+    def __init__(self,
+                 session,
+                 retries=5,
+                 backoff=0.5,
+                 max_backoff=30.0,
+                 sleep=time.sleep):
+        """Initialize this TransactionRunner for session."""
+        self.session = session
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._sleep = sleep
+
+    def _run_once(self, statements):
+        """Run statements in one transaction, rolling back on error."""
+        transaction = self.session.begin_transaction()
+        try:
+            results = [list(transaction.run(statement, parameters))
+                       for statement, parameters in statements]
+            transaction.commit()
+            return results
+        except Exception:
+            if not transaction.closed:
+                transaction.rollback()
+            raise
+
+    def run(self, statements):
+        """Run statements in one transaction, returning their records.
+
+        A list of the records each statement returned is returned.
+        Transient errors are retried, and any other CypherError, or a
+        transient one which happens on every retry, is raised.
+        """
+        for attempt in range(self.retries + 1):
+            try:
+                return self._run_once(statements)
+            except CypherError as error:
+                if not is_transient(error) or attempt == self.retries:
+                    raise
+
+                sys.stderr.write("Transient error ({}).. retrying {}\n"
+                                 "".format(error.code, attempt))
+                instrument.count("retries")
+                self._sleep(random.uniform(0, min(self.max_backoff,
+                                                  self.backoff *
+                                                  (2 ** attempt))))
+
+
+def ensure_schema(runner):
+    """Create the constraints and indexes loading relies on with runner.
+
+    Schema changes cannot be made in the same transaction as data
+    changes, so each is run in its own transaction.
+    """
+    for statement in SCHEMA_STATEMENTS:
+        runner.run([(statement, {})])
+
+
+def load_batches(runner, batches, progress, on_loaded=None):
+    """Load each Batch in batches with runner, returning failed batches.
+
+    A batch which fails is reported and skipped, so that the batches
+    already committed are kept and the remaining ones are still loaded.
+    If on_loaded is set, it is called with each batch once committed.
+    """
+    failed = []
+    for batch in batches:
+        try:
+            runner.run(batch.statements)
+            instrument.count("transactions")
+            if on_loaded is not None:
+                on_loaded(batch)
+        except CypherError as error:
+            sys.stderr.write("Failed to load articles {}..{} ({})\n".format(
+                batch.pmids[0],
+                batch.pmids[-1],
+                error
+            ))
+            instrument.count("failed_batches")
+            failed.append(batch)
+
+        progress.update(len(batch.pmids))
+
+    return failed
+
+
+class DimensionNodes(object):
+    """Creates the nodes each batch relates articles to, ahead of time.
+
+    When batches are loaded concurrently, two transactions merging the
+    same new node would race to create it. Creating new nodes from one
+    session before their batches are loaded means that the loading
+    transactions only ever match them.
+    """
+
+    def __init__(self, runner):
+        """Initialize this DimensionNodes, creating nodes with runner."""
+        self.runner = runner
+        self._created = {key: set() for key, _ in RELATIONSHIP_STATEMENTS}
+
+    def create(self, batch):
+        """Create the nodes batch relates articles to, if not created."""
+        statements = []
+        for statement, parameters in batch.statements:
+            key = RELATIONSHIP_KEYS.get(statement, None)
+            if key is None:
+                continue
+
+            names = sorted(set(row["name"] for row in parameters["rows"]) -
+                           self._created[key])
+            if names:
+                self._created[key].update(names)
+                statements.append((DIMENSION_STATEMENTS[key],
+                                   {"names": names}))
+
+        if statements:
+            self.runner.run(statements)
+
+
+class ParallelLoader(object):
+    """Loads batches with several runners, each in its own thread.
+
+    Each runner loads the batches in one partition, so that no two
+    runners load the same article at once. Progress, failed batches and
+    on_loaded are handled in the thread calling load(), so on_loaded
+    does not need to be thread safe.
+    """
+
+    def __init__(self, runners, progress, on_loaded=None):
+        """Initialize this ParallelLoader with runners."""
+        self.runners = runners
+        self.progress = progress
+        self.on_loaded = on_loaded
+        self.failed = []
+        self._errors = []
+        self._finished = queue.Queue()
+        self._stop = threading.Event()
+
+    def _work(self, runner, pending):
+        """Load batches from pending with runner until told to stop."""
+        while True:
+            batch = pending.get()
+            if batch is None:
+                return
+            if self._stop.is_set():
+                continue
+            try:
+                runner.run(batch.statements)
+                self._finished.put((batch, None))
+            except BaseException as error:  # suppress(blind-except)
+                self._finished.put((batch, error))
+
+    def _collect(self, block=False):
+        """Handle the next finished batch, returning False if none."""
+        try:
+            batch, error = self._finished.get(block)
+        except queue.Empty:
+            return False
+
+        if error is None:
+            instrument.count("transactions")
+            if self.on_loaded is not None:
+                self.on_loaded(batch)
+        elif isinstance(error, CypherError):
+            sys.stderr.write("Failed to load articles {}..{} ({})\n".format(
+                batch.pmids[0],
+                batch.pmids[-1],
+                error
+            ))
+            instrument.count("failed_batches")
+            self.failed.append(batch)
+        else:
+            self._errors.append(error)
+            self._stop.set()
+
+        self.progress.update(len(batch.pmids))
+        return True
+
+    def load(self, batches, before_load=None):
+        """Load each Batch in batches, returning the failed batches.
+
+        If before_load is set, it is called with each batch before it
+        is handed to a runner. Any error other than a CypherError stops
+        loading, and is raised once all threads have stopped.
+        """
+        pending = [queue.Queue(maxsize=2) for _ in self.runners]
+        threads = [threading.Thread(target=self._work, args=(runner, items))
+                   for runner, items in zip(self.runners, pending)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+
+        queued = 0
+        try:
+            for batch in batches:
+                if self._stop.is_set():
+                    break
+                if before_load is not None:
+                    before_load(batch)
+                pending[partition_of(batch.pmids[0],
+                                     len(self.runners))].put(batch)
+                queued += 1
+                while self._collect():
+                    queued -= 1
+        finally:
+            for items in pending:
+                items.put(None)
+            for thread in threads:
+                thread.join()
+
+        while queued and self._collect(True):
+            queued -= 1
+
+        if self._errors:
+            raise self._errors[0]
+
+        return self.failed
+
+
+def remove_articles(runner, snapshot, batch_size=DEFAULT_BATCH_SIZE):
+    """Delete articles in snapshot which were not seen by this load.
+
+    Articles are deleted batch_size at a time, and forgotten by the
+    snapshot once each batch is committed.
+    """
+    removed = snapshot.removed()
+    for start in range(0, len(removed), batch_size):
+        pmids = removed[start:start + batch_size]
+        runner.run([(DELETE_ARTICLES_STATEMENT, {"pmids": pmids})])
+        snapshot.forget(pmids)
+        instrument.count("removed_articles", len(pmids))
+
+    return len(removed)
+
+
+def delete_in_batches(runner,
+                      statement,
+                      batch_size,
+                      progress=None,
+                      parameters=None):
+    """Run statement until it deletes fewer than batch_size items.
+
+    statement is passed batch_size as {limit}, along with parameters,
+    and returns how many items it deleted as deleted. Each batch is
+    deleted in its own transaction. Returns the number of items deleted.
+    """
+    deleted = 0
+    while True:
+        results = runner.run([(statement,
+                               dict(parameters or {}, limit=batch_size))])
+        count = results[0][0]["deleted"]
+        deleted += count
+        if progress is not None:
+            progress.update(count)
+        if count < batch_size:
+            return deleted
+
+
+def delete_orphans(runner, batch_size=DEFAULT_BATCH_SIZE):
+    """Delete nodes no article is related to, batch_size at a time."""
+    deleted = sum(delete_in_batches(runner, statement, batch_size)
+                  for statement in DELETE_ORPHANS_STATEMENTS)
+    instrument.count("orphans_deleted", deleted)
+    return deleted
+
+
+def delete_stale_articles(runner, load_id, batch_size=DEFAULT_BATCH_SIZE):
+    """Delete articles not loaded by the load with load_id."""
+    deleted = delete_in_batches(runner,
+                                DELETE_STALE_ARTICLES_STATEMENT,
+                                batch_size,
+                                parameters={"loadId": load_id})
+    instrument.count("removed_articles", deleted)
+    return deleted
+
+
+def reset_graph(runner, batch_size=RESET_BATCH_SIZE):
+    """Delete every relationship and node, batch_size at a time."""
+    sys.stderr.write("Resetting the graph.\n")
+    for name, statement in RESET_STATEMENTS:
+        progress = instrument.Progress("Deleted {}".format(name))
+        instrument.count("deleted_" + name,
+                         delete_in_batches(runner,
+                                           statement,
+                                           batch_size,
+                                           progress))
+        progress.finish()
+
+
+def is_full_load(snapshot):
+    """Check if a load with snapshot loads every article."""
+    return snapshot is None or not len(snapshot)
+
+
+def load_all(runner,
+             batches,
+             snapshot=None,
+             batch_size=DEFAULT_BATCH_SIZE,
+             workers=None,
+             load_id=None,
+             input_ended=None):
+    """Load batches with runner, returning the failed batches.
+
+    Without a snapshot, or with an empty one, every article is in
+    batches. If load_id is set, they are marked with it, and the
+    articles which were not marked are deleted afterwards. Otherwise
+    only changed articles are in batches, and articles which were not
+    seen are deleted afterwards. Either way, nodes no article is related
+    to any more are deleted too. Nothing is deleted unless input_ended,
+    an Event set once the whole input has been read, is set, since
+    articles after the point the input stopped were not seen. If
+    workers is a list of runners, the batches are loaded by them
+    concurrently, partitioned as batches_from_data partitions them for
+    that many partitions. The chart summaries are then computed again
+    for the graph as loaded.
+    """
+    sys.stderr.write("Loading to database.\n")
+    progress = instrument.Progress("Loaded articles")
+
+    def _on_loaded(batch):
+        """Record that batch was loaded in the snapshot."""
+        snapshot.mark_loaded(batch.pmids)
+
+    on_loaded = _on_loaded if snapshot is not None else None
+    if workers:
+        loader = ParallelLoader(workers, progress, on_loaded)
+        failed = loader.load(batches, DimensionNodes(runner).create)
+    else:
+        failed = load_batches(runner, batches, progress, on_loaded)
+    progress.finish()
+
+    input_read = input_ended is not None and input_ended.is_set()
+    if (load_id is not None or snapshot is not None) and not input_read:
+        sys.stderr.write("The input stopped before its end, so no "
+                         "articles were removed.\n")
+    elif load_id is not None:
+        sys.stderr.write("Removing deleted articles.\n")
+        delete_stale_articles(runner, load_id, batch_size)
+        delete_orphans(runner, batch_size)
+    elif snapshot is not None:
+        sys.stderr.write("Removing deleted articles.\n")
+        # Finding orphans scans every node with each label, so it is
+        # skipped when nothing changed.
+        if remove_articles(runner, snapshot, batch_size) or progress.done:
+            delete_orphans(runner, batch_size)
+
+    sys.stderr.write("Computing chart summaries.\n")
+    instrument.count("chart_summaries", write_chart_summaries(runner))
+    return failed
+
+
+def read_batches(fileobj,
+                 batch_size,
+                 metrics,
+                 snapshot=None,
+                 partitions=1,
+                 on_end=None,
+                 end_marker=False,
+                 load_id=None):
+    """Yield Batches for the records in fileobj as they are read.
+
+    If snapshot is set, only records which changed since it was taken
+    are loaded. If load_id is set, records replace the articles already
+    loaded, marked with load_id. Records are split into
+    batches_from_data partitions. on_end and end_marker are passed to
+    read_records.
+    """
+    statements_for = statements_for_batch
+    data = metrics.timed("read",
+                         read_records(fileobj, on_end, end_marker),
+                         "articles")
+    if snapshot is not None:
+        data = (record for record in data if snapshot.is_changed(record))
+        statements_for = statements_for_changed_batch
+    if load_id is not None:
+        def _replaced(records):
+            """Get statements replacing records, marked with load_id."""
+            return statements_for_replaced_batch(records, load_id)
+
+        statements_for = _replaced
+
+    return metrics.timed(
+        "generate",
+        batches_from_data(data, batch_size, statements_for, partitions),
+        "batches"
+    )
+
+
+def database_driver():
+    """Get a (url, driver) tuple for the database in the environment."""
+    if all(var in os.environ for
+           var in ["DATABASE_URL", "DATABASE_PASS"]):
+        url = os.environ["DATABASE_URL"]
+        pwd = os.environ["DATABASE_PASS"]
+        usr = os.environ.get("DATABASE_USER", "")
+    else:
+        raise ValueError("Ensure environment variables "
+                         "DATABASE_URL, DATABASE_PASS and "
+                         "DATABASE_USER set.")
+
+    return (url, GraphDatabase.driver(url, auth=basic_auth(usr, pwd)))
+
+
+def count_articles(runner):
+    """Count the articles in the graph with runner."""
+    return runner.run([(COUNT_ARTICLES_STATEMENT, {})])[0][0]["articles"]
+
+
+def check_snapshot(snapshot):
+    """Clear snapshot unless it is of the graph in the database.
+
+    A snapshot of another database, or of a graph which was changed
+    some other way, would skip articles the graph does not have, so
+    every article is loaded instead.
+    """
+    url, driver = database_driver()
+    session = driver.session()
+    try:
+        articles = count_articles(TransactionRunner(session))
+    finally:
+        session.close()
+
+    if not snapshot.matches(url, articles):
+        if len(snapshot):
+            sys.stderr.write("Snapshot does not match the database, so "
+                             "every article will be loaded.\n")
+        snapshot.clear(url)
+
+
+def load_or_print(parse_result, metrics, snapshot=None):
+    """Load the articles to the database, or print the statements."""
+    if parse_result.schema_only:
+        load_or_print_batches(parse_result, metrics, None, snapshot)
+        return
+
+    if snapshot is not None:
+        check_snapshot(snapshot)
+
+    # Full loads replace articles instead of resetting the graph first,
+    # unless asked to, so that input which stops early does not leave
+    # the graph empty. Statements printed by --no-execute reset it.
+    load_id = None
+    if not (parse_result.no_execute or
+            parse_result.reset) and is_full_load(snapshot):
+        load_id = uuid.uuid4().hex
+
+    input_ended = threading.Event()
+    with open_or_default(parse_result.file, sys.stdin) as fileobj:
+        sys.stderr.write("Reading data from file\n")
+        batches = read_batches(fileobj,
+                               parse_result.batch_size,
+                               metrics,
+                               snapshot,
+                               parse_result.workers,
+                               input_ended.set,
+                               parse_result.require_end_marker,
+                               load_id)
+        # Batches are read as they are loaded, so only a few batches
+        # are held in memory at once. The first one is read before
+        # connecting to the database, so that invalid input is found
+        # before anything is changed.
+        first = list(itertools.islice(batches, 1))
+        load_or_print_batches(parse_result,
+                              metrics,
+                              itertools.chain(first, batches),
+                              snapshot,
+                              load_id,
+                              input_ended)
+
+
+def exit_unless_ended(input_ended):
+    """Exit with an error unless input_ended, an Event, is set."""
+    if not input_ended.is_set():
+        sys.stderr.write("The input stopped before its end marker\n")
+        sys.exit(1)
+
+
+def load_or_print_batches(parse_result,
+                          metrics,
+                          batches,
+                          snapshot=None,
+                          load_id=None,
+                          input_ended=None):
+    """Load batches to the database, or print their statements.
+
+    If batches is None, only the schema is created. load_id and
+    input_ended are passed to load_all, and if input_ended is set, the
+    load fails unless the whole input was read.
+    """
+    if parse_result.no_execute:
+        statements = [(statement, {}) for statement in SCHEMA_STATEMENTS]
+        if batches is not None:
+            statements = itertools.chain(
+                statements,
+                [(RESET_STATEMENT, {})],
+                itertools.chain.from_iterable(batch.statements
+                                              for batch in batches)
+            )
+        write_records(({"statement": statement, "parameters": parameters}
+                       for statement, parameters in statements),
+                      sys.stdout)
+        if input_ended is not None:
+            exit_unless_ended(input_ended)
+        return
+
+    with metrics.stage("execute"):
+        _, driver = database_driver()
+        # Sessions cannot be shared between threads, so each worker
+        # has its own session, as well as the one for this thread.
+        sessions = [driver.session() for _ in range(
+            1 + (parse_result.workers if parse_result.workers > 1 else 0)
+        )]
+        try:
+            runners = [TransactionRunner(session) for session in sessions]
+            sys.stderr.write("Creating constraints.\n")
+            ensure_schema(runners[0])
+            failed = []
+            if batches is not None:
+                if parse_result.reset:
+                    reset_graph(runners[0])
+                failed = load_all(runners[0],
+                                  batches,
+                                  snapshot,
+                                  parse_result.batch_size,
+                                  runners[1:],
+                                  load_id,
+                                  input_ended)
+        finally:
+            sys.stderr.write("Cleaning up.\n")
+            for session in sessions:
+                session.close()
+
+    if failed:
+        sys.stderr.write("Failed to load {} batches\n".format(
+            len(failed)
+        ))
+        sys.exit(1)
+
+    if input_ended is not None:
+        exit_unless_ended(input_ended)
+    sys.stderr.write("Done.\n")
+
+
+# Sinks which articles can be loaded into instead of Neo4j, by the
+# scheme of their --sink argument. Each is created with the location
+# after the scheme, and has reset(), load(records) and close() methods,
+# and a transaction() context committing everything done in it at once.
+SINKS = {
+    "sqlite": SQLiteSink
+}
+
+
+def sink_argument(value):
+    """Parse a --sink argument into a (scheme, location) tuple."""
+    scheme, _, location = value.partition(":")
+    if scheme == "neo4j" and not location:
+        return (scheme, None)
+
+    if scheme not in SINKS or not location:
+        raise argparse.ArgumentTypeError(
+            "expected neo4j, or one of {} followed by :LOCATION".format(
+                ", ".join(sorted(SINKS.keys()))
+            )
+        )
+
+    return (scheme, location)
+
+
+def load_to_sink(sink,
+                 records,
+                 batch_size=DEFAULT_BATCH_SIZE,
+                 input_ended=None):
+    """Reset sink, then load records into it batch_size at a time.
+
+    Everything is done in one sink transaction, so readers see the old
+    articles until every record has been loaded. If reading records
+    fails, or input_ended is set but the whole input was not read, the
+    old articles are kept.
+    """
+    with sink.transaction():
+        sink.reset()
+        sys.stderr.write("Loading to sink.\n")
+        progress = instrument.Progress("Loaded articles")
+        iterator = iter(records)
+        while True:
+            batch = list(itertools.islice(iterator, batch_size))
+            if not batch:
+                break
+
+            sink.load(batch)
+            instrument.count("transactions")
+            progress.update(len(batch))
+
+        progress.finish()
+        if input_ended is not None:
+            exit_unless_ended(input_ended)
+
+
 def main(argv=None):
     """Import all data in JSON file into Neo4j database."""
     parser = argparse.ArgumentParser(description="Load articles into Neo4j")
     parser.add_argument("file",
-                        help="File to read",
+                        help="File to read, a JSON array or NDJSON",
                         type=str,
                         nargs="?",
                         metavar="FILE")
     parser.add_argument("--no-execute",
-                        action="store_true")
+                        action="store_true",
+                        help="Print the statements as JSON instead of "
+                             "running them")
+    parser.add_argument("--batch-size",
+                        type=int,
+                        default=DEFAULT_BATCH_SIZE,
+                        metavar="N",
+                        help="How many articles to load per transaction")
+    parser.add_argument("--workers",
+                        type=int,
+                        default=1,
+                        metavar="N",
+                        help="How many sessions to load articles with at "
+                             "once")
+    parser.add_argument("--schema-only",
+                        action="store_true",
+                        help="Only create the constraints and indexes, "
+                             "without loading any articles")
+    parser.add_argument("--incremental",
+                        nargs="?",
+                        const="",
+                        metavar="SNAPSHOT",
+                        help="Only load articles which changed since the "
+                             "last load recorded in SNAPSHOT, and delete "
+                             "articles which are gone, instead of loading "
+                             "every article (default is {})".format(
+                                 SNAPSHOT_FILE
+                             ))
+    parser.add_argument("--reset",
+                        action="store_true",
+                        help="Delete the whole graph in batches before "
+                             "loading, instead of deleting the articles "
+                             "which are not in the input once it has all "
+                             "been read")
+    parser.add_argument("--require-end-marker",
+                        action="store_true",
+                        help="Fail if NDJSON input does not end with the "
+                             "end marker parse-pubmed-files --end-marker "
+                             "writes, since it may have stopped early")
+    parser.add_argument("--sink",
+                        type=sink_argument,
+                        default=("neo4j", None),
+                        metavar="SINK",
+                        help="Where to load articles: neo4j (the default), "
+                             "or sqlite:PATH for an SQLite database")
+    parser.add_argument("--export-csv",
+                        metavar="DIR",
+                        help="Write CSV files for neo4j-admin import to "
+                             "DIR instead of loading into a database")
+    instrument.add_arguments(parser)
     parse_result = parser.parse_args(argv or sys.argv[1:])
+    if parse_result.incremental is not None and parse_result.no_execute:
+        parser.error("--no-execute cannot be used with --incremental, "
+                     "since statements depend on the last load")
+    if parse_result.incremental is not None and parse_result.reset:
+        parser.error("--reset cannot be used with --incremental")
+    if parse_result.sink[0] != "neo4j" and (parse_result.no_execute or
+                                            parse_result.schema_only or
+                                            parse_result.workers > 1 or
+                                            parse_result.reset or
+                                            parse_result.incremental is
+                                            not None):
+        parser.error("--no-execute, --schema-only, --workers, --reset and "
+                     "--incremental can only be used with the neo4j sink")
 
-    with open_or_default(parse_result.file, sys.stdin) as fileobj:
-        data = json.load(fileobj)
-        sys.stderr.write("Reading data from file\n")
-        commands = list(commands_from_data(data))
+    with instrument.instrumented("load-pubmed-files",
+                                 parse_result) as metrics:
+        input_ended = threading.Event()
+        if parse_result.export_csv:
+            with open_or_default(parse_result.file, sys.stdin) as fileobj:
+                with metrics.stage("export"):
+                    exporter = export_csv(
+                        metrics.timed("read",
+                                      read_records(
+                                          fileobj,
+                                          input_ended.set,
+                                          parse_result.require_end_marker
+                                      ),
+                                      "articles"),
+                        parse_result.export_csv
+                    )
+            exit_unless_ended(input_ended)
+            metrics.merge({
+                "nodes": exporter.articles + exporter.nodes,
+                "relationships": exporter.relationships
+            })
+            sys.stderr.write("Exported {}. Import them into an empty "
+                             "database with:\n"
+                             "neo4j-admin import {}\n".format(
+                                 exporter.summary(),
+                                 " ".join(exporter.import_arguments())
+                             ))
+            return
 
-    if parse_result.no_execute:
-        sys.stdout.write(json.dumps(commands))
-    elif len(commands):
-        if all(var in os.environ for
-               var in ["DATABASE_URL", "DATABASE_PASS"]):
-                    url = os.environ["DATABASE_URL"]
-                    pwd = os.environ["DATABASE_PASS"]
-                    usr = os.environ.get("DATABASE_USER", "")
-        else:
-            raise ValueError("Ensure environment variables DATABASE_URL, "
-                             "DATABASE_PASS and DATABASE_USER set.")
-
-        driver = GraphDatabase.driver(url, auth=basic_auth(usr, pwd))
-        session = driver.session()
-        sys.stderr.write("Loading to database.\n")
-        for command in commands:
-            print(command)
-            session.run(command)
-        sys.stderr.write("Cleaning up.\n")
-        session.close()
-        sys.stderr.write("Done.\n")
+        scheme, location = parse_result.sink
+        if scheme != "neo4j":
+            with open_or_default(parse_result.file, sys.stdin) as fileobj:
+                records = metrics.timed(
+                    "read",
+                    read_records(fileobj,
+                                 input_ended.set,
+                                 parse_result.require_end_marker),
+                    "articles"
+                )
+                with metrics.stage("execute"):
+                    sink = SINKS[scheme](location)
+                    try:
+                        load_to_sink(sink,
+                                     records,
+                                     parse_result.batch_size,
+                                     input_ended)
+                    finally:
+                        sink.close()
+            sys.stderr.write("Done.\n")
+            return
+
+        snapshot = None
+        if parse_result.incremental is not None:
+            snapshot = LoadSnapshot(parse_result.incremental or SNAPSHOT_FILE)
+
+        try:
+            load_or_print(parse_result, metrics, snapshot)
+        finally:
+            if snapshot is not None:
+                snapshot.close()
+                metrics.merge({"changed_articles": snapshot.changed,
+                               "unchanged_articles": snapshot.unchanged})
+                sys.stderr.write(snapshot.summary() + "\n")
 
 if __name__ == "__main__":
     main(sys.argv[1:])
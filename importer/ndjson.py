@@ -0,0 +1,158 @@
+# /importer/ndjson.py
+#
+# Read and write streams of article records.
+#
+# See /LICENCE.md for Copyright information
+"""Read and write streams of article records.
+
+Records are either written as a single JSON array, or as newline
+delimited JSON (NDJSON), with one record per line. NDJSON can be
+consumed as it is written. Both are read one record at a time, so only
+the record being read is held in memory.
+
+A writer which stops part of the way through an NDJSON stream leaves
+behind records which look complete. If asked to, writers end NDJSON
+streams with an END_OF_STREAM line, so that readers which expect it
+can tell whether they have seen every record, as they can for a JSON
+array by its closing "]".
+"""
+
+import itertools
+import json
+
+
+FORMATS = ("json", "ndjson")
+
+# How many characters of a JSON array to read at a time.
+READ_SIZE = 1 << 16
+
+WHITESPACE = " \t\n\r"
+
+# The last line of a complete NDJSON stream written with an end marker,
+# which is not a record.
+END_OF_STREAM = {"endOfStream": True}
+
+
+def read_array(buffer, fileobj):
+    """Yield each value of the JSON array starting in buffer.
+
+    The rest of the array is read from :fileobj: as it is needed. A
+    ValueError is raised if the array is not valid JSON.
+    """
+    decoder = json.JSONDecoder()
+    position = buffer.index("[") + 1
+    # What is expected next: the first value or "]", a value after a
+    # ",", or a "," or "]" after a value.
+    expecting = "first"
+    exhausted = False
+    while True:
+        while position < len(buffer) and buffer[position] in WHITESPACE:
+            position += 1
+
+        if position < len(buffer):
+            char = buffer[position]
+            if char == "]" and expecting != "value":
+                return
+
+            if expecting == "separator":
+                if char != ",":
+                    raise ValueError("Expecting ',' delimiter in JSON array")
+                position += 1
+                expecting = "value"
+                continue
+
+            try:
+                value, end = decoder.raw_decode(buffer, position)
+            except ValueError:
+                # The value may be cut off at the end of the buffer.
+                if exhausted:
+                    raise
+            else:
+                # A number cut off at the end of the buffer is decoded
+                # without its remaining digits, so a value is only used
+                # once the "," or "]" after it has been read.
+                following = end
+                while (following < len(buffer) and
+                       buffer[following] in WHITESPACE):
+                    following += 1
+                after = buffer[following:following + 1]
+                if exhausted or after in (",", "]"):
+                    yield value
+                    position = end
+                    expecting = "separator"
+                    continue
+        elif exhausted:
+            raise ValueError("Unterminated JSON array")
+
+        more = fileobj.read(READ_SIZE)
+        buffer = buffer[position:] + more
+        position = 0
+        exhausted = not more
+
+
+def read_records(fileobj, on_end=None, end_marker=False):
+    """Yield each record in :fileobj:, a JSON array or NDJSON stream.
+
+    NDJSON is read one line at a time, so records are yielded as soon
+    as they are written. JSON arrays are read in chunks of READ_SIZE.
+    If :on_end: is set, it is called once the end of the input is read:
+    the closing "]" of a JSON array, or the END_OF_STREAM line or end of
+    file for NDJSON. If :end_marker: is set, the end of an NDJSON file
+    without an END_OF_STREAM line does not count.
+    """
+    # Look at the first character, since a JSON array may be on one
+    # very long line.
+    first = fileobj.read(1)
+    while first and first in WHITESPACE:
+        first = fileobj.read(1)
+
+    if first == "[":
+        for record in read_array(first, fileobj):
+            yield record
+        if on_end is not None:
+            on_end()
+        return
+
+    # Use readline instead of iterating over fileobj, since Python 2
+    # does not allow mixing iteration with read()
+    lines = itertools.chain([first + fileobj.readline()] if first else [],
+                            iter(fileobj.readline, ""))
+    for line in lines:
+        stripped = line.strip()
+        if not stripped:
+            continue
+
+        record = json.loads(stripped)
+        if record == END_OF_STREAM:
+            if on_end is not None:
+                on_end()
+            return
+
+        yield record
+
+    if on_end is not None and not end_marker:
+        on_end()
+
+
+def write_records(records, fileobj, output_format="json", end_marker=False):
+    """Write each record in :records: to :fileobj: in :output_format:.
+
+    In the ndjson format, :fileobj: is flushed after each record, and if
+    :end_marker: is set, END_OF_STREAM is written once every record has
+    been. In the json format, the output is the same as json.dumps of a list of
+    :records:, followed by a newline, but records are written one at a
+    time instead of building the whole document first.
+    """
+    if output_format == "ndjson":
+        for record in records:
+            fileobj.write(json.dumps(record) + "\n")
+            fileobj.flush()
+        if end_marker:
+            fileobj.write(json.dumps(END_OF_STREAM) + "\n")
+            fileobj.flush()
+        return
+
+    fileobj.write("[")
+    for index, record in enumerate(records):
+        fileobj.write((", " if index else "") + json.dumps(record))
+    fileobj.write("]\n")
@@ -10,20 +10,77 @@ This file will contain all the relevant fields for each retraction.
 """
 
 import argparse
-from datetime import date, datetime
+import collections
+from datetime import date
+import functools
+import io
+import multiprocessing
 import os
 import re
 import sys
 import itertools
-import json
 import xml.etree.ElementTree as ET
 
+from importer import instrument
+from importer.cache import (CACHE_FILE,
+                            ParseCache,
+                            default_cache_path,
+                            fingerprint)
+from importer.ndjson import FORMATS, write_records
+from importer.record import (ArticleRecord,
+                             date_to_json,
+                             date_value,
+                             encode_date)
+from importer.store import open_store
+
+try:
+    from lxml import etree as lxml_etree
+except ImportError:
+    lxml_etree = None
+
+
+# Version of the records produced by the parser. Change this whenever
+# the records parsed from the same document would change, so that
+# cached records are parsed again.
+PARSER_VERSION = "1"
+
+# Elements which contain a single article in a PubmedArticleSet.
+ARTICLE_TAGS = ("PubmedArticle", "PubmedBookArticle")
+
+# How long to wait for the oldest chunk sent to the pool before checking
+# if any other chunk has been parsed.
+POLL_INTERVAL = 0.01
+
 
 def file_to_element_tree(path):
     """For a given :path:, get an ElementTree."""
     return ET.parse(path)
 
 
+def iterparse_articles(source):
+    """Yield each article element in :source: as soon as it is parsed.
+
+    :source: is a path or file object. Each element is cleared once the
+    caller is done with it, so that memory use does not grow with the
+    number of articles in :source:. If :source: has no article elements,
+    its root element is yielded instead.
+    """
+    context = ET.iterparse(source, events=("start", "end"))
+    _, root = next(context)
+    found_articles = False
+
+    for event, element in context:
+        if event == "end" and element.tag in ARTICLE_TAGS:
+            found_articles = True
+            yield element
+            element.clear()
+            # Drop the reference to the article from its parent too
+            root.clear()
+
+    if not found_articles:
+        yield root
+
+
 def parse_selected_sections(object, *args):
     """Given a particular ElementTree element, get specified children."""
     def _text_or_none(element):
@@ -43,7 +100,9 @@ class InvalidCombinationExpection(Exception):
 
     def __init__(self, entry, valid_combinations):
         """Initialize this exception with combinations."""
-        Exception.__init__(self)
+        # Pass the arguments on, so that this exception can be pickled
+        # and raised in the parent when it happens in a worker process
+        Exception.__init__(self, entry, valid_combinations)
         self._entry = entry
         self._valid_combinations = valid_combinations
 
@@ -69,14 +128,17 @@ def expect_section_combinations(entry, object, combinations):
         raise InvalidCombinationExpection(entry, combinations)
 
 
+DATE_COMBINATIONS = [
+    tuple(),
+    ("Year", ),
+    ("Year", "Month"),
+    ("Year", "Month", "Day")
+]
+
+
 def expect_valid_date_combinations(entry, object):
     """Expect object to have valid date combinations as children."""
-    return expect_section_combinations(entry, object, [
-        tuple(),
-        ("Year", ),
-        ("Year", "Month"),
-        ("Year", "Month", "Day")
-    ])
+    return expect_section_combinations(entry, object, DATE_COMBINATIONS)
 
 
 def sections_to_date_entry(sections):
@@ -95,9 +157,25 @@ def sections_to_date_entry(sections):
     }
 
 
+def sections_to_date(sections):
+    """Given a list of date sections, return a packed date."""
+    # Set every other component to 1
+    date_sections = sections + list(itertools.repeat("1", 3 - len(sections)))
+    return encode_date(*[int(a) for a in date_sections],
+                       precision=len(sections))
+
+
+SANITISE_PATTERN = re.compile(r"[\\\t\\\n\\\r]")
+
+
 def sanitise_string(string):
     """Sanitize a particular string."""
-    return re.sub(r"[\\\t\\\n\\\r]", "", string.strip())
+    return SANITISE_PATTERN.sub("", string.strip())
+
+
+def sanitise_optional_string(string):
+    """Sanitize string if it is not None."""
+    return sanitise_string(string) if string is not None else None
 
 
 def sanitise_field_values(structure):
@@ -114,6 +192,7 @@ def sanitise_field_values(structure):
 
 def warning(filename, msg):
     """Print warning about filename."""
+    instrument.count("warnings")
     sys.stderr.write("{}{}\n".format(filename + ": " if filename else "",
                                      msg))
 
@@ -133,77 +212,405 @@ def get_author_name(author_element):
 
 def parse_element_tree(tree, filename=None):
     """For a given ElementTree :tree:, parse it into JSON."""
-    root = tree.getroot()
-    article_data = {
-        "pmid": None,
-        "pubDate": None,
-        "reviseDate": None,
-        "ISSN": None,
-        "country": None,
-        "Author": None,
-        "Topic": None
-    }
+    return parse_element(tree.getroot(), filename).to_json()
 
-    for medinfo in root.iter("MedlineCitation"):
-        article_data["pmid"] = medinfo.find("PMID").text
 
-    authors = list()
-    for author in root.iter("Author"):
-        authors.append(get_author_name(author))
-
-    # Special case - if the authors list is empty, just replace it with none
-    article_data["Author"] = authors if len(authors) else None
-
-    for pubDate in root.iter("DateCompleted"):
-        expect_valid_date_combinations("DateCompleted", pubDate)
-        sections = parse_selected_sections(pubDate, "Year", "Month", "Day")
-        article_data["pubDate"] = sections_to_date_entry([
-            s for s in sections if s
-        ])
-
-    for reviseDate in root.iter("DateRevised"):
-        expect_valid_date_combinations("DateRevised", reviseDate)
-        sections = parse_selected_sections(reviseDate, "Year", "Month", "Day")
-        article_data["reviseDate"] = sections_to_date_entry([
-            s for s in sections if s
-        ])
-
-    for journal in root.iter("Journal"):
-        sections = parse_selected_sections(journal, "ISSN")
-        if all(sections):
-            article_data["ISSN"] = sections[0]
-
-    for journalinfo in root.iter("MedlineJournalInfo"):
-        sections = parse_selected_sections(journalinfo, "Country")
-        if all(sections):
-            article_data["country"] = sections[0]
-
-    for headinglist in root.iter("MeshHeadingList"):
-        topics = list()
-        for heading in root.iter("MeshHeading"):
-            sections = parse_selected_sections(heading, "DescriptorName")
-            if all(sections):
-                topics.append(sections[0])
-        article_data["Topic"] = topics
+def parse_articles(source, filename=None, backend=None):
+    """Parse each article in :source:, a path or file, to ArticleRecords.
 
+    This returns a generator which parses :source: incrementally. If
+    :backend: is not set, the ElementTree backend is used.
+    """
+    return (backend or BACKENDS["etree"]).parse_articles(source, filename)
+
+
+def parse_date_element(entry, element):
+    """Parse a date :element: such as DateCompleted into a packed date."""
+    expect_valid_date_combinations(entry, element)
+    sections = parse_selected_sections(element, "Year", "Month", "Day")
+    return sections_to_date([s for s in sections if s])
+
+
+def parse_element(root, filename=None):
+    """For a given article element :root:, parse it to an ArticleRecord.
+
+    All fields are collected in a single traversal of :root:.
+    """
+    pmid = None
+    pub_date = None
+    revise_date = None
+    issn = None
+    country = None
+    authors = list()
+    topics = list()
+    found_heading_list = False
+
+    for element in root.iter():
+        tag = element.tag
+        if tag == "Author":
+            authors.append(sanitise_string(get_author_name(element)))
+        elif tag == "MeshHeading":
+            descriptor = element.find("DescriptorName")
+            if descriptor is not None and descriptor.text:
+                topics.append(sanitise_string(descriptor.text))
+        elif tag == "MedlineCitation":
+            pmid = element.find("PMID").text
+        elif tag == "DateCompleted":
+            pub_date = parse_date_element(tag, element)
+        elif tag == "DateRevised":
+            revise_date = parse_date_element(tag, element)
+        elif tag == "Journal":
+            issn = element.find("ISSN")
+            issn = issn.text if issn is not None and issn.text else None
+        elif tag == "MedlineJournalInfo":
+            country = element.find("Country")
+            country = (country.text if country is not None and country.text
+                       else None)
+        elif tag == "MeshHeadingList":
+            found_heading_list = True
+
+    return article_record(filename,
+                          pmid,
+                          pub_date,
+                          revise_date,
+                          issn,
+                          country,
+                          authors,
+                          topics if found_heading_list else None)
+
+
+def article_record(filename,
+                   pmid,
+                   pub_date,
+                   revise_date,
+                   issn,
+                   country,
+                   authors,
+                   topics):
+    """Build the ArticleRecord for an article from its extracted fields.
+
+    :authors: and :topics: must already be sanitised. :topics: is None
+    if the article had no MeshHeadingList.
+    """
     # Print error to stderr if there's contradictory field
-    # entries and don't insert a value if so
-    if all([article_data[a] is not None for a in ["pubDate", "reviseDate"]]):
-        if (datetime.strptime(article_data["pubDate"]["date"],
-                              "%Y-%m-%d") >
-                datetime.strptime(article_data["reviseDate"]["date"],
-                                  "%Y-%m-%d")):
+    # entries and don't insert a value if so.
+    if pub_date is not None and revise_date is not None:
+        if date_value(pub_date) > date_value(revise_date):
             warning(filename,
                     """pubDate ({}) is greater than reviseDate ({})"""
-                    """""".format(article_data["pubDate"],
-                                  article_data["reviseDate"]))
-            article_data["pubDate"] = None
-            article_data["reviseDate"] = None
-
-    if len([k for k in article_data.keys() if article_data[k]]) == 0:
+                    """""".format(date_to_json(pub_date),
+                                  date_to_json(revise_date)))
+            pub_date = None
+            revise_date = None
+
+    if not any([pmid,
+                pub_date is not None,
+                revise_date is not None,
+                issn,
+                country,
+                authors,
+                topics]):
+        instrument.count("warnings")
         sys.stderr.write("File found with no fields, skipping\n")
 
-    return sanitise_field_values(article_data)
+    # Lists were sanitised as they were collected, dates do not need it.
+    # The authors list is replaced with None if it is empty.
+    return ArticleRecord(sanitise_optional_string(pmid),
+                         pub_date,
+                         revise_date,
+                         sanitise_optional_string(issn),
+                         sanitise_optional_string(country),
+                         authors if len(authors) else None,
+                         topics)
+
+
+# Elements which the lxml backend gets events for. Filtering events
+# by tag is done by lxml in C.
+LXML_EVENT_TAGS = ARTICLE_TAGS + (
+    "Author",
+    "MeshHeading",
+    "MedlineCitation",
+    "DateCompleted",
+    "DateRevised",
+    "Journal",
+    "MedlineJournalInfo",
+    "MeshHeadingList"
+)
+
+
+def first_children(element, tags):
+    """Get a dict of the first child of :element: with each of :tags:."""
+    children = dict()
+    for child in element:
+        if child.tag in tags and child.tag not in children:
+            children[child.tag] = child
+
+    return children
+
+
+def child_text(children, tag):
+    """Get the text of the child with :tag: in :children:, or None."""
+    child = children.get(tag, None)
+    return child.text if child is not None else None
+
+
+def lxml_parse_date_element(entry, element):
+    """Parse a date :element: like parse_date_element does."""
+    children = first_children(element, ("Year", "Month", "Day"))
+    if not any([all([e in children for e in c]) and len(c) == len(element)
+                for c in DATE_COMBINATIONS]):
+        raise InvalidCombinationExpection(entry, DATE_COMBINATIONS)
+
+    sections = [child_text(children, t) for t in ("Year", "Month", "Day")]
+    return sections_to_date([s for s in sections if s])
+
+
+def lxml_parse_articles(source, filename=None):
+    """Parse each article in :source: to ArticleRecords using lxml.
+
+    This behaves like the ElementTree backend, but instead of walking
+    each article in Python, lxml only reports the elements we extract
+    fields from, and fields are read straight from their children. This
+    avoids lxml's Python level find() and XPath calls, which cost more
+    per call than parsing a whole article with ElementTree.
+    """
+    context = lxml_etree.iterparse(source,
+                                   events=("end", ),
+                                   tag=LXML_EVENT_TAGS,
+                                   remove_comments=True,
+                                   remove_pis=True)
+    fields = dict()
+    authors = list()
+    topics = list()
+    found_articles = False
+
+    for _, element in context:
+        tag = element.tag
+        if tag == "Author":
+            children = first_children(element, ("ForeName",
+                                                "LastName",
+                                                "CollectiveName"))
+            name = " ".join([
+                children[t].text for t in ("ForeName", "LastName")
+                if t in children
+            ])
+            if not name:
+                name = children.get("CollectiveName", None).text
+            authors.append(sanitise_string(name))
+        elif tag == "MeshHeading":
+            descriptor = child_text(first_children(element,
+                                                   ("DescriptorName", )),
+                                    "DescriptorName")
+            if descriptor:
+                topics.append(sanitise_string(descriptor))
+        elif tag == "MedlineCitation":
+            fields["pmid"] = first_children(element,
+                                            ("PMID", )).get("PMID").text
+        elif tag == "DateCompleted":
+            fields["pubDate"] = lxml_parse_date_element(tag, element)
+        elif tag == "DateRevised":
+            fields["reviseDate"] = lxml_parse_date_element(tag, element)
+        elif tag == "Journal":
+            issn = child_text(first_children(element, ("ISSN", )), "ISSN")
+            if issn:
+                fields["ISSN"] = issn
+        elif tag == "MedlineJournalInfo":
+            country = child_text(first_children(element, ("Country", )),
+                                 "Country")
+            if country:
+                fields["country"] = country
+        elif tag == "MeshHeadingList":
+            fields["Topic"] = True
+        else:
+            found_articles = True
+            yield lxml_article_record(filename, fields, authors, topics)
+            fields = dict()
+            authors = list()
+            topics = list()
+            element.clear()
+            # Drop references to articles we are done with from the parent
+            while element.getprevious() is not None:
+                del element.getparent()[0]
+
+    if not found_articles:
+        yield lxml_article_record(filename, fields, authors, topics)
+
+
+def lxml_article_record(filename, fields, authors, topics):
+    """Build the ArticleRecord for an article parsed by lxml."""
+    return article_record(filename,
+                          fields.get("pmid", None),
+                          fields.get("pubDate", None),
+                          fields.get("reviseDate", None),
+                          fields.get("ISSN", None),
+                          fields.get("country", None),
+                          authors,
+                          topics if fields.get("Topic", False) else None)
+
+
+def etree_parse_articles(source, filename=None):
+    """Parse each article in :source: to ArticleRecords with ElementTree."""
+    for element in iterparse_articles(source):
+        yield parse_element(element, filename)
+
+
+Backend = collections.namedtuple("Backend", "name parse_articles")
+
+BACKENDS = {
+    "etree": Backend("etree", etree_parse_articles),
+    "lxml": Backend("lxml", lxml_parse_articles)
+}
+
+
+def available_backends():
+    """Get the names of the backends which can be used."""
+    return sorted(name for name in BACKENDS
+                  if name != "lxml" or lxml_etree is not None)
+
+
+def select_backend(name="auto"):
+    """Get the Backend called :name:.
+
+    If :name: is "auto", the lxml backend is used if lxml is installed,
+    otherwise the ElementTree backend is used.
+    """
+    if name == "auto":
+        name = "lxml" if lxml_etree is not None else "etree"
+
+    if name not in available_backends():
+        raise ValueError("Parser backend {} is not available".format(name))
+
+    return BACKENDS[name]
+
+
+def parse_document(backend_name, article):
+    """Parse each article in a stored (name, document) tuple.
+
+    This runs in worker processes, so the backend is passed by name.
+    """
+    name, document = article
+    return list(parse_articles(io.BytesIO(document),
+                               name,
+                               BACKENDS[backend_name]))
+
+
+def parse_store(store, backend, jobs=1, chunk_size=16, cache=None):
+    """Yield a record for each article in :store:.
+
+    If :jobs: is more than one, documents are sent to a pool of :jobs:
+    processes, :chunk_size: documents at a time, with up to two chunks
+    per process in flight. Records are yielded from whichever chunk is
+    parsed first, so one slow chunk does not hold up the rest, and their
+    order is not deterministic.
+
+    If :cache: is set, records for documents in the :cache: are yielded
+    without parsing them. Documents whose stamp in the :store: has not
+    changed are not even read. Only the other documents are parsed,
+    then added to the :cache:.
+    """
+    parse = functools.partial(parse_document, backend.name)
+    pool = multiprocessing.Pool(jobs) if jobs > 1 else None
+    pending = collections.deque()
+    chunk = []
+
+    def _submit():
+        """Start parsing the current chunk."""
+        articles = [article for article, _ in chunk]
+        keys = [(name, key) for (name, _), key in chunk]
+        if pool is None:
+            pending.append((keys, [parse(a) for a in articles]))
+        else:
+            pending.append((keys, pool.map_async(
+                functools.partial(instrument.collect_counters, parse),
+                articles,
+                len(articles)
+            )))
+        del chunk[:]
+
+    def _finish(index):
+        """Yield the records for the pending chunk at :index:."""
+        keys, results = pending[index]
+        del pending[index]
+        if pool is not None:
+            # Add what each worker counted to the counters for this run
+            results = results.get()
+            for _, counters in results:
+                instrument.active().merge(counters)
+            results = [records for records, _ in results]
+
+        for (name, (key, stamp)), records in zip(keys, results):
+            if cache is not None:
+                cache.put(name, key, [r.to_json() for r in records], stamp)
+            for record in records:
+                yield record
+
+    def _drain(limit):
+        """Yield records for parsed chunks, waiting while over :limit:."""
+        while pending:
+            index = next((i for i, (_, results) in enumerate(pending)
+                          if pool is None or results.ready()), None)
+            if index is not None:
+                for record in _finish(index):
+                    yield record
+            elif len(pending) > limit:
+                pending[0][1].wait(POLL_INTERVAL)
+            else:
+                return
+
+    def _unstamped():
+        """Yield (name, None, read) for each article read from :store:."""
+        for name, document in store.articles():
+            yield (name, None, lambda document=document: document)
+
+    articles = store.stamped_articles() if cache is not None else _unstamped()
+
+    try:
+        for name, stamp, read in articles:
+            records = None
+            if cache is not None:
+                unchanged = cache.get_unchanged(name, stamp)
+                if unchanged is not None:
+                    size, records = unchanged
+                    instrument.count("bytes", size)
+
+            if records is None:
+                document = read()
+                instrument.count("bytes", len(document))
+                key = None
+                if cache is not None:
+                    key = fingerprint(document)
+                    records = cache.get(name, key, stamp)
+
+            if records is not None:
+                for record in records:
+                    yield ArticleRecord.from_json(record)
+                continue
+
+            chunk.append(((name, document), (key, stamp)))
+            if pool is None or len(chunk) >= chunk_size:
+                _submit()
+
+            for record in _drain(2 * jobs):
+                yield record
+
+        if chunk:
+            _submit()
+
+        for record in _drain(0):
+            yield record
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+
+def pmid_sort_key(record):
+    """Get a key to sort records by PMID numerically, PMID-less last."""
+    pmid = record.pmid
+    if pmid is None:
+        return (2, 0, "")
+
+    return (0, int(pmid), "") if pmid.isdigit() else (1, 0, pmid)
 
 
 def main(argv=None):
@@ -211,19 +618,93 @@ def main(argv=None):
     argv = argv or sys.argv[1:]
     parser = argparse.ArgumentParser("Parse XML files.")
     parser.add_argument("directory",
-                        help="Directory to scan",
+                        help="Directory to scan, or a single XML file",
                         default="./Retractions",
                         type=str,
                         metavar="DIR")
+    parser.add_argument("--store",
+                        choices=("directory", "pack"),
+                        help="Read articles from XML files or a pack file "
+                             "(default is pack if DIR has one)")
+    parser.add_argument("--backend",
+                        choices=["auto"] + sorted(BACKENDS.keys()),
+                        default="auto",
+                        help="XML parser to use (default is lxml if it is "
+                             "installed)")
+    parser.add_argument("--jobs",
+                        type=int,
+                        default=1,
+                        metavar="JOBS",
+                        help="How many processes to parse DIR with")
+    parser.add_argument("--chunk-size",
+                        type=int,
+                        default=16,
+                        metavar="N",
+                        help="How many documents to send to a process "
+                             "at a time")
+    parser.add_argument("--sort",
+                        action="store_true",
+                        help="Sort output by PMID, so that it is the same "
+                             "for any number of jobs")
+    parser.add_argument("--format",
+                        choices=FORMATS,
+                        default="json",
+                        help="Write a JSON array, or one JSON record per "
+                             "line as soon as it is parsed (ndjson)")
+    parser.add_argument("--end-marker",
+                        action="store_true",
+                        help="End ndjson output with an end of stream "
+                             "line, so that readers can tell it is "
+                             "complete")
+    parser.add_argument("--cache",
+                        nargs="?",
+                        const="",
+                        metavar="PATH",
+                        help="Only parse documents which changed since they "
+                             "were cached in PATH (default is {} in DIR)"
+                             "".format(CACHE_FILE))
+    instrument.add_arguments(parser)
     parse_result = parser.parse_args(argv)
 
-    print(json.dumps([
-        parse_element_tree(
-            file_to_element_tree(os.path.join(parse_result.directory, fn))
-        )
-        for fn in os.listdir(parse_result.directory)
-        if os.path.splitext(fn)[1] == ".xml"
-    ]))
+    cache = None
+    try:
+        backend = select_backend(parse_result.backend)
+    except ValueError as error:
+        parser.error(str(error))
+
+    with instrument.instrumented("parse-pubmed-files",
+                                 parse_result) as metrics:
+        if os.path.isfile(parse_result.directory):
+            records = parse_articles(parse_result.directory,
+                                     parse_result.directory,
+                                     backend)
+        else:
+            store = open_store(parse_result.directory, parse_result.store)
+            if parse_result.cache is not None:
+                cache = ParseCache(parse_result.cache or
+                                   default_cache_path(parse_result.directory),
+                                   PARSER_VERSION)
+            records = parse_store(store,
+                                  backend,
+                                  parse_result.jobs,
+                                  parse_result.chunk_size,
+                                  cache)
+
+        records = metrics.timed("parse", records, "articles")
+        if parse_result.sort:
+            records = sorted(records, key=pmid_sort_key)
+
+        try:
+            write_records((r.to_json() for r in records),
+                          sys.stdout,
+                          parse_result.format,
+                          parse_result.end_marker)
+        finally:
+            if cache is not None:
+                cache.close()
+                metrics.count("cache_hits", cache.hits)
+                metrics.count("cache_misses", cache.misses)
+                sys.stderr.write(cache.summary() + "\n")
 
 
 if __name__ == "__main__":
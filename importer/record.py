@@ -0,0 +1,220 @@
+# /importer/record.py
+#
+# Compact in-memory representation of parsed articles.
+#
+# See /LICENCE.md for Copyright information
+"""Compact in-memory representation of parsed articles.
+
+Each article is held as an ArticleRecord, which has no per-instance
+dict. Strings which are shared between many articles, such as country,
+topic and author names, are interned, and dates are packed into a
+single integer. Records are converted to and from their JSON form at
+the edges of each command.
+"""
+
+from datetime import date
+
+
+# Interned dimension strings. This is used instead of intern(), since
+# Python 2 cannot intern unicode strings.
+_INTERNED = dict()
+
+DATE_COMPONENTS = ("Year", "Month", "Day")
+
+# The JSON name of each ArticleRecord attribute, in output order.
+JSON_FIELDS = (("pmid", "pmid"),
+               ("pubDate", "pub_date"),
+               ("reviseDate", "revise_date"),
+               ("ISSN", "issn"),
+               ("country", "country"),
+               ("Author", "authors"),
+               ("Topic", "topics"))
+
+
+def intern_string(value):
+    """Get the shared copy of the string value, or None."""
+    if value is None:
+        return None
+
+    return _INTERNED.setdefault(value, value)
+
+
+def intern_strings(values):
+    """Get a tuple of shared copies of the strings in values, or None."""
+    if values is None:
+        return None
+
+    return tuple(intern_string(v) for v in values)
+
+
+def list_or_none(values):
+    """Get values as a list, or None."""
+    return list(values) if values is not None else None
+
+
+def encode_date(year, month=1, day=1, precision=3):
+    """Pack a date into an integer.
+
+    The integer is YYYYMMDD shifted left by two bits, with the number of
+    components (Year, Month, Day) the date was given with in the low two
+    bits. Packed dates compare in the same order as the dates, so
+    date_value() can be used to compare dates regardless of precision.
+    """
+    # Validate the date in the same way as the date entries did.
+    date(year, month, day)
+    return ((year * 10000 + month * 100 + day) << 2) | precision
+
+
+def date_value(packed):
+    """Get the YYYYMMDD integer for a packed date."""
+    return packed >> 2
+
+
+def date_year(packed):
+    """Get the year of a packed date."""
+    return date_value(packed) // 10000
+
+
+def date_month(packed):
+    """Get the month of a packed date."""
+    return date_value(packed) // 100 % 100
+
+
+def unpack_date(packed):
+    """Get a date from a packed date."""
+    value = date_value(packed)
+    return date(value // 10000, value // 100 % 100, value % 100)
+
+
+def date_to_json(packed):
+    """Convert a packed date into a JSON date entry, or None."""
+    if packed is None:
+        return None
+
+    precision = packed & 3
+    return {
+        "date": unpack_date(packed).isoformat(),
+        "components": {
+            "Year": precision > 0,
+            "Month": precision > 1,
+            "Day": precision == 3
+        }
+    }
+
+
+def date_from_json(entry):
+    """Convert a JSON date entry into a packed date, or None."""
+    if entry is None:
+        return None
+
+    year, month, day = [int(s) for s in entry["date"].split("-")]
+    components = entry.get("components", None)
+    precision = (sum([bool(components.get(c, False))
+                      for c in DATE_COMPONENTS])
+                 if components is not None else 3)
+    return encode_date(year, month, day, precision)
+
+
+class ArticleRecord(object):
+    """A parsed article.
+
+    Dates are packed with encode_date. :authors: and :topics: are
+    tuples, and :topics: is None if the article had no MeshHeadingList.
+    """
+
+    __slots__ = ("pmid",
+                 "pub_date",
+                 "revise_date",
+                 "issn",
+                 "country",
+                 "authors",
+                 "topics")
+
+    def __init__(self,
+                 pmid=None,
+                 pub_date=None,
+                 revise_date=None,
+                 issn=None,
+                 country=None,
+                 authors=None,
+                 topics=None):
+        """Initialize this ArticleRecord, interning shared strings."""
+        self.pmid = pmid
+        self.pub_date = pub_date
+        self.revise_date = revise_date
+        self.issn = intern_string(issn)
+        self.country = intern_string(country)
+        self.authors = intern_strings(authors)
+        self.topics = intern_strings(topics)
+
+    def _values(self):
+        """Get a tuple of the values of this record."""
+        return tuple(getattr(self, s) for s in self.__slots__)
+
+    def __getstate__(self):
+        """Get the state of this record for pickling."""
+        return self._values()
+
+    def __setstate__(self, state):
+        """Restore this record from pickled state.
+
+        Strings are interned again, since records parsed in another
+        process do not share strings with this one.
+        """
+        self.__init__(*state)
+
+    def __eq__(self, other):
+        """Check if this record has the same values as other."""
+        return (isinstance(other, ArticleRecord) and
+                self._values() == other._values())
+
+    def __ne__(self, other):
+        """Check if this record has different values to other."""
+        return not self == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        """Represent this record."""
+        return "ArticleRecord({})".format(", ".join([
+            "{}={!r}".format(s, getattr(self, s)) for s in self.__slots__
+        ]))
+
+    def fields(self):
+        """Get the names of the JSON fields, except pmid, with values."""
+        return tuple(name for name, attribute in JSON_FIELDS[1:]
+                     if getattr(self, attribute) is not None)
+
+    def to_json(self):
+        """Convert this record into its JSON form."""
+        return {
+            "pmid": self.pmid,
+            "pubDate": date_to_json(self.pub_date),
+            "reviseDate": date_to_json(self.revise_date),
+            "ISSN": self.issn,
+            "country": self.country,
+            "Author": list_or_none(self.authors),
+            "Topic": list_or_none(self.topics)
+        }
+
+    @classmethod
+    def from_json(cls, value):
+        """Create an ArticleRecord from its JSON form.
+
+        Missing fields are treated as None.
+        """
+        return cls(value.get("pmid", None),
+                   date_from_json(value.get("pubDate", None)),
+                   date_from_json(value.get("reviseDate", None)),
+                   value.get("ISSN", None),
+                   value.get("country", None),
+                   value.get("Author", None),
+                   value.get("Topic", None))
+
+
+def as_article_record(value):
+    """Get value as an ArticleRecord, converting it from JSON if needed."""
+    if isinstance(value, ArticleRecord):
+        return value
+
+    return ArticleRecord.from_json(value)
@@ -0,0 +1,157 @@
+# /importer/snapshot.py
+#
+# Snapshot of the articles last loaded into the database.
+#
+# See /LICENCE.md for Copyright information
+"""Snapshot of the articles last loaded into the database.
+
+The snapshot is an SQLite database mapping the pmid of each loaded
+article to a digest of its record, so that an incremental load only
+writes articles which are new or changed, and can find articles which
+are no longer there. An article's digest is only updated once it has
+been committed to the graph, so articles which failed to load are
+loaded again by the next run.
+
+A snapshot also records the database it was loaded into. If it is used
+with another database, or the database has a different number of
+articles than the snapshot, it is cleared, so that every article is
+loaded again.
+"""
+
+import hashlib
+import json
+import sqlite3
+
+from importer.record import as_article_record
+
+
+SNAPSHOT_FILE = ".load-snapshot.sqlite"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS loaded (
+    pmid TEXT PRIMARY KEY,
+    digest TEXT NOT NULL
+)
+"""
+
+META_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+)
+"""
+
+
+def record_digest(record):
+    """Get a digest of the contents of an ArticleRecord."""
+    return hashlib.sha1(
+        json.dumps(record.to_json(), sort_keys=True).encode("utf-8")
+    ).hexdigest()
+
+
+class LoadSnapshot(object):
+    """Snapshot of the articles last loaded, for one incremental load."""
+
+    def __init__(self, path):
+        """Initialize this LoadSnapshot at path."""
+        self.path = path
+        self.changed = 0
+        self.unchanged = 0
+        self._pending = dict()
+        self._connection = sqlite3.connect(path)
+        self._connection.execute(SCHEMA)
+        self._connection.execute(META_SCHEMA)
+        # The pmids seen by this load, which are not kept between runs.
+        self._connection.execute(
+            "CREATE TEMPORARY TABLE seen (pmid TEXT PRIMARY KEY)"
+        )
+
+    def __len__(self):
+        """Get the number of articles in this snapshot."""
+        return self._connection.execute(
+            "SELECT COUNT(*) FROM loaded"
+        ).fetchone()[0]
+
+    def database(self):
+        """Get the URL of the database this snapshot was loaded into."""
+        row = self._connection.execute(
+            "SELECT value FROM meta WHERE key = 'database'"
+        ).fetchone()
+        return row[0] if row is not None else None
+
+    def matches(self, database_url, articles):
+        """Check if this is a snapshot of the graph at database_url.
+
+        The graph has :articles: articles, which is the same as the
+        number in this snapshot unless something else changed the
+        graph, or a full load stopped before it finished.
+        """
+        return self.database() == database_url and len(self) == articles
+
+    def clear(self, database_url):
+        """Forget every article, and record loading into database_url."""
+        self._pending.clear()
+        self._connection.execute("DELETE FROM loaded")
+        self._connection.execute(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES ('database', ?)",
+            (database_url,)
+        )
+        self._connection.commit()
+
+    def is_changed(self, record):
+        """Check if record, or its JSON form, needs to be loaded.
+
+        Records without a pmid are never loaded. Every other record is
+        marked as seen, so that it is not returned by removed().
+        """
+        record = as_article_record(record)
+        if record.pmid is None:
+            return False
+
+        digest = record_digest(record)
+        self._connection.execute("INSERT OR IGNORE INTO seen VALUES (?)",
+                                 (record.pmid,))
+        row = self._connection.execute(
+            "SELECT digest FROM loaded WHERE pmid = ?",
+            (record.pmid,)
+        ).fetchone()
+        if row is not None and row[0] == digest:
+            self.unchanged += 1
+            return False
+
+        self.changed += 1
+        self._pending[record.pmid] = digest
+        return True
+
+    def mark_loaded(self, pmids):
+        """Record that the changed articles with pmids were loaded."""
+        self._connection.executemany(
+            "INSERT OR REPLACE INTO loaded (pmid, digest) VALUES (?, ?)",
+            [(pmid, self._pending.pop(pmid)) for pmid in pmids
+             if pmid in self._pending]
+        )
+        self._connection.commit()
+
+    def removed(self):
+        """Get a list of the pmids of loaded articles which were not seen."""
+        return [row[0] for row in self._connection.execute(
+            "SELECT pmid FROM loaded WHERE pmid NOT IN (SELECT pmid FROM seen)"
+        )]
+
+    def forget(self, pmids):
+        """Record that the articles with pmids were removed."""
+        self._connection.executemany("DELETE FROM loaded WHERE pmid = ?",
+                                     [(pmid,) for pmid in pmids])
+        self._connection.commit()
+
+    def summary(self):
+        """Summarise changed and unchanged articles."""
+        return "Snapshot: {} changed, {} unchanged".format(self.changed,
+                                                           self.unchanged)
+
+    def close(self):
+        """Close this snapshot."""
+        if self._connection is not None:
+            self._connection.commit()
+            self._connection.close()
+            self._connection = None
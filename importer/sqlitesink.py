@@ -0,0 +1,194 @@
+# /importer/sqlitesink.py
+#
+# Store the article graph in an SQLite database.
+#
+# See /LICENCE.md for Copyright information
+"""Store the article graph in an SQLite database.
+
+Each relationship between an article and an Author, Country, Topic,
+Month or Year node is a row in an indexed edge table, so the charts
+the backend draws from Neo4j can be queried without a server. Batches
+are inserted in one transaction each, in WAL mode, unless they are
+inserted inside SQLiteSink.transaction(). load-pubmed-files replaces
+the whole graph in one transaction, so that readers see the old graph
+until the new one is complete, and keep it if loading fails.
+"""
+
+import argparse
+import json
+import sqlite3
+import sys
+
+from contextlib import contextmanager
+
+from importer.charts import CHARTS, FILTERS
+from importer.csvexport import related_names
+from importer.record import as_article_record
+
+
+SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS articles (
+        pmid TEXT PRIMARY KEY,
+        issn TEXT
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS edges (
+        label TEXT NOT NULL,
+        name TEXT NOT NULL,
+        pmid TEXT NOT NULL,
+        PRIMARY KEY (label, name, pmid)
+    ) WITHOUT ROWID
+    """,
+    "CREATE INDEX IF NOT EXISTS edges_by_pmid ON edges (pmid, label, name)"
+)
+
+# The ISSN of an article is only replaced if the new record has one,
+# as when merging it into Neo4j.
+INSERT_ARTICLE = ("INSERT OR REPLACE INTO articles (pmid, issn) "
+                  "VALUES (?, coalesce(?, (SELECT issn FROM articles "
+                  "WHERE pmid = ?)))")
+
+INSERT_EDGE = ("INSERT OR IGNORE INTO edges (label, name, pmid) "
+               "VALUES (?, ?, ?)")
+
+TOP_QUERY = ("SELECT name, COUNT(*) AS count FROM edges WHERE label = ? "
+             "GROUP BY name ORDER BY count DESC, name LIMIT ?")
+
+# Each edge of an article with the filter node, other than the edge to
+# the filter node itself, as Cypher never matches one relationship
+# twice in a pattern.
+FILTERED_TOP_QUERY = ("SELECT edge.name, COUNT(*) AS count "
+                      "FROM edges AS filter JOIN edges AS edge "
+                      "ON edge.pmid = filter.pmid "
+                      "WHERE filter.label = ? AND filter.name = ? "
+                      "AND edge.label = ? "
+                      "AND NOT (edge.label = filter.label AND "
+                      "edge.name = filter.name) "
+                      "GROUP BY edge.name ORDER BY count DESC, edge.name "
+                      "LIMIT ?")
+
+
+class SQLiteSink(object):
+    """Sink storing articles in the SQLite database at path."""
+
+    def __init__(self, path):
+        """Initialize this SQLiteSink, creating tables if needed."""
+        self.path = path
+        self._in_transaction = False
+        self._connection = sqlite3.connect(path)
+        self._connection.execute("PRAGMA journal_mode = WAL")
+        self._connection.execute("PRAGMA synchronous = NORMAL")
+        for statement in SCHEMA:
+            self._connection.execute(statement)
+        self._connection.commit()
+
+    @contextmanager
+    def transaction(self):
+        """A context in which reset() and load() are committed at once.
+
+        If the context is left with an error, everything done in it is
+        rolled back instead.
+        """
+        self._in_transaction = True
+        try:
+            with self._connection:
+                yield
+        finally:
+            self._in_transaction = False
+
+    @contextmanager
+    def _writing(self):
+        """A context committing what is written, unless in transaction()."""
+        if self._in_transaction:
+            yield
+        else:
+            with self._connection:
+                yield
+
+    def reset(self):
+        """Delete every article and edge."""
+        with self._writing():
+            self._connection.execute("DELETE FROM edges")
+            self._connection.execute("DELETE FROM articles")
+
+    def load(self, records):
+        """Insert a batch of records, or their JSON form.
+
+        Records without a pmid are skipped.
+        """
+        records = [r for r in (as_article_record(r) for r in records)
+                   if r.pmid is not None]
+        with self._writing():
+            self._connection.executemany(
+                INSERT_ARTICLE,
+                [(r.pmid, r.issn or None, r.pmid) for r in records]
+            )
+            self._connection.executemany(
+                INSERT_EDGE,
+                [(label, name, r.pmid)
+                 for r in records for label, name in related_names(r)]
+            )
+
+    def top(self, chart, filter_string=None, filter_type=None, limit=10):
+        """Get (name, count) tuples for chart, as /get_bar_chart does.
+
+        A ValueError is raised for unknown charts and filter types.
+        """
+        if chart not in CHARTS:
+            raise ValueError("Don't know how to get chart {}".format(chart))
+
+        if not filter_type:
+            return self._connection.execute(TOP_QUERY,
+                                            (CHARTS[chart], limit)).fetchall()
+
+        if filter_type not in FILTERS:
+            raise ValueError("Don't know how to filter on {}".format(
+                filter_type
+            ))
+
+        return self._connection.execute(FILTERED_TOP_QUERY,
+                                        (FILTERS[filter_type],
+                                         filter_string,
+                                         CHARTS[chart],
+                                         limit)).fetchall()
+
+    def close(self):
+        """Close this sink."""
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+
+def main(argv=None):
+    """Print the data for a chart from an SQLite article graph."""
+    parser = argparse.ArgumentParser(description="Query an SQLite graph")
+    parser.add_argument("database",
+                        metavar="PATH",
+                        help="Database written by load-pubmed-files --sink")
+    parser.add_argument("chart",
+                        choices=sorted(CHARTS.keys()))
+    parser.add_argument("--filter-type",
+                        choices=sorted(FILTERS.keys()))
+    parser.add_argument("--filter-string")
+    parser.add_argument("--limit",
+                        type=int,
+                        default=10)
+    parse_result = parser.parse_args(argv or sys.argv[1:])
+
+    sink = SQLiteSink(parse_result.database)
+    try:
+        rows = sink.top(parse_result.chart,
+                        parse_result.filter_string,
+                        parse_result.filter_type,
+                        parse_result.limit)
+    finally:
+        sink.close()
+
+    sys.stdout.write(json.dumps([{"name": name, "value": count}
+                                 for name, count in rows]) + "\n")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,485 @@
+# /importer/store.py
+#
+# Storage for downloaded PubMed articles.
+#
+# See /LICENCE.md for Copyright information
+"""Storage for downloaded PubMed articles.
+
+Articles can either be stored as one <pmid>.xml file per article in a
+directory, or appended to a pack file inside that directory. The pack
+file is a sequence of zlib compressed records, each prefixed by its
+PMID, with a separate append-only index mapping each PMID to the offset
+of its latest record. A record is only indexed once it has been written,
+so a record torn by an interrupted write is never read, and is cut off
+before anything else is appended.
+
+Each article can also be read with a stamp, a string which changes
+whenever its document does, but which is cheaper to get than reading
+the document, so that unchanged articles can be skipped.
+"""
+
+import argparse
+import errno
+import functools
+import os
+import struct
+import sys
+import threading
+import time
+import zlib
+
+
+PACK_FILE = "articles.pack"
+INDEX_FILE = "articles.idx"
+
+# Each record starts with the length of the PMID and the length of the
+# compressed document that follows it.
+RECORD_HEADER = struct.Struct(">II")
+
+# Files modified less than this many seconds ago have no stamp, since
+# they could be modified again without changing their modification time
+# on file systems with a coarse resolution.
+STAMP_RESOLUTION = 2.0
+
+
+def read_file(path):
+    """Read the bytes in the file at path."""
+    with open(path, "rb") as in_file:
+        return in_file.read()
+
+
+def file_stamp(path, clock=time.time):
+    """Get the size and modification time of the file at path as a stamp.
+
+    Returns None if the file was modified too recently for its
+    modification time to be sure to change when it is modified again.
+    """
+    status = os.stat(path)
+    if status.st_mtime > clock() - STAMP_RESOLUTION:
+        return None
+
+    return "{}:{!r}".format(status.st_size, status.st_mtime)
+
+
+def ensure_directory(location):
+    """Create location if it doesn't exist already."""
+    try:
+        os.makedirs(location)
+    except OSError as error:
+        if error.errno != errno.EEXIST:
+            raise error
+
+
+class CorruptPackError(Exception):
+    """Exception raised if a pack file cannot be read."""
+
+    def __init__(self, path, offset):
+        """Initialize this exception with the path and offset."""
+        Exception.__init__(self)
+        self._path = path
+        self._offset = offset
+
+    def __str__(self):
+        """Convert to string."""
+        return "Truncated or corrupt record in {} at offset {}".format(
+            self._path,
+            self._offset
+        )
+
+
+class DirectoryStore(object):
+    """Store each article as <pmid>.xml in a directory."""
+
+    def __init__(self, location):
+        """Initialize this DirectoryStore in location."""
+        self.location = location
+
+    def path(self, pmid):
+        """Get the path that pmid is stored at."""
+        return os.path.join(self.location, pmid + ".xml")
+
+    def __contains__(self, pmid):
+        """Check if pmid is in this store."""
+        return os.path.isfile(self.path(pmid))
+
+    def write(self, pmid, document):
+        """Write document, which is bytes, as the article for pmid."""
+        with open(self.path(pmid), "wb") as out_file:
+            out_file.write(document)
+
+    def read(self, pmid):
+        """Read the document for pmid."""
+        with open(self.path(pmid), "rb") as in_file:
+            return in_file.read()
+
+    def articles(self):
+        """Yield a (filename, document) tuple for each article."""
+        for filename in os.listdir(self.location):
+            if os.path.splitext(filename)[1] == ".xml":
+                yield (filename,
+                       read_file(os.path.join(self.location, filename)))
+
+    def stamped_articles(self):
+        """Yield a (filename, stamp, read) tuple for each article.
+
+        The stamp is the size and modification time of the file, and
+        read is a function which reads the document.
+        """
+        for filename in os.listdir(self.location):
+            if os.path.splitext(filename)[1] == ".xml":
+                path = os.path.join(self.location, filename)
+                yield (filename,
+                       file_stamp(path),
+                       functools.partial(read_file, path))
+
+    def close(self):
+        """Close this store."""
+        pass
+
+
+class PackStore(object):
+    """Append articles to a compressed pack file with a PMID index.
+
+    Writing an article which is already in the pack appends a new
+    record, which supersedes the old one. Writes are thread safe.
+    """
+
+    def __init__(self, location):
+        """Initialize this PackStore in location."""
+        self.location = location
+        self.pack_path = os.path.join(location, PACK_FILE)
+        self.index_path = os.path.join(location, INDEX_FILE)
+        self._index = read_index(self.index_path)
+        self._pack = None
+        self._index_file = None
+        self._lock = threading.Lock()
+
+    def __contains__(self, pmid):
+        """Check if pmid is in this store."""
+        return pmid in self._index
+
+    def __len__(self):
+        """Get the number of articles in this store."""
+        return len(self._index)
+
+    def _indexed_end(self):
+        """Get the offset just after the last valid indexed record.
+
+        The index can be written to disk before the pack it indexes, so
+        indexed records at the end of the pack can be torn or corrupt
+        after a crash. Their index entries are dropped, so that they are
+        cut off and written again, and the index is rewritten without
+        them, so that they never point at records appended later.
+        """
+        end = 0
+        dropped = False
+        with open(self.pack_path, "rb") as pack:
+            for offset in sorted(set(self._index.values()), reverse=True):
+                pack.seek(offset)
+                try:
+                    if read_record(pack, self.pack_path) is not None:
+                        end = pack.tell()
+                        break
+                except CorruptPackError:
+                    pass
+
+                self._index = dict((pmid, indexed) for pmid, indexed
+                                   in self._index.items()
+                                   if indexed != offset)
+                dropped = True
+
+        if dropped:
+            write_index(self.index_path, self._index)
+
+        return end
+
+    def _open_for_append(self):
+        """Open the pack and index, cutting off any torn record or line.
+
+        Complete records after the last valid indexed one are kept,
+        although they are never read, since they may be all that is left
+        of a pack whose index was lost.
+        """
+        ensure_directory(self.location)
+        truncate_partial_line(self.index_path)
+        end = 0
+        if os.path.isfile(self.pack_path):
+            end = self._indexed_end()
+
+        self._pack = open(self.pack_path, "ab")
+        self._index_file = open(self.index_path, "a")
+        with open(self.pack_path, "rb") as pack:
+            pack.seek(end)
+            while True:
+                end = pack.tell()
+                try:
+                    if read_record(pack, self.pack_path) is None:
+                        break
+                except CorruptPackError:
+                    self._pack.truncate(end)
+                    break
+
+    def write(self, pmid, document):
+        """Append document, which is bytes, as the article for pmid."""
+        encoded_pmid = pmid.encode("utf-8")
+        compressed = zlib.compress(document)
+        record = (RECORD_HEADER.pack(len(encoded_pmid), len(compressed)) +
+                  encoded_pmid +
+                  compressed)
+        with self._lock:
+            if self._pack is None:
+                self._open_for_append()
+
+            # Files opened for appending start at offset zero on some
+            # platforms until the first write, so seek explicitly.
+            self._pack.seek(0, os.SEEK_END)
+            offset = self._pack.tell()
+            self._pack.write(record)
+            self._pack.flush()
+            self._index_file.write("{}\t{}\n".format(pmid, offset))
+            self._index_file.flush()
+            self._index[pmid] = offset
+
+    def read(self, pmid):
+        """Read the document for pmid."""
+        with open(self.pack_path, "rb") as pack:
+            pack.seek(self._index[pmid])
+            return read_record(pack, self.pack_path)[2]
+
+    def _records(self):
+        """Yield (offset, pmid, compressed) for each article, in pack order.
+
+        Superseded records are skipped, and reading stops at the last
+        indexed record, so that a torn record after it is not read.
+        """
+        if not self._index or not os.path.isfile(self.pack_path):
+            return
+
+        last = max(self._index.values())
+        with open(self.pack_path, "rb") as pack:
+            while pack.tell() <= last:
+                record = read_compressed_record(pack, self.pack_path)
+                if record is None:
+                    return
+
+                offset, pmid, compressed = record
+                if self._index.get(pmid, None) == offset:
+                    yield record
+
+    def articles(self):
+        """Yield a (pmid, document) tuple for each article, in pack order.
+
+        Superseded records are skipped, and reading stops at the last
+        indexed record, so that a torn record after it is not read.
+        """
+        for offset, pmid, compressed in self._records():
+            yield (pmid, decompress_record(self.pack_path,
+                                           offset,
+                                           compressed))
+
+    def stamped_articles(self):
+        """Yield a (pmid, stamp, read) tuple for each article, in pack order.
+
+        The stamp is the length and CRC-32 of the compressed record, and
+        read is a function which decompresses the document, so that
+        records are only decompressed if they are read.
+        """
+        for offset, pmid, compressed in self._records():
+            yield (pmid,
+                   "{}:{}".format(len(compressed),
+                                  zlib.crc32(compressed) & 0xffffffff),
+                   functools.partial(decompress_record,
+                                     self.pack_path,
+                                     offset,
+                                     compressed))
+
+    def close(self):
+        """Close the pack and index files."""
+        with self._lock:
+            if self._pack is not None:
+                self._pack.close()
+                self._index_file.close()
+                self._pack = None
+                self._index_file = None
+
+
+def read_index(path):
+    """Read a pack index at path into a dict of PMID to offset.
+
+    Later entries for the same PMID replace earlier ones. A last line
+    without a newline was torn by an interrupted write, and is skipped.
+    """
+    index = dict()
+    try:
+        with open(path, "r") as index_file:
+            for line in index_file:
+                if not line.endswith("\n"):
+                    break
+
+                fields = line.split()
+                if len(fields) == 2:
+                    index[fields[0]] = int(fields[1])
+    except IOError as error:
+        if error.errno != errno.ENOENT:
+            raise error
+
+    return index
+
+
+def write_index(path, index):
+    """Replace the pack index at path with index, in pack order.
+
+    The index is replaced in one step, so that an interrupted write
+    leaves the old index.
+    """
+    temporary = path + ".tmp"
+    with open(temporary, "w") as index_file:
+        for pmid, offset in sorted(index.items(), key=lambda e: e[1]):
+            index_file.write("{}\t{}\n".format(pmid, offset))
+
+    os.rename(temporary, path)
+
+
+def truncate_partial_line(path):
+    """Cut off a last line without a newline from the file at path."""
+    try:
+        with open(path, "rb+") as text_file:
+            text_file.seek(0, os.SEEK_END)
+            end = text_file.tell()
+            position = end
+            while position > 0:
+                start = max(0, position - 4096)
+                text_file.seek(start)
+                chunk = text_file.read(position - start)
+                if position == end and chunk.endswith(b"\n"):
+                    return
+
+                newline = chunk.rfind(b"\n")
+                if newline != -1:
+                    text_file.truncate(start + newline + 1)
+                    return
+
+                position = start
+
+            text_file.truncate(0)
+    except IOError as error:
+        if error.errno != errno.ENOENT:
+            raise error
+
+
+def read_compressed_record(pack, path):
+    """Read the record at the current position of pack.
+
+    Returns an (offset, pmid, compressed) tuple, where compressed is
+    the compressed document, or None at the end of the pack.
+    """
+    offset = pack.tell()
+    header = pack.read(RECORD_HEADER.size)
+    if not header:
+        return None
+
+    if len(header) != RECORD_HEADER.size:
+        raise CorruptPackError(path, offset)
+
+    pmid_length, compressed_length = RECORD_HEADER.unpack(header)
+    pmid = pack.read(pmid_length)
+    compressed = pack.read(compressed_length)
+    if len(pmid) != pmid_length or len(compressed) != compressed_length:
+        raise CorruptPackError(path, offset)
+
+    try:
+        return (offset, pmid.decode("utf-8"), compressed)
+    except UnicodeDecodeError:
+        raise CorruptPackError(path, offset)
+
+
+def decompress_record(path, offset, compressed):
+    """Decompress the document in the record at offset in the pack."""
+    try:
+        return zlib.decompress(compressed)
+    except zlib.error:
+        raise CorruptPackError(path, offset)
+
+
+def read_record(pack, path):
+    """Read the record at the current position of pack.
+
+    Returns an (offset, pmid, document) tuple, or None at the end of
+    the pack.
+    """
+    record = read_compressed_record(pack, path)
+    if record is None:
+        return None
+
+    offset, pmid, compressed = record
+    return (offset, pmid, decompress_record(path, offset, compressed))
+
+
+def is_pack(location):
+    """Check if location contains a pack file."""
+    return os.path.isfile(os.path.join(location, PACK_FILE))
+
+
+def open_store(location, kind=None):
+    """Open the article store in location.
+
+    If kind is not set, a PackStore is used if location contains a
+    pack file, otherwise a DirectoryStore.
+    """
+    if kind is None:
+        kind = "pack" if is_pack(location) else "directory"
+
+    return {
+        "pack": PackStore,
+        "directory": DirectoryStore
+    }[kind](location)
+
+
+def migrate_directory(location, remove=False):
+    """Append all <pmid>.xml files in location to a pack in location.
+
+    Articles already in the pack are not added again. If remove is set,
+    each file is removed once it is in the pack. Returns the number of
+    articles added.
+    """
+    directory = DirectoryStore(location)
+    pack = PackStore(location)
+    added = 0
+    try:
+        for filename in sorted(os.listdir(location)):
+            pmid, extension = os.path.splitext(filename)
+            if extension != ".xml":
+                continue
+
+            if pmid not in pack:
+                pack.write(pmid, directory.read(pmid))
+                added += 1
+
+            if remove:
+                os.remove(directory.path(pmid))
+    finally:
+        pack.close()
+
+    return added
+
+
+def main(argv=None):
+    """Move articles downloaded into a directory into a pack file."""
+    parser = argparse.ArgumentParser(description="Pack downloaded articles")
+    parser.add_argument("location",
+                        default="Retractions",
+                        type=str,
+                        nargs="?",
+                        metavar="DIR",
+                        help="Directory of downloaded articles")
+    parser.add_argument("--remove",
+                        action="store_true",
+                        help="Remove each XML file once it is packed")
+    parse_result = parser.parse_args(argv or sys.argv[1:])
+
+    added = migrate_directory(parse_result.location, parse_result.remove)
+    sys.stderr.write("Packed {} articles.\n".format(added))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
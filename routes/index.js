@@ -21,35 +21,57 @@ var filters = {
   year: "Year"
 };
 
+/* Chart summaries are stored by the importer once a load is done, so
+ * that common charts are looked up instead of counted on every request. */
+var SUMMARY_QUERY = "MATCH (s:ChartSummary { key: {key} }) RETURN s.key, s.data";
+
 /* GET home page. */
 
 router.get("/", function handleIndexRequest(req, res) {
   res.render("pubmedRetraction");
 });
 
+/**
+ * isUnfiltered
+ *
+ * Check if a chart is not being filtered. The "No Filter" option in the
+ * page sends a filter type of "none".
+ *
+ * @filterType {string} - What type of data we might be filtering on
+ * @returns {boolean} - Whether the chart is unfiltered
+ */
+function isUnfiltered(filterType) {
+  return !filterType || filterType === "none";
+}
+
 /**
  * generateMatchStatement
  *
  * Generates a neo4j match statement based on some criteria. The match statement
  * either starts from the chartName node if we want all results, or starts
  * from the filterType node (and links to the chartName node) if we're filtering
- * on something
+ * on something. The filter node is looked up by the {filterString} parameter,
+ * so that the unique constraint on its name created by the importer is used
+ * as an index, and the query is only planned once.
  *
  * @chartName {string} - The name of the chart that we are going to display
  * @filterType {string} - What type of data we might be filtering on
- * @filterString {string} - The string to filter on for the filtered type
  * @returns {string} - A match statement to start a neo4j query with
  */
-function generateMatchStatement(chartName, filterType, filterString) {
+function generateMatchStatement(chartName, filterType) {
   if (Object.keys(names).indexOf(chartName) === -1) {
     throw new Error("Don't know how to get chart " + chartName);
   }
 
-  if (!filterType) {
+  if (isUnfiltered(filterType)) {
     return "MATCH(a:" + names[chartName] + ")-[r]-()";
   }
 
-  return "MATCH(f:" + filters[filterType] + " { name: '" + filterString + "'})-[fr]-(t:Article)-[r]-(a:" + names[chartName] + ")";
+  if (Object.keys(filters).indexOf(filterType) === -1) {
+    throw new Error("Don't know how to filter on " + filterType);
+  }
+
+  return "MATCH(f:" + filters[filterType] + " { name: {filterString} })-[fr]-(t:Article)-[r]-(a:" + names[chartName] + ")";
 }
 
 /**
@@ -62,15 +84,35 @@ function generateMatchStatement(chartName, filterType, filterString) {
  * @chartName {string}: The chart name to generate
  * @filterString {string}: A string which may be used to filter on
  * @filterType {string}: What we are filtering for
- * @returns {array}: An array of tuples of (string, value)
+ * @returns {object}: The query, and the parameters to run it with
  */
 function generateQueryForChart(chartName, filterString, filterType) {
-  var matchStatement = generateMatchStatement(chartName,
-                                              filterType,
-                                              filterString);
+  var matchStatement = generateMatchStatement(chartName, filterType);
   var limitStatement = ("RETURN a, count(r) as rel_count " +
                         "ORDER BY rel_count desc LIMIT 10");
-  return [matchStatement, limitStatement].join(" ");
+  return {
+    query: [matchStatement, limitStatement].join(" "),
+    params: { filterString: filterString }
+  };
+}
+
+/**
+ * summaryKey
+ *
+ * Get the key of the summary the importer stores for a chart. This must
+ * match summary_key in importer/charts.py.
+ *
+ * @chartName {string}: The chart name
+ * @filterString {string}: A string which may be used to filter on
+ * @filterType {string}: What we are filtering for
+ * @returns {string}: The key of the chart's summary
+ */
+function summaryKey(chartName, filterString, filterType) {
+  if (isUnfiltered(filterType)) {
+    return JSON.stringify([chartName, null, null]);
+  }
+
+  return JSON.stringify([chartName, filterType, filterString || null]);
 }
 
 /**
@@ -113,36 +155,50 @@ router.get("/get_bar_chart", function onGetBarChart(req, res) {
     return;
   }
 
-  db.cypherQuery(query, function handleQueryRes(err, result) {
-    var accumulator = {};
-
-    if (err) {
+  db.cypherQuery(SUMMARY_QUERY, {
+    key: summaryKey(req.query.name, req.query.filterString, req.query.filterType)
+  }, function handleSummaryRes(summaryErr, summary) {
+    /* Charts without a summary, such as ones filtered on an uncommon
+     * name, are counted from the graph */
+    if (!summaryErr && summary.data.length) {
       res.json({
-        result: "failure",
-        reason: String(err)
+        result: "success",
+        data: JSON.parse(summary.data[0][1])
       });
       return;
     }
 
-    /* Merge together entities that really have the same name but
-     * with a different capitalisation convention */
-    result.data.forEach(function forEachRow(r) {
-      var name = normaliseName(r[0].name);
-      if (Object.keys(accumulator).indexOf(name) !== -1) {
-        accumulator[name] += r[1];
-      } else {
-        accumulator[name] = r[1];
+    db.cypherQuery(query.query, query.params, function handleQueryRes(err, result) {
+      var accumulator = {};
+
+      if (err) {
+        res.json({
+          result: "failure",
+          reason: String(err)
+        });
+        return;
       }
-    });
 
-    res.json({
-      result: "success",
-      data: Object.keys(accumulator).map(function forEachKey(k) {
-        return {
-          name: k,
-          value: accumulator[k]
-        };
-      })
+      /* Merge together entities that really have the same name but
+       * with a different capitalisation convention */
+      result.data.forEach(function forEachRow(r) {
+        var name = normaliseName(r[0].name);
+        if (Object.keys(accumulator).indexOf(name) !== -1) {
+          accumulator[name] += r[1];
+        } else {
+          accumulator[name] = r[1];
+        }
+      });
+
+      res.json({
+        result: "success",
+        data: Object.keys(accumulator).map(function forEachKey(k) {
+          return {
+            name: k,
+            value: accumulator[k]
+          };
+        })
+      });
     });
   });
 });
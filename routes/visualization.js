@@ -16,21 +16,29 @@ router.get("/", function handleIndexRequest(req, res) {
 /**
  * generateQueryForVisualization
  *
- * Given a @chartName generate a Neo4j query which will yield tuples
- * generating that chart. @arguments is applied to the function generating
- * the query.
+ * Given a @filterType generate a Neo4j query which will yield tuples
+ * generating the visualization. The filtered node is looked up by the
+ * {filterString} parameter, so that the unique constraint on its name is
+ * used as an index.
  *
- * @chartName {string}: The chart name to generate
  * @filterString {string}: A string which may be used to filter on
  * @filterType {string}: What we are filtering for
- * @returns {array}: An array of tuples of (string, value)
+ * @returns {object}: The query, and the parameters to run it with
  */
 function generateQueryForVisualization(filterString, filterType) {
   var filterTypeDispatch = {
-    country: "MATCH(c:Country { name: '" + filterString + "' })-[ra]-(a:Article)-[rt]-(t:Topic) RETURN c, ra, a, rt, t",
-    topic: "MATCH(t:Topic { name: '" + filterString + "' })-[ra]-(a:Article)-[rt]-(c:Country) RETURN t, ra, a, rt, c"
+    country: "MATCH(c:Country { name: {filterString} })-[ra]-(a:Article)-[rt]-(t:Topic) RETURN c, ra, a, rt, t",
+    topic: "MATCH(t:Topic { name: {filterString} })-[ra]-(a:Article)-[rt]-(c:Country) RETURN t, ra, a, rt, c"
+  };
+
+  if (Object.keys(filterTypeDispatch).indexOf(filterType) === -1) {
+    throw new Error("Don't know how to filter on " + filterType);
+  }
+
+  return {
+    query: filterTypeDispatch[filterType] + " LIMIT 75",
+    params: { filterString: filterString }
   };
-  return filterTypeDispatch[filterType] + " LIMIT 75";
 }
 
 /**
@@ -103,7 +111,7 @@ router.get("/get_visualisation", function onGetBarChart(req, res) {
     return;
   }
 
-  db.cypherQuery(query, function handleQueryRes(err, result) {
+  db.cypherQuery(query.query, query.params, function handleQueryRes(err, result) {
     if (err) {
       res.json({
         result: "failure",
@@ -84,42 +84,36 @@ app.post("/start_crawling", function startCrawling(req, res) {
           resolve();
         }
       });
-    }).then(function parseDocuments() {
-      return new Promise(function parseXML(resolve, reject) {
-        // Create child python process
-        var loadProc = spawn("./python-virtualenv/bin/python", ["./python-virtualenv/bin/parse-pubmed-files", "Retractions"], {
-          stdio: ["pipe", "pipe", "pipe"]
-        });
-        var stdout = [];
-        loadProc.on("exit", function onExit(code, signal) {
-          if (code !== 0 || signal) {
-            reject("Crawling process failed with " + code + " " + signal);
-          } else {
-            console.log(stdout.join(""));  // eslint-disable-line no-console
-            resolve(JSON.parse(stdout.join("")));
-          }
-        });
-        loadProc.stdout.on("data", function onData(data) {
-          stdout.push(String(data));
-        });
+    }).then(function parseAndLoadDocuments() {
+      // Records are streamed from the parser into the loader as NDJSON,
+      // so loading starts as soon as the first article is parsed. The
+      // loader requires the parser's end marker, so that it does not
+      // treat the output of a parser which crashed as complete.
+      var parseProc = spawn("./python-virtualenv/bin/python", ["./python-virtualenv/bin/parse-pubmed-files", "Retractions", "--format", "ndjson", "--end-marker", "--cache"], {
+        stdio: ["ignore", "pipe", "inherit"]
       });
-    }).then(function loadDatabase(json) {
-      return new Promise(function loadDB(resolve, reject) {
-        // Create child python process
-        var loadProc = spawn("./python-virtualenv/bin/python", ["./python-virtualenv/bin/load-pubmed-files"], {
-          stdio: ["pipe", "inherit", "inherit"]
-        });
-        // Crawling is completed now, resolve or reject promise
-        loadProc.on("exit", function onExit(code, signal) {
-          if (code !== 0 || signal) {
-            reject("Crawling process failed with " + code + " " + signal);
-          } else {
-            resolve();
-          }
-        });
-        loadProc.stdin.write(JSON.stringify(json));
-        loadProc.stdin.end();
+      var loadProc = spawn("./python-virtualenv/bin/python", ["./python-virtualenv/bin/load-pubmed-files", "--incremental", "--require-end-marker"], {
+        stdio: ["pipe", "inherit", "inherit"]
       });
+
+      parseProc.stdout.pipe(loadProc.stdin);
+
+      function exited(proc, name) {
+        return new Promise(function onProcExit(resolve, reject) {
+          proc.on("exit", function onExit(code, signal) {
+            if (code !== 0 || signal) {
+              reject(name + " process failed with " + code + " " + signal);
+            } else {
+              resolve();
+            }
+          });
+        });
+      }
+
+      return Promise.all([
+        exited(parseProc, "Parsing"),
+        exited(loadProc, "Loading")
+      ]);
     }).then(function onDone() {
       done();
     })
@@ -25,7 +25,7 @@ setup(name="pubmed-retraction-analysis",
       url="http://github.com/smspillaz/pubmed-retraction-analysis",
       license="MIT",
       keywords="development",
-      packages=find_packages(exclude=["test"]),
+      packages=find_packages(exclude=["test", "benchmarks"]),
       install_requires=["setuptools"],
       extras_require={
           "green": ["testtools",
@@ -35,6 +35,7 @@ setup(name="pubmed-retraction-analysis",
                     "mock",
                     "setuptools-green>=0.0.13",
                     "six"],
+          "lxml": ["lxml"],
           "polysquarelint": ["polysquare-setuptools-lint>=0.0.19"],
           "upload": ["setuptools-markdown"]
       },
@@ -43,6 +44,9 @@ setup(name="pubmed-retraction-analysis",
               "download-pubmed-articles=importer.downloader:main",
               "parse-pubmed-files=importer.parsexml:main",
               "load-pubmed-files=importer.load:main",
+              "pack-pubmed-articles=importer.store:main",
+              "compact-parse-cache=importer.cache:main",
+              "query-pubmed-sqlite=importer.sqlitesink:main",
               "generate-representative-pubmed-sample="
               "importer.generate_representative_sample:main"
           ]
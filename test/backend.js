@@ -76,6 +76,20 @@ describe("Web Server Backend", function bootingServer() {
       });
     });
 
+    it("4.5.10.1 treats the No Filter option as no filter", function getNF(done) {
+      request.get(serverUrl(serverBase, "/get_bar_chart"), {
+        qs: {
+          name: "authorRetraction",
+          filterType: "none"
+        }
+      }, function onData(error, response, body) {
+        var result = JSON.parse(body);
+        expect(result.result).to.equal("success");
+        expect(result.data.slice(0, 2)).to.deep.equal(REPRESENTATIVE_BAR_CHART);
+        done();
+      });
+    });
+
     it("4.5.10.2 returns an error for nonexistent charts", function retE(done) {
       request.get(serverUrl(serverBase, "/get_bar_chart"), {
         qs: {
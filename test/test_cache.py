@@ -0,0 +1,154 @@
+# /test/test_cache.py
+#
+# Tests for the parse cache.
+#
+# See /LICENCE.md for Copyright information
+"""Tests for the parse cache."""
+
+import os
+
+import shutil
+
+import sqlite3
+
+import tempfile
+
+from importer import cache
+
+from testtools import TestCase
+from testtools.matchers import (Equals, Is)
+
+
+RECORDS = [{"pmid": "1", "Author": ["A"]}]
+
+
+class FakeClock(object):
+    """A clock which only moves when told to."""
+
+    def __init__(self):
+        """Start at time zero."""
+        self.now = 0.0
+
+    def __call__(self):
+        """Get the current time."""
+        return self.now
+
+
+class TestParseCache(TestCase):
+    """Test caching parsed records."""
+
+    def setUp(self):
+        """Create a directory for the cache."""
+        super(TestParseCache, self).setUp()
+        location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, location)
+        self.path = cache.default_cache_path(location)
+        self.clock = FakeClock()
+
+    def open_cache(self, version="1"):
+        """Open the cache for parser version."""
+        parse_cache = cache.ParseCache(self.path, version, self.clock)
+        self.addCleanup(parse_cache.close)
+        return parse_cache
+
+    def test_records_read_back_in_new_session(self):
+        """Records put in the cache are there when it is opened again."""
+        key = cache.fingerprint(b"document")
+        parse_cache = self.open_cache()
+        parse_cache.put("1.xml", key, RECORDS)
+        parse_cache.close()
+        self.assertThat(self.open_cache().get("1.xml", key),
+                        Equals(RECORDS))
+
+    def test_changed_document_misses(self):
+        """A document with different contents is not in the cache."""
+        parse_cache = self.open_cache()
+        parse_cache.put("1.xml", cache.fingerprint(b"old"), RECORDS)
+        self.assertThat(parse_cache.get("1.xml", cache.fingerprint(b"new")),
+                        Is(None))
+
+    def test_other_parser_version_misses(self):
+        """Records from another parser version are not used."""
+        key = cache.fingerprint(b"document")
+        parse_cache = self.open_cache("1")
+        parse_cache.put("1.xml", key, RECORDS)
+        parse_cache.close()
+        self.assertThat(self.open_cache("2").get("1.xml", key), Is(None))
+
+    def test_counts_hits_and_misses(self):
+        """Hits and misses are counted."""
+        key = cache.fingerprint(b"document")
+        parse_cache = self.open_cache()
+        parse_cache.get("1.xml", key)
+        parse_cache.put("1.xml", key, RECORDS)
+        parse_cache.get("1.xml", key)
+        parse_cache.get("1.xml", key)
+        self.assertThat((parse_cache.hits, parse_cache.misses),
+                        Equals((2, 1)))
+
+    def test_unchanged_stamp_hits_without_document(self):
+        """Entries with the same stamp are used without a fingerprint."""
+        parse_cache = self.open_cache()
+        parse_cache.put("1.xml", cache.fingerprint(b"1"), RECORDS, "stamp")
+        self.assertThat(parse_cache.get_unchanged("1.xml", "stamp"),
+                        Equals((1, RECORDS)))
+        self.assertThat(parse_cache.hits, Equals(1))
+
+    def test_changed_stamp_not_counted_as_miss(self):
+        """A changed or missing stamp is left for get to check."""
+        parse_cache = self.open_cache()
+        parse_cache.put("1.xml", cache.fingerprint(b"1"), RECORDS, "old")
+        self.assertThat((parse_cache.get_unchanged("1.xml", "new"),
+                         parse_cache.get_unchanged("1.xml", None),
+                         parse_cache.misses),
+                        Equals((None, None, 0)))
+
+    def test_fingerprint_hit_updates_stamp(self):
+        """A document with a new stamp but the same bytes is restamped."""
+        key = cache.fingerprint(b"1")
+        parse_cache = self.open_cache()
+        parse_cache.put("1.xml", key, RECORDS, "old")
+        parse_cache.get("1.xml", key, "new")
+        self.assertThat(parse_cache.get_unchanged("1.xml", "new"),
+                        Equals((1, RECORDS)))
+
+    def test_cache_without_stamps_upgraded(self):
+        """Caches written before stamps were kept can still be used."""
+        connection = sqlite3.connect(self.path)
+        connection.execute("CREATE TABLE parsed (name TEXT PRIMARY KEY, "
+                           "size INTEGER NOT NULL, digest TEXT NOT NULL, "
+                           "version TEXT NOT NULL, records TEXT NOT NULL, "
+                           "used REAL NOT NULL)")
+        key = cache.fingerprint(b"1")
+        connection.execute("INSERT INTO parsed VALUES (?, ?, ?, ?, ?, ?)",
+                           ("1.xml", key[0], key[1], "1", "[]", 0.0))
+        connection.commit()
+        connection.close()
+        parse_cache = self.open_cache()
+        self.assertThat((parse_cache.get("1.xml", key, "stamp"),
+                         parse_cache.get_unchanged("1.xml", "stamp")),
+                        Equals(([], (1, []))))
+
+    def test_compact_evicts_unused_entries(self):
+        """Entries not used since max_age ago are evicted."""
+        parse_cache = self.open_cache()
+        parse_cache.put("1.xml", cache.fingerprint(b"1"), RECORDS)
+        parse_cache.put("2.xml", cache.fingerprint(b"2"), RECORDS)
+        parse_cache.close()
+
+        self.clock.now = 100.0
+        parse_cache = self.open_cache()
+        parse_cache.get("2.xml", cache.fingerprint(b"2"))
+        self.assertThat(parse_cache.compact(50.0), Equals(1))
+        self.assertThat(len(parse_cache), Equals(1))
+        self.assertThat(parse_cache.get("2.xml", cache.fingerprint(b"2")),
+                        Equals(RECORDS))
+
+    def test_compact_command(self):
+        """The compact command evicts entries from a cache file."""
+        parse_cache = self.open_cache()
+        parse_cache.put("1.xml", cache.fingerprint(b"1"), RECORDS)
+        parse_cache.close()
+        cache.main([self.path, "--max-age", "0"])
+        self.assertThat(len(self.open_cache()), Equals(0))
+        self.assertThat(os.path.isfile(self.path), Equals(True))
@@ -0,0 +1,89 @@
+# /test/test_charts.py
+#
+# Tests for precomputing the bar charts the backend draws.
+#
+# See /LICENCE.md for Copyright information
+"""Tests for precomputing the bar charts the backend draws."""
+
+import json
+
+from importer import charts
+
+from testtools import TestCase
+from testtools.matchers import Contains, Equals
+
+
+class FakeRunner(object):
+    """Runner returning the same rows for every chart statement."""
+
+    def __init__(self, rows):
+        """Initialize this FakeRunner with (name, count) rows."""
+        self.rows = rows
+        self.transactions = []
+
+    def run(self, statements):
+        """Record statements, returning rows for the first one."""
+        self.transactions.append(statements)
+        return [[{"name": name, "rel_count": count}
+                 for name, count in self.rows]]
+
+
+class TestChartData(TestCase):
+    """Test merging chart rows as the backend does."""
+
+    def test_names_normalised(self):
+        """Each word of a name is put in title case."""
+        self.assertThat(charts.normalise_name(u"UNITED STATES of america"),
+                        Equals(u"United States Of America"))
+
+    def test_names_differing_by_case_merged(self):
+        """Counts for names which only differ by case are added up."""
+        self.assertThat(charts.chart_data([(u"ENGLAND", 3),
+                                           (u"Japan", 2),
+                                           (u"England", 1)]),
+                        Equals([{"name": u"England", "value": 4},
+                                {"name": u"Japan", "value": 2}]))
+
+    def test_numeric_names_ordered_first(self):
+        """Names like years come first in ascending order, as in JS."""
+        self.assertThat([row["name"] for row in charts.chart_data([
+            (u"2012", 5), (u"Topic", 4), (u"2009", 3), (u"02", 1)
+        ])], Equals([u"2009", u"2012", u"Topic", u"02"]))
+
+    def test_summary_key(self):
+        """Keys are compact JSON, as JSON.stringify gives."""
+        self.assertThat([charts.summary_key("topicRetraction"),
+                         charts.summary_key("topicRetraction",
+                                            "year",
+                                            u"2011")],
+                        Equals([u"[\"topicRetraction\",null,null]",
+                                u"[\"topicRetraction\",\"year\",\"2011\"]"]))
+
+
+class TestChartSummaries(TestCase):
+    """Test computing and writing chart summaries."""
+
+    def test_summaries_for_charts_and_top_filters(self):
+        """Each chart is summarised alone and filtered on its top names."""
+        runner = FakeRunner([(u"A", 2), (u"B", 1)])
+        summaries = charts.chart_summaries(runner)
+        self.assertThat(len(summaries),
+                        Equals(len(charts.CHARTS) +
+                               2 * len(charts.FILTERS) * len(charts.CHARTS)))
+        self.assertThat(summaries,
+                        Contains(charts.summary_key("countryRetraction",
+                                                    "author",
+                                                    u"B")))
+
+    def test_summaries_replaced_in_one_transaction(self):
+        """Old summaries are deleted in the same transaction as written."""
+        runner = FakeRunner([(u"A", 2)])
+        charts.write_chart_summaries(runner)
+        statements, parameters = zip(*runner.transactions[-1])
+        self.assertThat(statements,
+                        Equals((charts.DELETE_SUMMARIES_STATEMENT,
+                                charts.CREATE_SUMMARIES_STATEMENT)))
+        summary = [s for s in parameters[1]["summaries"]
+                   if s["key"] == charts.summary_key("topicRetraction")]
+        self.assertThat(json.loads(summary[0]["data"]),
+                        Equals([{"name": u"A", "value": 2}]))
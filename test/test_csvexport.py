@@ -0,0 +1,127 @@
+# /test/test_csvexport.py
+#
+# Tests for exporting articles for the offline bulk importer.
+#
+# See /LICENCE.md for Copyright information
+"""Tests for exporting articles for the offline bulk importer."""
+
+import io
+
+import os
+
+import shutil
+
+import tempfile
+
+from importer import csvexport
+
+from testtools import TestCase
+from testtools.matchers import (Contains, Equals, Not)
+
+
+ARTICLE = {
+    "pmid": "1",
+    "pubDate": {"date": "2011-11-11"},
+    "ISSN": "1234-5678",
+    "country": "Australia",
+    "Author": ["A Author", "A Author", "O'Brien, \"Jr\""],
+    "Topic": ["Topic"]
+}
+
+
+class TestExportCSV(TestCase):
+    """Test exporting articles as CSV files."""
+
+    def setUp(self):
+        """Create a directory to export into."""
+        super(TestExportCSV, self).setUp()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def read_lines(self, name):
+        """Read the lines of the exported file called name."""
+        with io.open(os.path.join(self.directory, name),
+                     encoding="utf-8") as fileobj:
+            return fileobj.read().splitlines()
+
+    def test_article_nodes(self):
+        """Articles are written with their ISSN."""
+        csvexport.export_csv([ARTICLE, {"pmid": "2"}], self.directory)
+        self.assertThat(self.read_lines(csvexport.ARTICLE_FILE),
+                        Equals(["title:ID(Article),ISSN,:LABEL",
+                                "\"1\",\"1234-5678\",\"Article\"",
+                                "\"2\",,\"Article\""]))
+
+    def test_nodes_written_once(self):
+        """Nodes shared by articles are only written once."""
+        csvexport.export_csv([ARTICLE, dict(ARTICLE, pmid="2")],
+                             self.directory)
+        self.assertThat(self.read_lines(csvexport.node_file("Author")),
+                        Equals(["name:ID(Author),:LABEL",
+                                "\"A Author\",\"Author\"",
+                                "\"O'Brien, \"\"Jr\"\"\",\"Author\""]))
+
+    def test_relationships_written_once_per_article(self):
+        """Each article is related to each node once."""
+        csvexport.export_csv([ARTICLE], self.directory)
+        self.assertThat(
+            self.read_lines(csvexport.relationship_file("Author",
+                                                        "AUTHORED_BY")),
+            Equals([":START_ID(Article),:END_ID(Author),:TYPE",
+                    "\"1\",\"A Author\",\"AUTHORED_BY\"",
+                    "\"1\",\"O'Brien, \"\"Jr\"\"\",\"AUTHORED_BY\""])
+        )
+
+    def test_publication_date_nodes(self):
+        """Articles are related to the month and year they were published."""
+        csvexport.export_csv([ARTICLE], self.directory)
+        self.assertThat(
+            self.read_lines(csvexport.relationship_file("Month",
+                                                        "PUBLISHED_IN"))[1:],
+            Equals(["\"1\",\"November\",\"PUBLISHED_IN\""])
+        )
+        self.assertThat(self.read_lines(csvexport.node_file("Year"))[1:],
+                        Equals(["\"2011\",\"Year\""]))
+
+    def test_duplicate_articles_written_once(self):
+        """Only one article is written for each pmid."""
+        exporter = csvexport.export_csv([ARTICLE, ARTICLE, {}],
+                                        self.directory)
+        self.assertThat((exporter.articles, exporter.duplicates),
+                        Equals((1, 1)))
+        self.assertThat(len(self.read_lines(csvexport.ARTICLE_FILE)),
+                        Equals(2))
+
+    def test_duplicate_article_relationships_merged(self):
+        """Articles are related to the nodes of every record with a pmid."""
+        exporter = csvexport.export_csv([
+            ARTICLE,
+            {"pmid": "2", "Author": ["A Author"]},
+            {"pmid": "1", "Author": ["A Author", "B Author"]}
+        ], self.directory)
+        self.assertThat(
+            self.read_lines(csvexport.relationship_file("Author",
+                                                        "AUTHORED_BY"))[1:],
+            Equals(["\"1\",\"A Author\",\"AUTHORED_BY\"",
+                    "\"1\",\"O'Brien, \"\"Jr\"\"\",\"AUTHORED_BY\"",
+                    "\"2\",\"A Author\",\"AUTHORED_BY\"",
+                    "\"1\",\"B Author\",\"AUTHORED_BY\""])
+        )
+        self.assertThat(self.read_lines(csvexport.node_file("Author"))[1:],
+                        Equals(["\"A Author\",\"Author\"",
+                                "\"O'Brien, \"\"Jr\"\"\",\"Author\"",
+                                "\"B Author\",\"Author\""]))
+        self.assertThat(exporter.relationships, Equals(8))
+
+    def test_duplicate_article_issn_merged(self):
+        """Articles keep the last ISSN any record with their pmid has."""
+        csvexport.export_csv([{"pmid": "1"},
+                              {"pmid": "2", "ISSN": "2"},
+                              {"pmid": "1", "ISSN": "1"},
+                              {"pmid": "2"}],
+                             self.directory)
+        self.assertThat(self.read_lines(csvexport.ARTICLE_FILE)[1:],
+                        Equals(["\"1\",\"1\",\"Article\"",
+                                "\"2\",\"2\",\"Article\""]))
+        self.assertThat(os.listdir(self.directory),
+                        Not(Contains(csvexport.ARTICLE_FILE + ".tmp")))
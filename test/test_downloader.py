@@ -0,0 +1,646 @@
+# /test/test_downloader.py
+#
+# Tests for downloader.
+#
+# See /LICENCE.md for Copyright information
+"""Tests for downloader."""
+
+import json
+
+import os
+
+import shutil
+
+import sys
+
+import tempfile
+
+import threading
+
+import time
+
+import zlib
+
+from importer import downloader, store
+
+from six.moves import BaseHTTPServer, StringIO, socketserver, urllib
+
+from testtools import (ExpectedException, TestCase)
+from testtools.matchers import (Equals,
+                                GreaterThan,
+                                Is,
+                                LessThan,
+                                Not,
+                                StartsWith)
+
+from xml.etree import ElementTree
+
+
+ARTICLE_SET = (
+    "<?xml version=\"1.0\" ?>\n"
+    "<!DOCTYPE PubmedArticleSet PUBLIC \"-//NLM//DTD PubMedArticle, "
+    "1st January 2016//EN\" \"http://www.ncbi.nlm.nih.gov/corehtml/query/"
+    "DTD/pubmed_160101.dtd\">\n"
+    "<PubmedArticleSet>\n"
+    "<PubmedArticle><MedlineCitation><PMID>1</PMID>"
+    "<Article><ArticleTitle>First</ArticleTitle></Article>"
+    "</MedlineCitation></PubmedArticle>\n"
+    "<PubmedArticle><MedlineCitation><PMID>2</PMID>"
+    "<Article><ArticleTitle>Second &amp; last</ArticleTitle></Article>"
+    "</MedlineCitation></PubmedArticle>\n"
+    "</PubmedArticleSet>\n"
+)
+
+
+class TestBatchedFetch(TestCase):
+    """Test fetching several articles with one request."""
+
+    def test_short_id_list_in_url(self):
+        """Short ID lists are sent in the query string."""
+        url, data = downloader.pubmed_fetch_articles_request(["1", "2"])
+        self.assertThat(data, Is(None))
+        query = urllib.parse.parse_qs(urllib.parse.urlparse(url).query)
+        self.assertThat(query["id"], Equals(["1,2"]))
+
+    def test_long_id_list_posted(self):
+        """Long ID lists are sent as POST data."""
+        articles = [str(i) for i in range(downloader.POST_ID_THRESHOLD + 1)]
+        url, data = downloader.pubmed_fetch_articles_request(articles)
+        self.assertThat(data, Not(Is(None)))
+        self.assertThat(url, Equals(downloader.pubmed_api("efetch")))
+        query = urllib.parse.parse_qs(data.decode("utf-8"))
+        self.assertThat(query["id"], Equals([",".join(articles)]))
+
+    def test_split_article_set_pmids(self):
+        """Each article in a set is split out with its PMID."""
+        pmids = [p for p, _ in downloader.split_article_set(ARTICLE_SET)]
+        self.assertThat(pmids, Equals(["1", "2"]))
+
+    def test_split_article_set_documents(self):
+        """Split documents are article sets with a single article."""
+        documents = [
+            ElementTree.fromstring(d)
+            for _, d in downloader.split_article_set(ARTICLE_SET)
+        ]
+        self.assertThat([d.tag for d in documents],
+                        Equals(["PubmedArticleSet", "PubmedArticleSet"]))
+        self.assertThat([len(list(d)) for d in documents], Equals([1, 1]))
+        self.assertThat(documents[1].find(".//ArticleTitle").text,
+                        Equals("Second & last"))
+
+    def test_split_document_declares_encoding(self):
+        """Split documents carry an XML declaration."""
+        _, document = next(downloader.split_article_set(ARTICLE_SET))
+        self.assertThat(document.decode("utf-8"), StartsWith("<?xml"))
+
+
+def article_set_for(pmids):
+    """Generate a PubmedArticleSet document for each of pmids."""
+    return "<PubmedArticleSet>{}</PubmedArticleSet>".format("".join([
+        "<PubmedArticle><MedlineCitation><PMID>{}</PMID>"
+        "</MedlineCitation></PubmedArticle>".format(p)
+        for p in pmids
+    ]))
+
+
+class StandInHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Answer E-utilities requests like NCBI would, slowly."""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        """Don't log requests."""
+        del args
+
+    def setup(self):
+        """Count connections to the server."""
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        with self.server.lock:
+            self.server.connections += 1
+
+    def _send(self, status, body=b""):
+        """Send a response with status and body, compressing if asked."""
+        self.send_response(status)
+        if "gzip" in self.headers.get("Accept-Encoding", ""):
+            compressor = zlib.compressobj(9,
+                                          zlib.DEFLATED,
+                                          16 + zlib.MAX_WBITS)
+            body = compressor.compress(body) + compressor.flush()
+            with self.server.lock:
+                if self.server.corrupt > 0:
+                    self.server.corrupt -= 1
+                    body = b"not gzip"
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _respond(self, query):
+        """Respond to a request with query parameters."""
+        server = self.server
+        function = self.path.split("?")[0].split("/")[-1]
+        with server.lock:
+            server.log.append(function)
+            server.requests += 1
+            server.active += 1
+            server.max_active = max(server.max_active, server.active)
+            throttle = server.throttle > 0
+            if throttle:
+                server.throttle -= 1
+
+        try:
+            time.sleep(server.latency)
+            if throttle:
+                self._send(429)
+                return
+
+            if server.status != 200:
+                self._send(server.status)
+                return
+
+            if function == "esearch.fcgi":
+                retstart = int(query.get("retstart", ["0"])[0])
+                retmax = int(query["retmax"][0])
+                if "mindate" in query:
+                    server.mindates.append(query["mindate"][0])
+                    server.result = server.revised
+                elif "WebEnv" not in query:
+                    server.result = server.pmids
+                body = json.dumps({
+                    "esearchresult": {
+                        "count": str(len(server.result)),
+                        "retstart": str(retstart),
+                        "webenv": "WEBENV",
+                        "querykey": "1",
+                        "idlist": server.result[retstart:retstart + retmax]
+                    }
+                })
+            else:
+                body = article_set_for([
+                    pmid for pmid in query["id"][0].split(",")
+                    if pmid not in server.missing
+                ])
+
+            self._send(200, body.encode("utf-8"))
+        finally:
+            with server.lock:
+                server.active -= 1
+
+    def _redirect(self):
+        """Redirect requests to a path under /moved, returning if we did."""
+        if not self.path.startswith("/moved/"):
+            return False
+
+        self.send_response(301)
+        self.send_header("Location", self.path[len("/moved"):])
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+        return True
+
+    def do_GET(self):  # suppress(N802)
+        """Respond to GET request."""
+        if self._redirect():
+            return
+
+        self._respond(urllib.parse.parse_qs(
+            urllib.parse.urlparse(self.path).query
+        ))
+
+    def do_POST(self):  # suppress(N802)
+        """Respond to POST request."""
+        length = int(self.headers["Content-Length"])
+        body = self.rfile.read(length).decode("utf-8")
+        if self._redirect():
+            return
+
+        self._respond(urllib.parse.parse_qs(body))
+
+
+class StandInServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """Local stand-in for the E-utilities server."""
+
+    daemon_threads = True
+
+    def __init__(self,
+                 pmids,
+                 latency=0.0,
+                 throttle=0,
+                 revised=None,
+                 status=200,
+                 missing=None,
+                 corrupt=0):
+        """Initialize server with pmids, latency and throttled requests.
+
+        Searches with a modification date window return revised, or
+        no articles if it is not set. If status is set, every request
+        which is not throttled fails with that status. Articles in
+        missing are left out of every response. The first corrupt
+        compressed responses have a body which is not valid gzip.
+        """
+        BaseHTTPServer.HTTPServer.__init__(self,
+                                           ("127.0.0.1", 0),
+                                           StandInHandler)
+        self.pmids = pmids
+        self.revised = revised or []
+        self.missing = set(missing or [])
+        self.corrupt = corrupt
+        self.result = pmids
+        self.mindates = []
+        self.latency = latency
+        self.throttle = throttle
+        self.lock = threading.Lock()
+        self.status = status
+        self.log = []
+        self.connections = 0
+        self.requests = 0
+        self.active = 0
+        self.max_active = 0
+
+    def api(self, function):
+        """Get entry point for function on this server."""
+        return "http://127.0.0.1:{}/entrez/eutils/{}.fcgi?".format(
+            self.server_address[1],
+            function
+        )
+
+
+class StandInServerTestCase(TestCase):
+    """Base for tests which download from a StandInServer."""
+
+    def start_server(self, *args, **kwargs):
+        """Start a StandInServer and point the downloader at it."""
+        server = StandInServer(*args, **kwargs)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.patch(downloader, "pubmed_api", server.api)
+        self.patch(sys, "stdout", StringIO())
+        self.patch(sys, "stderr", StringIO())
+        return server
+
+
+class FakeClock(object):
+    """A clock which only advances when slept on."""
+
+    def __init__(self):
+        """Initialize clock at zero."""
+        self.now = 0.0
+
+    def time(self):
+        """Get current time."""
+        return self.now
+
+    def sleep(self, duration):
+        """Advance the clock by duration."""
+        self.now += duration
+
+
+class TestRateLimiter(TestCase):
+    """Test adaptive token bucket rate limiting."""
+
+    def test_requests_spaced_by_rate(self):
+        """Requests are spaced out so that they do not exceed rate."""
+        clock = FakeClock()
+        limiter = downloader.RateLimiter(4.0,
+                                         clock=clock.time,
+                                         sleep=clock.sleep)
+        for _ in range(9):
+            limiter.acquire()
+
+        self.assertThat(clock.now, Equals(2.0))
+
+    def test_throttling_decreases_rate(self):
+        """Throttled requests decrease the rate multiplicatively."""
+        limiter = downloader.RateLimiter(8.0)
+        limiter.throttled()
+        limiter.throttled()
+        self.assertThat(limiter.rate, Equals(2.0))
+
+    def test_success_increases_rate_up_to_maximum(self):
+        """Successful requests increase the rate additively up to maximum."""
+        limiter = downloader.RateLimiter(2.0, increase=0.5)
+        limiter.throttled()
+        limiter.succeeded()
+        self.assertThat(limiter.rate, Equals(1.5))
+        limiter.succeeded()
+        limiter.succeeded()
+        self.assertThat(limiter.rate, Equals(2.0))
+
+
+class TestConcurrentDownload(StandInServerTestCase):
+    """Test downloading concurrently from a stand-in server."""
+
+    def setUp(self):
+        """Create a directory to download into."""
+        super(TestConcurrentDownload, self).setUp()
+        self.location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.location)
+
+    def test_download_all_articles_concurrently(self):
+        """Articles are downloaded with several requests in flight."""
+        pmids = [str(i) for i in range(1, 13)]
+        server = self.start_server(pmids, latency=0.05)
+        downloader.main([self.location, "--jobs", "4", "--rate", "1000"])
+        self.assertThat(sorted(os.listdir(self.location)),
+                        Equals(sorted([p + ".xml" for p in pmids])))
+        self.assertThat(server.max_active, GreaterThan(1))
+
+    def test_download_batches_concurrently(self):
+        """Batches of articles are downloaded concurrently."""
+        pmids = [str(i) for i in range(1, 13)]
+        server = self.start_server(pmids, latency=0.05)
+        downloader.main([self.location,
+                         "--jobs", "3",
+                         "--batch-size", "4",
+                         "--rate", "1000"])
+        self.assertThat(len(os.listdir(self.location)), Equals(12))
+        # One search request and three batches
+        self.assertThat(server.requests, Equals(4))
+
+    def test_download_into_pack(self):
+        """Articles can be appended to a pack instead of single files."""
+        pmids = [str(i) for i in range(1, 7)]
+        self.start_server(pmids)
+        downloader.main([self.location,
+                         "--jobs", "2",
+                         "--batch-size", "4",
+                         "--store", "pack",
+                         "--rate", "1000"])
+        self.assertThat(sorted(os.listdir(self.location)),
+                        Equals([store.INDEX_FILE, store.PACK_FILE]))
+        self.assertThat(sorted(p for p, _ in
+                               store.PackStore(self.location).articles()),
+                        Equals(sorted(pmids)))
+
+    def test_metrics_written(self):
+        """Requests, bytes and articles are written to the metrics file."""
+        pmids = [str(i) for i in range(1, 7)]
+        server = self.start_server(pmids)
+        metrics_path = os.path.join(tempfile.mkdtemp(), "metrics.json")
+        self.addCleanup(shutil.rmtree, os.path.dirname(metrics_path))
+        downloader.main([self.location,
+                         "--batch-size", "4",
+                         "--rate", "1000",
+                         "--metrics-file", metrics_path])
+        with open(metrics_path) as metrics_file:
+            metrics = json.load(metrics_file)
+        self.assertThat((metrics["counters"]["articles"],
+                         metrics["counters"]["requests"]),
+                        Equals((6, server.requests)))
+        self.assertThat(metrics["counters"]["bytes"], GreaterThan(0))
+        self.assertThat(sorted(metrics["stages"]),
+                        Equals(["download", "search", "total"]))
+
+    def test_search_results_paged(self):
+        """Search results are requested one page at a time."""
+        pmids = [str(i) for i in range(1, 6)]
+        server = self.start_server(pmids)
+        downloader.main([self.location,
+                         "--page-size", "2",
+                         "--rate", "1000"])
+        self.assertThat(len(os.listdir(self.location)), Equals(5))
+        self.assertThat(server.log.count("esearch.fcgi"), Equals(3))
+
+    def test_fetch_starts_before_search_finishes(self):
+        """Articles are fetched as soon as their page of IDs arrives."""
+        server = self.start_server([str(i) for i in range(1, 6)])
+        downloader.main([self.location,
+                         "--page-size", "2",
+                         "--rate", "1000"])
+        self.assertThat(server.log[:4], Equals(["esearch.fcgi",
+                                                "efetch.fcgi",
+                                                "efetch.fcgi",
+                                                "esearch.fcgi"]))
+
+    def test_article_count_limits_search(self):
+        """Only article-count articles are downloaded."""
+        self.start_server([str(i) for i in range(1, 6)])
+        downloader.main([self.location,
+                         "--page-size", "2",
+                         "--article-count", "3",
+                         "--rate", "1000"])
+        self.assertThat(sorted(os.listdir(self.location)),
+                        Equals(["1.xml", "2.xml", "3.xml"]))
+
+    def test_throttled_requests_slow_down_and_retry(self):
+        """Throttled requests are retried at a lower rate."""
+        server = self.start_server(["1"], throttle=2)
+        limiter = downloader.RateLimiter(1000.0)
+        client = downloader.HTTPClient(limiter=limiter, backoff=0.0)
+        result = client.download(downloader.pubmed_fetch_article_url("1"))
+        self.assertThat(result, Equals(article_set_for(["1"])))
+        self.assertThat(server.requests, Equals(3))
+        self.assertThat(limiter.rate, LessThan(1000.0))
+
+    def test_api_key_sent_with_requests(self):
+        """The API key is sent with each request."""
+        url, _ = downloader.with_api_key(
+            downloader.pubmed_fetch_article_url("1"),
+            None,
+            "key"
+        )
+        query = urllib.parse.parse_qs(urllib.parse.urlparse(url).query)
+        self.assertThat(query["api_key"], Equals(["key"]))
+
+    def test_failed_downloads_do_not_stop_crawl(self):
+        """Other articles are downloaded if one fails, then we exit."""
+        pmids = [str(i) for i in range(1, 5)]
+        self.start_server(pmids)
+        original_download = downloader.download_article
+
+        def _download_article(location, article_id, **kwargs):
+            """Fail to download article 2."""
+            if article_id == "2":
+                raise downloader.DownloadError(article_id, "broken")
+            original_download(location, article_id, **kwargs)
+
+        self.patch(downloader, "download_article", _download_article)
+        with ExpectedException(SystemExit):
+            downloader.main([self.location, "--jobs", "2", "--rate", "1000"])
+
+        self.assertThat(sorted(os.listdir(self.location)),
+                        Equals(["1.xml", "3.xml", "4.xml"]))
+
+    def test_job_errors_reraised(self):
+        """Errors raised by jobs are raised by run_jobs."""
+        def _raise(item):
+            """Raise an error for item 3."""
+            if item == 3:
+                raise RuntimeError(item)
+
+        with ExpectedException(RuntimeError):
+            downloader.run_jobs(_raise, range(10), 4)
+
+
+class TestHTTPClient(StandInServerTestCase):
+    """Test the pooled HTTP client."""
+
+    def client(self, **kwargs):
+        """Create a HTTPClient which does not wait between retries."""
+        client = downloader.HTTPClient(backoff=0.0, **kwargs)
+        self.addCleanup(client.close)
+        return client
+
+    def test_connection_kept_alive(self):
+        """Several requests to the same host share a connection."""
+        server = self.start_server(["1"])
+        client = self.client()
+        for pmid in ["1", "2", "3"]:
+            client.download(downloader.pubmed_fetch_article_url(pmid))
+
+        self.assertThat(server.connections, Equals(1))
+
+    def test_gzip_response_decoded(self):
+        """Compressed responses are decompressed."""
+        self.start_server(["1"])
+        client = self.client()
+        result = client.download(downloader.pubmed_fetch_article_url("1"))
+        self.assertThat(result, Equals(article_set_for(["1"])))
+        self.assertThat(client.stats.bytes_received,
+                        LessThan(client.stats.bytes_decoded))
+
+    def test_corrupt_response_retried(self):
+        """Responses which cannot be decompressed are retried."""
+        server = self.start_server(["1"], corrupt=1)
+        client = self.client()
+        result = client.download(downloader.pubmed_fetch_article_url("1"))
+        self.assertThat(result, Equals(article_set_for(["1"])))
+        self.assertThat(server.requests, Equals(2))
+        self.assertThat(client.stats.retries, Equals(1))
+
+    def test_corrupt_responses_raise_download_error(self):
+        """DownloadError is raised if every response is corrupt."""
+        self.start_server(["1"], corrupt=10)
+        client = self.client(retries=2)
+        with ExpectedException(downloader.DownloadError):
+            client.download(downloader.pubmed_fetch_article_url("1"))
+
+    def test_post_request(self):
+        """POST data is sent in the request body."""
+        self.start_server(["1"])
+        client = self.client()
+        pmids = [str(i) for i in range(downloader.POST_ID_THRESHOLD + 1)]
+        url, data = downloader.pubmed_fetch_articles_request(pmids)
+        self.assertThat(client.download(url, data),
+                        Equals(article_set_for(pmids)))
+
+    def test_redirects_followed(self):
+        """Moved URLs are requested again at their new location."""
+        self.start_server(["1"])
+        client = self.client()
+        url = downloader.pubmed_fetch_article_url("1").replace("/entrez",
+                                                               "/moved/entrez")
+        self.assertThat(client.download(url),
+                        Equals(article_set_for(["1"])))
+
+    def test_post_data_sent_to_redirect(self):
+        """POST data is sent again to the new location of a moved URL."""
+        self.start_server(["1"])
+        client = self.client()
+        url, data = downloader.pubmed_fetch_articles_request(["1", "2"])
+        self.assertThat(client.download(url.replace("/entrez",
+                                                    "/moved/entrez"), data),
+                        Equals(article_set_for(["1", "2"])))
+
+    def test_client_error_not_retried(self):
+        """Client errors raise DownloadError without retrying."""
+        server = self.start_server(["1"], status=404)
+        client = self.client()
+        with ExpectedException(downloader.DownloadError):
+            client.download(downloader.pubmed_fetch_article_url("1"))
+
+        self.assertThat(server.requests, Equals(1))
+
+    def test_server_error_retried_then_raised(self):
+        """Server errors are retried, then DownloadError is raised."""
+        server = self.start_server(["1"], status=503)
+        client = self.client(retries=3)
+        with ExpectedException(downloader.DownloadError):
+            client.download(downloader.pubmed_fetch_article_url("1"))
+
+        self.assertThat(server.requests, Equals(4))
+        self.assertThat(client.stats.retries, Equals(3))
+        self.assertThat(client.stats.failures, Equals(1))
+
+    def test_backoff_grows_exponentially(self):
+        """Retry delays are capped by an exponentially growing bound."""
+        delays = []
+        self.start_server(["1"], status=503)
+        client = downloader.HTTPClient(retries=4,
+                                       backoff=1.0,
+                                       sleep=delays.append)
+        self.addCleanup(client.close)
+        with ExpectedException(downloader.DownloadError):
+            client.download(downloader.pubmed_fetch_article_url("1"))
+
+        self.assertThat(len(delays), Equals(4))
+        for attempt, delay in enumerate(delays):
+            self.assertThat(delay, LessThan(2 ** attempt + 0.001))
+
+    def test_connection_refused_raises(self):
+        """Connection failures raise DownloadError."""
+        server = self.start_server(["1"])
+        url = server.api("efetch")
+        server.shutdown()
+        server.server_close()
+        with ExpectedException(downloader.DownloadError):
+            self.client(retries=1).download(url)
+
+
+class TestIncrementalSync(StandInServerTestCase):
+    """Test downloading only articles revised since the last sync."""
+
+    def setUp(self):
+        """Start a stand-in server and create a directory to download into."""
+        super(TestIncrementalSync, self).setUp()
+        self.location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.location)
+        self.server = self.start_server(["1", "2", "3"], revised=["2", "4"])
+
+    def download(self, *args):
+        """Run the downloader with args."""
+        downloader.main([self.location, "--rate", "1000"] + list(args))
+
+    def test_first_sync_downloads_everything(self):
+        """The first sync downloads all articles and records the date."""
+        self.download("--sync")
+        self.assertThat(sorted(os.listdir(self.location)),
+                        Equals([".last-sync", "1.xml", "2.xml", "3.xml"]))
+        self.assertThat(self.server.mindates, Equals([]))
+
+    def test_later_sync_searches_since_last_sync(self):
+        """Later syncs only search for articles modified since last sync."""
+        with open(os.path.join(self.location, ".last-sync"), "w") as sync:
+            sync.write("2016/10/01\n")
+
+        self.download("--sync")
+        self.assertThat(self.server.mindates, Equals(["2016/10/01"]))
+        self.assertThat(sorted(os.listdir(self.location)),
+                        Equals([".last-sync", "2.xml", "4.xml"]))
+        self.assertThat(downloader.read_last_sync(self.location),
+                        Not(Equals("2016/10/01")))
+
+    def test_revised_articles_replaced(self):
+        """Revised articles are downloaded again even if present."""
+        with open(os.path.join(self.location, "2.xml"), "w") as article:
+            article.write("stale")
+
+        self.download("--since", "2016-10-01")
+        with open(os.path.join(self.location, "2.xml"), "r") as article:
+            self.assertThat(article.read(), Not(Equals("stale")))
+
+    def test_missing_articles_do_not_record_sync(self):
+        """Articles missing from a batch fail, and the sync is not recorded."""
+        self.server.missing.add("3")
+        with ExpectedException(SystemExit):
+            self.download("--sync", "--batch-size", "2")
+
+        self.assertThat(sorted(os.listdir(self.location)),
+                        Equals(["1.xml", "2.xml"]))
+
+    def test_since_does_not_record_sync(self):
+        """Only --sync records the date of the last sync."""
+        self.download("--since", "2016-10-01")
+        self.assertThat(downloader.read_last_sync(self.location), Is(None))
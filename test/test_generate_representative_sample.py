@@ -0,0 +1,80 @@
+# /test/test_generate_representative_sample.py
+#
+# Tests for generating a representative sample of articles.
+#
+# See /LICENCE.md for Copyright information
+"""Tests for generating a representative sample of articles."""
+
+import json
+
+import os
+
+import shutil
+
+import sys
+
+import tempfile
+
+from importer import generate_representative_sample
+
+from six import StringIO
+
+from testtools import TestCase
+from testtools.matchers import Equals
+
+
+ARTICLES = [
+    {
+        "pmid": "1",
+        "pubDate": {
+            "date": "2011-11-01",
+            "components": {"Year": True, "Month": True, "Day": False}
+        },
+        "country": "UNITED STATES"
+    },
+    {
+        "pmid": "2",
+        "pubDate": {
+            "date": "2011-01-01",
+            "components": {"Year": True, "Month": False, "Day": False}
+        },
+        "country": "AUSTRALIA"
+    },
+    {
+        "pmid": "3",
+        "pubDate": {
+            "date": "2012-01-01",
+            "components": {"Year": True, "Month": False, "Day": False}
+        },
+        "ISSN": "0000-0000",
+        "Topic": ["Topic"]
+    }
+]
+
+
+class TestGenerateRepresentativeSample(TestCase):
+    """Test sampling articles from a file."""
+
+    def sample(self, articles):
+        """Get the sample printed for articles."""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, "articles.json")
+        with open(path, "w") as fileobj:
+            json.dump(articles, fileobj)
+
+        self.patch(sys, "stdout", StringIO())
+        self.patch(sys, "stderr", StringIO())
+        generate_representative_sample.main([path])
+        return json.loads(sys.stdout.getvalue())
+
+    def test_one_article_per_fields_and_year(self):
+        """One article is sampled for each set of fields and year."""
+        pmids = sorted(a["pmid"] for a in self.sample(ARTICLES))
+        self.assertThat(pmids, Equals(["1", "3"]))
+
+    def test_only_present_fields_printed(self):
+        """Fields without values are left out of the sample."""
+        self.assertThat(sorted(self.sample(ARTICLES),
+                               key=lambda a: a["pmid"]),
+                        Equals([ARTICLES[0], ARTICLES[2]]))
@@ -5,6 +5,8 @@
 # See /LICENCE.md for Copyright information
 """Tests for importer."""
 
+from contextlib import contextmanager
+
 import errno
 
 import json
@@ -21,7 +23,15 @@ import subprocess
 
 import sys
 
-from importer import load
+import tempfile
+
+import threading
+
+from importer import charts, instrument, load
+from importer.snapshot import LoadSnapshot
+from importer.sqlitesink import SQLiteSink
+
+from neo4j.v1.exceptions import CypherError
 
 from nose_parameterized import parameterized
 
@@ -30,7 +40,7 @@ import requests
 from six.moves import StringIO
 
 from testtools import (ExpectedException, TestCase)
-from testtools.matchers import Equals
+from testtools.matchers import Contains, Equals
 
 
 ENTRY_VALUES = {
@@ -80,11 +90,12 @@ CURRENT_FILE = os.path.realpath(__file__)
 TEST_TOKEN = "4287e44985b04c7536c523ca6ea8e67c"
 
 
-def run_query(query):
+def run_query(query, params=None):
     """Run query against a database."""
     url = "http://:{}@localhost:7474/db/data/cypher".format(TEST_TOKEN)
     return requests.post(url, json={
-        "query":  query
+        "query":  query,
+        "params": params or {}
     })
 
 
@@ -93,6 +104,408 @@ def run_commands(commands):
     return [run_query(c) for c in commands]
 
 
+def run_statements(statements):
+    """Run all (statement, parameters) tuples against a neo4j database."""
+    return [run_query(s, p) for s, p in statements]
+
+
+class FakeTransaction(object):
+    """A transaction which fails to commit with the session's errors."""
+
+    def __init__(self, session):
+        """Initialize this FakeTransaction for session."""
+        self.session = session
+        self.closed = False
+        self.statements = []
+        self.parameters = []
+
+    def run(self, statement, parameters):
+        """Record statement, returning the session's next records."""
+        self.statements.append(statement)
+        self.parameters.append(parameters)
+        if self.session.results:
+            return self.session.results.pop(0)
+
+        return []
+
+    def commit(self):
+        """Commit, or fail with the next error code for the session."""
+        self.closed = True
+        if self.session.errors:
+            raise CypherError({"code": self.session.errors.pop(0),
+                               "message": "Failed"})
+
+        self.session.committed.append(self.statements)
+        self.session.committed_parameters.append(self.parameters)
+
+    def rollback(self):
+        """Roll back."""
+        self.closed = True
+
+
+class FakeDeletingTransaction(FakeTransaction):
+    """A transaction in which statements deleting items delete none."""
+
+    def run(self, statement, parameters):
+        """Record statement, returning that nothing was deleted."""
+        records = super(FakeDeletingTransaction, self).run(statement,
+                                                           parameters)
+        return [{"deleted": 0}] if "AS deleted" in statement else records
+
+
+class FakeSession(object):
+    """A session whose transactions fail with each code in errors."""
+
+    transaction_class = FakeTransaction
+
+    def __init__(self, errors, results=None):
+        """Initialize this FakeSession, returning each of results."""
+        self.errors = list(errors)
+        self.results = list(results or [])
+        self.committed = []
+        self.committed_parameters = []
+
+    def begin_transaction(self):
+        """Begin a transaction of transaction_class."""
+        return self.transaction_class(self)
+
+
+DEADLOCK = "Neo.TransientError.Transaction.DeadlockDetected"
+
+
+class TestTransactions(TestCase):
+    """Test loading batches in explicit transactions."""
+
+    def setUp(self):
+        """Quieten stderr."""
+        super(TestTransactions, self).setUp()
+        self.patch(sys, "stderr", StringIO())
+
+    def load(self, session, batch_size=2):
+        """Load five articles with session, returning failed batches."""
+        values = [dict(ENTRY_VALUES, pmid=str(p)) for p in range(5)]
+        runner = load.TransactionRunner(session, sleep=lambda delay: None)
+        progress = instrument.Progress("Loaded", stream=StringIO())
+        return load.load_batches(runner,
+                                 load.batches_from_data(values, batch_size),
+                                 progress)
+
+    def test_one_transaction_per_batch(self):
+        """Each batch of articles is committed in its own transaction."""
+        session = FakeSession([])
+        self.assertThat(self.load(session), Equals([]))
+        self.assertThat(len(session.committed), Equals(3))
+
+    def test_transient_errors_retried(self):
+        """Transactions which fail with a transient error are retried."""
+        session = FakeSession([DEADLOCK, DEADLOCK])
+        self.assertThat(self.load(session), Equals([]))
+        self.assertThat(len(session.committed), Equals(3))
+
+    def test_failed_batches_reported(self):
+        """Batches which fail are returned, and later ones still loaded."""
+        session = FakeSession(["Neo.ClientError.Statement.SyntaxError"])
+        failed = self.load(session)
+        self.assertThat([batch.pmids for batch in failed],
+                        Equals([["0", "1"]]))
+        self.assertThat(len(session.committed), Equals(2))
+
+    def test_orphans_deleted_until_none_left(self):
+        """Orphaned nodes are deleted in batches until none are left."""
+        results = [[{"deleted": count}] for count in [2, 1, 0, 0, 0, 0]]
+        session = FakeSession([], results)
+        deleted = load.delete_orphans(load.TransactionRunner(session),
+                                      batch_size=2)
+        self.assertThat(deleted, Equals(3))
+        self.assertThat(len(session.committed),
+                        Equals(len(load.DELETE_ORPHANS_STATEMENTS) + 1))
+
+    def test_reset_deletes_relationships_then_nodes(self):
+        """The graph is reset in batches of relationships, then nodes."""
+        results = [[{"deleted": count}] for count in [2, 0, 2, 2, 1]]
+        session = FakeSession([], results)
+        load.reset_graph(load.TransactionRunner(session), batch_size=2)
+        self.assertThat(session.committed,
+                        Equals([[load.RESET_STATEMENTS[0][1]]] * 2 +
+                               [[load.RESET_STATEMENTS[1][1]]] * 3))
+
+    def full_load(self, input_ended):
+        """Load five articles in a full load, returning the statements."""
+        session = FakeSession([])
+        session.transaction_class = FakeDeletingTransaction
+        values = [dict(ENTRY_VALUES, pmid=str(p)) for p in range(5)]
+        load.load_all(load.TransactionRunner(session),
+                      load.batches_from_data(
+                          values,
+                          2,
+                          lambda r: load.statements_for_replaced_batch(r, "1")
+                      ),
+                      load_id="1",
+                      input_ended=input_ended)
+        return [(statement, parameters)
+                for transaction in zip(session.committed,
+                                       session.committed_parameters)
+                for statement, parameters in zip(*transaction)]
+
+    def test_full_load_marks_articles(self):
+        """Articles in a full load are marked with the load's id."""
+        self.assertThat([parameters["loadId"]
+                         for statement, parameters in self.full_load(None)
+                         if statement == load.REPLACE_ARTICLE_STATEMENT],
+                        Equals(["1"] * 3))
+
+    def test_full_load_deletes_stale_articles_once_input_ended(self):
+        """Articles not in a full load are deleted once it is all read."""
+        input_ended = threading.Event()
+        input_ended.set()
+        self.assertThat(
+            self.full_load(input_ended),
+            Contains((load.DELETE_STALE_ARTICLES_STATEMENT,
+                      {"loadId": "1", "limit": load.DEFAULT_BATCH_SIZE}))
+        )
+
+    def test_nothing_deleted_if_input_stops_early(self):
+        """Nothing is deleted if a full load's input stops before its end."""
+        statements = [s for s, _ in self.full_load(threading.Event())]
+        self.assertThat(
+            [s for s in statements
+             if s == load.DELETE_STALE_ARTICLES_STATEMENT or
+             s == load.RESET_STATEMENT or
+             s in load.DELETE_ORPHANS_STATEMENTS or
+             s in dict(load.RESET_STATEMENTS).values()],
+            Equals([])
+        )
+
+    def test_snapshot_articles_kept_if_input_stops_early(self):
+        """Articles not seen are kept if incremental input stops early."""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, "snapshot.sqlite")
+        snapshot = LoadSnapshot(path)
+        snapshot.is_changed(ENTRY_VALUES)
+        snapshot.mark_loaded([ENTRY_VALUES["pmid"]])
+        snapshot.close()
+
+        session = FakeSession([])
+        session.transaction_class = FakeDeletingTransaction
+        snapshot = LoadSnapshot(path)
+        self.addCleanup(snapshot.close)
+        load.load_all(load.TransactionRunner(session),
+                      iter([]),
+                      snapshot,
+                      input_ended=threading.Event())
+        self.assertThat(
+            (len(snapshot), [s for statements in session.committed
+                             for s in statements
+                             if s == load.DELETE_ARTICLES_STATEMENT or
+                             s in load.DELETE_ORPHANS_STATEMENTS]),
+            Equals((1, []))
+        )
+
+    def test_parallel_batches_partitioned_by_pmid(self):
+        """Each worker loads the articles in one partition."""
+        sessions = [FakeSession([DEADLOCK]) for _ in range(3)]
+        values = [dict(ENTRY_VALUES, pmid=str(p)) for p in range(20)]
+        loader = load.ParallelLoader(
+            [load.TransactionRunner(s, sleep=lambda delay: None)
+             for s in sessions],
+            instrument.Progress("Loaded", stream=StringIO())
+        )
+        failed = loader.load(load.batches_from_data(values,
+                                                    batch_size=2,
+                                                    partitions=3))
+        self.assertThat(failed, Equals([]))
+        self.assertThat(loader.progress.done, Equals(20))
+        for index, session in enumerate(sessions):
+            for parameters in session.committed_parameters:
+                self.assertThat(
+                    set(load.partition_of(row["pmid"], 3)
+                        for row in parameters[0]["rows"]),
+                    Equals(set([index]))
+                )
+
+    def test_dimension_nodes_created_once(self):
+        """Nodes articles are related to are only created once."""
+        session = FakeSession([])
+        dimensions = load.DimensionNodes(load.TransactionRunner(session))
+        for batch in load.batches_from_data([ENTRY_VALUES] * 2,
+                                            batch_size=1):
+            dimensions.create(batch)
+        self.assertThat(len(session.committed), Equals(1))
+
+    def test_schema_changes_in_own_transactions(self):
+        """Each constraint is created in its own transaction."""
+        session = FakeSession([])
+        load.ensure_schema(load.TransactionRunner(session))
+        self.assertThat(session.committed,
+                        Equals([[s] for s in load.SCHEMA_STATEMENTS]))
+
+    def test_sink_reset_then_loaded_in_batches(self):
+        """Other sinks are reset, then loaded in one transaction."""
+        calls = []
+
+        class FakeSink(object):
+            """Sink recording what it is asked to do."""
+
+            @contextmanager
+            def transaction(self):
+                """Record a transaction beginning and committing."""
+                calls.append("begin")
+                yield
+                calls.append("commit")
+
+            def reset(self):
+                """Record a reset."""
+                calls.append("reset")
+
+            def load(self, records):
+                """Record the number of records loaded."""
+                calls.append(len(records))
+
+        values = [dict(ENTRY_VALUES, pmid=str(p)) for p in range(5)]
+        load.load_to_sink(FakeSink(), values, batch_size=2)
+        self.assertThat(calls,
+                        Equals(["begin", "reset", 2, 2, 1, "commit"]))
+
+    def test_sink_argument(self):
+        """Sinks are given as neo4j, or a scheme and a location."""
+        self.assertThat([load.sink_argument("neo4j"),
+                         load.sink_argument("sqlite:/tmp/graph.sqlite")],
+                        Equals([("neo4j", None),
+                                ("sqlite", "/tmp/graph.sqlite")]))
+
+
+class TestMain(TestCase):
+    """Test running load-pubmed-files."""
+
+    def setUp(self):
+        """Write an article to a file to load, and quieten stderr."""
+        super(TestMain, self).setUp()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.path = os.path.join(self.directory, "articles.json")
+        with open(self.path, "w") as articles_file:
+            json.dump([ENTRY_VALUES], articles_file)
+        self.patch(sys, "stderr", StringIO())
+
+    def test_errors_while_loading_not_masked(self):
+        """I/O errors raised while loading from a file are raised."""
+        self.patch(load,
+                   "load_or_print_batches",
+                   mock.Mock(side_effect=IOError("Broken pipe")))
+        with ExpectedException(IOError):
+            load.main([self.path, "--no-execute"])
+
+    def load_ndjson(self, *args):
+        """Print statements loading NDJSON without an end marker."""
+        self.patch(sys, "stdout", StringIO())
+        with open(self.path, "w") as articles_file:
+            articles_file.write(json.dumps(ENTRY_VALUES) + "\n")
+        load.main([self.path, "--no-execute"] + list(args))
+
+    def test_ndjson_without_end_marker_loaded(self):
+        """NDJSON without an end marker is complete by default."""
+        self.load_ndjson()
+        self.assertThat(sys.stdout.getvalue(), Contains(ENTRY_VALUES["pmid"]))
+
+    def test_ndjson_without_required_end_marker_fails(self):
+        """NDJSON without an end marker fails if one is required."""
+        with ExpectedException(SystemExit):
+            self.load_ndjson("--require-end-marker")
+
+    def patch_database(self, results=None):
+        """Load into a FakeSession returning results, and return it."""
+        session = FakeSession([], results)
+        session.transaction_class = FakeDeletingTransaction
+        session.close = lambda: None
+        self.patch(load, "GraphDatabase", mock.Mock(**{
+            "driver.return_value.session.return_value": session
+        }))
+        self.patch(os, "environ", {"DATABASE_URL": "bolt://localhost",
+                                   "DATABASE_PASS": "password"})
+        return session
+
+    def test_graph_kept_if_end_marker_missing(self):
+        """Nothing is deleted if NDJSON stops before its end marker."""
+        session = self.patch_database()
+        with open(self.path, "w") as articles_file:
+            articles_file.write(json.dumps(ENTRY_VALUES) + "\n")
+
+        with ExpectedException(SystemExit):
+            load.main([self.path, "--require-end-marker"])
+        self.assertThat([s for statements in session.committed
+                         for s in statements
+                         if s == load.DELETE_STALE_ARTICLES_STATEMENT or
+                         s in dict(load.RESET_STATEMENTS).values()],
+                        Equals([]))
+
+    def test_graph_reset_first_if_asked(self):
+        """With --reset, the graph is reset before articles are loaded."""
+        session = self.patch_database()
+        load.main([self.path, "--reset"])
+        statements = [s for statements in session.committed
+                      for s in statements
+                      if s not in load.SCHEMA_STATEMENTS]
+        self.assertThat(statements[:2],
+                        Equals([s for _, s in load.RESET_STATEMENTS]))
+
+    def check_snapshot(self, articles):
+        """Check a snapshot of two articles, returning how many are left.
+
+        The graph in the database has :articles: articles.
+        """
+        self.patch_database([[{"articles": articles}]])
+        snapshot = LoadSnapshot(os.path.join(self.directory, "snapshot"))
+        self.addCleanup(snapshot.close)
+        snapshot.clear("bolt://localhost")
+        for pmid in ("1", "2"):
+            snapshot.is_changed(dict(ENTRY_VALUES, pmid=pmid))
+        snapshot.mark_loaded(["1", "2"])
+        load.check_snapshot(snapshot)
+        return len(snapshot)
+
+    def test_snapshot_of_graph_kept(self):
+        """A snapshot with as many articles as the graph is kept."""
+        self.assertThat(self.check_snapshot(2), Equals(2))
+
+    def test_snapshot_not_of_graph_cleared(self):
+        """A snapshot with a different number of articles is cleared."""
+        self.assertThat(self.check_snapshot(3), Equals(0))
+
+    def test_sink_kept_if_end_marker_missing(self):
+        """A sink keeps its articles if NDJSON stops before its end marker."""
+        sink = "sqlite:" + os.path.join(self.directory, "graph.sqlite")
+        load.main([self.path, "--sink", sink])
+        with open(self.path, "w") as articles_file:
+            articles_file.write(json.dumps(dict(ENTRY_VALUES,
+                                                country="Japan")) + "\n")
+
+        with ExpectedException(SystemExit):
+            load.main([self.path, "--sink", sink, "--require-end-marker"])
+        graph = SQLiteSink(sink.partition(":")[2])
+        self.addCleanup(graph.close)
+        self.assertThat(graph.top("countryRetraction"),
+                        Equals([("Australia", 1)]))
+
+    def test_errors_while_exporting_not_masked(self):
+        """Errors writing CSV files are raised."""
+        self.patch(load,
+                   "export_csv",
+                   mock.Mock(side_effect=OSError("Permission denied")))
+        with ExpectedException(OSError):
+            load.main([self.path, "--export-csv", self.directory])
+
+    def test_errors_while_loading_to_sink_not_masked(self):
+        """Errors loading into other sinks are raised."""
+        self.patch(load,
+                   "load_to_sink",
+                   mock.Mock(side_effect=OSError("Disk full")))
+        with ExpectedException(OSError):
+            load.main([self.path,
+                       "--sink",
+                       "sqlite:" + os.path.join(self.directory, "graph")])
+
+
 class TestImporterLoad(TestCase):
     """Test loading data into the database."""
 
@@ -198,6 +611,76 @@ class TestImporterLoad(TestCase):
         self.assertThat(res.json()["data"][0][0]["data"]["name"],
                         Equals("November"))
 
+    @parameterized.expand(ARTICLE_QUERIES)
+    def test_batched_statements_load_same_data(self, query, value):
+        """4.5.5.1 Batched statements load the same data as commands."""
+        run_statements(load.statements_from_data([ENTRY_VALUES]))
+        res = run_query(query).json()
+        self.assertThat(res["data"][0][0]["data"],
+                        Equals(value))
+
+    def test_batched_statements_load_all_batches(self):
+        """4.5.5.1 Every batch of articles is loaded."""
+        values = [dict(ENTRY_VALUES, pmid=str(p)) for p in range(10)]
+        run_statements(load.statements_from_data(values, batch_size=3))
+        res = run_query("MATCH(a:Article)-[:AUTHORED_BY]->(r:Author) "
+                        " RETURN Count(a)")
+        self.assertThat(res.json()["data"][0][0], Equals(10))
+
+    def test_batched_statements_load_names_with_quotes(self):
+        """4.5.5.1 Names with quotes are loaded as they are."""
+        name = "O'Brien \"Jr\""
+        run_statements(load.statements_from_data([
+            dict(ENTRY_VALUES, Author=[name])
+        ]))
+        res = run_query("MATCH(a:Article)-[:AUTHORED_BY]->(r:Author) "
+                        " RETURN r")
+        self.assertThat(res.json()["data"][0][0]["data"]["name"],
+                        Equals(name))
+
+    def test_schema_creation_is_idempotent(self):
+        """4.5.5.1 Constraints can be created again, then merged on."""
+        schema = [(s, {}) for s in load.SCHEMA_STATEMENTS]
+        for _ in range(2):
+            for response in run_statements(schema):
+                self.assertThat(response.status_code, Equals(200))
+        run_statements(load.statements_from_data([ENTRY_VALUES] * 2))
+        res = run_query("MATCH(a:Article) RETURN Count(a)")
+        self.assertThat(res.json()["data"][0][0], Equals(1))
+
+    def test_changed_articles_related_to_new_nodes(self):
+        """4.5.5.1 Reloading a changed article replaces its relationships."""
+        run_statements(load.statements_from_data([ENTRY_VALUES]))
+        run_statements(load.statements_for_changed_batch([
+            dict(ENTRY_VALUES, Author=["new_name"])
+        ]))
+        res = run_query("MATCH(a:Article)-[:AUTHORED_BY]->(r:Author) "
+                        " RETURN r")
+        self.assertThat([row[0]["data"]["name"] for row in res.json()["data"]],
+                        Equals(["new_name"]))
+
+    def test_reset_statements_delete_graph_in_batches(self):
+        """4.5.5.1 Running each reset statement in turn empties the graph."""
+        values = [dict(ENTRY_VALUES, pmid=str(p)) for p in range(5)]
+        run_statements(load.statements_from_data(values))
+        for _, statement in load.RESET_STATEMENTS:
+            while run_query(statement,
+                            {"limit": 2}).json()["data"][0][0] == 2:
+                pass
+        res = run_query("MATCH (n) RETURN Count(n)")
+        self.assertThat(res.json()["data"][0][0], Equals(0))
+
+    def test_chart_statements_count_relationships(self):
+        """4.5.5.1 Chart summaries count relationships like the backend."""
+        values = [dict(ENTRY_VALUES, pmid=str(p)) for p in range(2)]
+        run_statements(load.statements_from_data(values))
+        top = run_query(charts.TOP_STATEMENT.format("Year"), {"limit": 10})
+        filtered = run_query(charts.FILTERED_TOP_STATEMENT.format("Country",
+                                                                  "Year"),
+                             {"limit": 10, "filterString": "Australia"})
+        self.assertThat([top.json()["data"], filtered.json()["data"]],
+                        Equals([[["2011", 2]], [["2011", 2]]]))
+
     def test_throw_exception_if_network_connection_fails(self):
         """4.5.5.2 Throw exception if network connection is down."""
         with mock.patch("socket.socket") as MockSocket:
@@ -0,0 +1,175 @@
+# /test/test_instrument.py
+#
+# Tests for stage timers, counters and profiling.
+#
+# See /LICENCE.md for Copyright information
+"""Tests for stage timers, counters and profiling."""
+
+import argparse
+
+import json
+
+import os
+
+import pstats
+
+import shutil
+
+import tempfile
+
+from importer import instrument
+
+from six.moves import StringIO
+
+from testtools import TestCase
+from testtools.matchers import (Contains, Equals, FileExists)
+
+
+class FakeClock(object):
+    """A clock which moves forward one second each time it is read."""
+
+    def __init__(self):
+        """Start at time zero."""
+        self.now = 0.0
+
+    def __call__(self):
+        """Get the current time, then move forward."""
+        self.now += 1.0
+        return self.now
+
+
+def parse_arguments(argv):
+    """Parse the instrumentation arguments in argv."""
+    parser = argparse.ArgumentParser()
+    instrument.add_arguments(parser)
+    return parser.parse_args(argv)
+
+
+class TestMetrics(TestCase):
+    """Test counting and timing stages."""
+
+    def test_count(self):
+        """Counters add up each amount counted."""
+        metrics = instrument.Metrics("command")
+        metrics.count("articles")
+        metrics.count("articles", 2)
+        metrics.merge({"articles": 1, "bytes": 10})
+        self.assertThat(metrics.counters,
+                        Equals({"articles": 4, "bytes": 10}))
+
+    def test_stage_time_added_up(self):
+        """Time spent in a stage each time it is entered is added up."""
+        metrics = instrument.Metrics("command", clock=FakeClock())
+        for _ in range(2):
+            with metrics.stage("parse"):
+                pass
+        self.assertThat(metrics.stages, Equals({"parse": 2.0}))
+
+    def test_timed_stages_exclude_nested_stages(self):
+        """Time in a nested timed stage is not counted by the outer one."""
+        metrics = instrument.Metrics("command", clock=FakeClock())
+        inner = metrics.timed("read", [1, 2], "articles")
+        self.assertThat(list(metrics.timed("generate", inner)),
+                        Equals([1, 2]))
+        self.assertThat(metrics.stages,
+                        Equals({"read": 3.0, "generate": 6.0}))
+        self.assertThat(metrics.counters, Equals({"articles": 2}))
+
+    def test_prometheus_format(self):
+        """Metrics are written in the Prometheus text format."""
+        metrics = instrument.Metrics("parse-pubmed-files")
+        metrics.count("cache-hits", 3)
+        metrics.add_time("parse", 1.5)
+        text = metrics.to_prometheus()
+        self.assertThat(text, Contains(
+            "# TYPE pubmed_importer_cache_hits_total counter\n"
+            "pubmed_importer_cache_hits_total"
+            "{command=\"parse-pubmed-files\"} 3\n"
+        ))
+        self.assertThat(text, Contains(
+            "pubmed_importer_stage_seconds"
+            "{command=\"parse-pubmed-files\",stage=\"parse\"} 1.5\n"
+        ))
+
+    def test_collect_counters(self):
+        """Counters from a call are returned instead of counted."""
+        outer = instrument.Metrics("command")
+        previous = instrument.activate(outer)
+        self.addCleanup(instrument.activate, previous)
+
+        def _warn(times):
+            """Count warnings."""
+            instrument.count("warnings", times)
+            return times
+
+        self.assertThat(instrument.collect_counters(_warn, 2),
+                        Equals((2, {"warnings": 2})))
+        self.assertThat(outer.counters, Equals({}))
+
+
+class TestProgress(TestCase):
+    """Test reporting progress."""
+
+    def test_progress_reported_every_interval(self):
+        """Progress is only reported once interval seconds have passed."""
+        stream = StringIO()
+        progress = instrument.Progress("Loaded",
+                                       total=4,
+                                       interval=2.0,
+                                       stream=stream,
+                                       clock=FakeClock())
+        for _ in range(4):
+            progress.update()
+        progress.finish()
+        self.assertThat(stream.getvalue(),
+                        Equals("Loaded: 2 of 4 (1.0/s)\n"
+                               "Loaded: 4 of 4 (1.0/s)\n"
+                               "Loaded: 4 of 4 (0.8/s)\n"))
+
+
+class TestInstrumented(TestCase):
+    """Test instrumenting a run of a command."""
+
+    def setUp(self):
+        """Create a directory for output files."""
+        super(TestInstrumented, self).setUp()
+        self.location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.location)
+
+    def test_write_json_metrics_at_exit(self):
+        """Metrics are written as JSON, even if the command fails."""
+        path = os.path.join(self.location, "metrics.json")
+        arguments = parse_arguments(["--metrics-file", path])
+
+        def _run():
+            """Count an article, then exit with an error."""
+            with instrument.instrumented("command", arguments):
+                instrument.count("articles")
+                raise SystemExit(1)
+
+        self.assertRaises(SystemExit, _run)
+        with open(path) as metrics_file:
+            metrics = json.load(metrics_file)
+        self.assertThat((metrics["command"], metrics["counters"]),
+                        Equals(("command", {"articles": 1})))
+        self.assertThat(sorted(metrics["stages"]), Equals(["total"]))
+
+    def test_write_prometheus_metrics(self):
+        """Metrics files ending in .prom use the Prometheus format."""
+        path = os.path.join(self.location, "metrics.prom")
+        with instrument.instrumented("command",
+                                     parse_arguments(["--metrics-file",
+                                                      path])):
+            pass
+        with open(path) as metrics_file:
+            self.assertThat(metrics_file.read(),
+                            Contains("pubmed_importer_stage_seconds"))
+
+    def test_dump_profile(self):
+        """cProfile stats are written to the --profile file."""
+        path = os.path.join(self.location, "run.pstats")
+        with instrument.instrumented("command",
+                                     parse_arguments(["--profile", path])):
+            sorted(range(10))
+        self.assertThat(path, FileExists())
+        self.assertThat(pstats.Stats(path).total_calls > 0, Equals(True))
@@ -0,0 +1,164 @@
+# /test/test_ndjson.py
+#
+# Tests for reading and writing streams of records.
+#
+# See /LICENCE.md for Copyright information
+"""Tests for reading and writing streams of records."""
+
+import json
+
+from importer import ndjson
+
+from six.moves import StringIO
+
+from testtools import TestCase
+from testtools.matchers import Equals
+
+
+RECORDS = [{"pmid": "1", "Author": ["A"]}, {"pmid": "2", "Author": []}]
+
+
+class TestReadRecords(TestCase):
+    """Test reading records from JSON arrays and NDJSON."""
+
+    def test_read_json_array(self):
+        """Records are read from a JSON array."""
+        self.assertThat(list(ndjson.read_records(StringIO(
+            json.dumps(RECORDS, indent=2)
+        ))), Equals(RECORDS))
+
+    def test_read_ndjson(self):
+        """Records are read from NDJSON, skipping blank lines."""
+        self.assertThat(list(ndjson.read_records(StringIO(
+            "\n".join(json.dumps(r) for r in RECORDS) + "\n\n"
+        ))), Equals(RECORDS))
+
+    def test_ndjson_records_read_as_they_arrive(self):
+        """The first record is read before the rest of the stream."""
+        stream = StringIO(json.dumps(RECORDS[0]) + "\n")
+        records = ndjson.read_records(stream)
+        self.assertThat(next(records), Equals(RECORDS[0]))
+
+    def test_json_array_read_in_chunks(self):
+        """Values cut off between chunks of an array are read whole."""
+        self.patch(ndjson, "READ_SIZE", 3)
+        values = [{"a": "]"}, 12345, -1.5e3, [], "x, y", None]
+        self.assertThat(list(ndjson.read_records(StringIO(
+            " " + json.dumps(values) + "\n"
+        ))), Equals(values))
+
+    def test_json_array_records_read_as_they_arrive(self):
+        """The first record of an array is read before the rest."""
+        self.patch(ndjson, "READ_SIZE", 16)
+        stream = StringIO(json.dumps(RECORDS * 100))
+        records = ndjson.read_records(stream)
+        self.assertThat(next(records), Equals(RECORDS[0]))
+        self.assertThat(stream.tell() < 100, Equals(True))
+
+    def test_invalid_json_array_raises(self):
+        """Arrays with missing or extra separators raise ValueError."""
+        for text in ("[1 2]", "[1,]", "[,1]", "[1, 2"):
+            self.assertRaises(ValueError,
+                              list,
+                              ndjson.read_records(StringIO(text)))
+
+    def test_end_of_json_array_signalled(self):
+        """on_end is called once the end of a JSON array is read."""
+        ended = []
+        records = list(ndjson.read_records(StringIO(json.dumps(RECORDS)),
+                                           lambda: ended.append(True)))
+        self.assertThat((records, ended), Equals((RECORDS, [True])))
+
+    def test_end_of_ndjson_file_signalled(self):
+        """on_end is called at the end of NDJSON without a marker."""
+        ended = []
+        list(ndjson.read_records(StringIO(json.dumps(RECORDS[0]) + "\n"),
+                                 lambda: ended.append(True)))
+        self.assertThat(ended, Equals([True]))
+
+    def test_ndjson_without_required_marker_not_signalled(self):
+        """on_end is not called without END_OF_STREAM if it is required."""
+        ended = []
+        list(ndjson.read_records(StringIO(json.dumps(RECORDS[0]) + "\n"),
+                                 lambda: ended.append(True),
+                                 end_marker=True))
+        self.assertThat(ended, Equals([]))
+
+    def test_ndjson_end_marker_read(self):
+        """END_OF_STREAM ends NDJSON, and is not read as a record."""
+        stream = StringIO()
+        ndjson.write_records(RECORDS, stream, "ndjson", end_marker=True)
+        stream.seek(0)
+        ended = []
+        records = list(ndjson.read_records(stream,
+                                           lambda: ended.append(True),
+                                           end_marker=True))
+        self.assertThat((records, ended), Equals((RECORDS, [True])))
+
+    def test_empty_input_has_no_records(self):
+        """An empty stream has no records."""
+        self.assertThat(list(ndjson.read_records(StringIO(""))),
+                        Equals([]))
+
+    def test_invalid_input_raises(self):
+        """Invalid input raises ValueError."""
+        self.assertRaises(ValueError,
+                          list,
+                          ndjson.read_records(StringIO("invalid")))
+
+
+class TestWriteRecords(TestCase):
+    """Test writing records as JSON arrays and NDJSON."""
+
+    def test_write_json_same_as_dumps(self):
+        """The json format is the same as dumping a list of records."""
+        stream = StringIO()
+        ndjson.write_records(iter(RECORDS), stream)
+        self.assertThat(stream.getvalue(),
+                        Equals(json.dumps(RECORDS) + "\n"))
+
+    def test_write_empty_json(self):
+        """No records are written as an empty array."""
+        stream = StringIO()
+        ndjson.write_records([], stream)
+        self.assertThat(json.loads(stream.getvalue()), Equals([]))
+
+    def test_round_trip_ndjson(self):
+        """Records written as NDJSON are read back the same."""
+        stream = StringIO()
+        ndjson.write_records(RECORDS, stream, "ndjson")
+        stream.seek(0)
+        self.assertThat(list(ndjson.read_records(stream)), Equals(RECORDS))
+
+    def test_ndjson_only_has_records(self):
+        """Without an end marker, each line of NDJSON is a record."""
+        stream = StringIO()
+        ndjson.write_records(RECORDS, stream, "ndjson")
+        self.assertThat([json.loads(line)
+                         for line in stream.getvalue().splitlines()],
+                        Equals(RECORDS))
+
+    def test_ndjson_end_marker_written_last(self):
+        """With an end marker, NDJSON ends with END_OF_STREAM."""
+        stream = StringIO()
+        ndjson.write_records(RECORDS, stream, "ndjson", end_marker=True)
+        self.assertThat([json.loads(line)
+                         for line in stream.getvalue().splitlines()],
+                        Equals(RECORDS + [ndjson.END_OF_STREAM]))
+
+    def test_ndjson_end_marker_not_written_if_records_raise(self):
+        """END_OF_STREAM is not written if records stop with an error."""
+        def _records():
+            """Yield one record, then fail."""
+            yield RECORDS[0]
+            raise RuntimeError("Parsing failed")
+
+        stream = StringIO()
+        self.assertRaises(RuntimeError,
+                          ndjson.write_records,
+                          _records(),
+                          stream,
+                          "ndjson",
+                          end_marker=True)
+        self.assertThat(stream.getvalue(),
+                        Equals(json.dumps(RECORDS[0]) + "\n"))
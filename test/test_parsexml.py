@@ -5,18 +5,35 @@
 # See /LICENCE.md for Copyright information
 """Tests for parsexml."""
 
+import io
+
+import json
+
+import os
+
+import pickle
+
+import shutil
+
 import sys
 
-from importer import parsexml
+import tempfile
+
+import time
+
+from importer import parsexml, store
+
+from importer.ndjson import END_OF_STREAM
 
 from nose_parameterized import parameterized
 
 from six.moves import StringIO
 
-from testtools import (ExpectedException, TestCase)
+from testtools import (ExpectedException, TestCase, skipIf)
 from testtools.matchers import (Contains,
                                 Equals,
-                                Is)
+                                Is,
+                                Not)
 
 from xml.etree import ElementTree
 
@@ -320,3 +337,295 @@ class TestFileToElementTree(TestCase):
         self.assertThat(result["reviseDate"], Is(None))
         self.assertThat(stderr_out,
                         Contains("is greater than"))
+
+
+class TestStreamingParse(TestCase):
+    """Test parsing documents with many articles incrementally."""
+
+    def test_parse_each_article_in_set(self):
+        """4.5.3.1 Each article in a set is parsed into its own record."""
+        stream = StringIO("<PubmedArticleSet>{}</PubmedArticleSet>".format(
+            "".join([
+                "<PubmedArticle>{}</PubmedArticle>".format(
+                    construct_document_from(MedlineCitation={"PMID": p})
+                )
+                for p in ["1", "2", "3"]
+            ])
+        ))
+        result = list(parsexml.parse_articles(stream))
+        self.assertThat([r.pmid for r in result],
+                        Equals(["1", "2", "3"]))
+
+    def test_articles_cleared_once_parsed(self):
+        """4.5.3.1 Article elements are cleared after they are used."""
+        stream = StringIO(wrap_document_text(construct_document_from(
+            **POSSIBLE_MOCK_FIELDS
+        )))
+        elements = list(parsexml.iterparse_articles(stream))
+        self.assertThat([len(list(e)) for e in elements], Equals([0]))
+
+    def test_streaming_matches_element_tree(self):
+        """4.5.3.1 Streaming parse gives same record as parsing tree."""
+        text = wrap_document_text(construct_document_from(
+            **POSSIBLE_MOCK_FIELDS
+        ))
+        self.assertThat([r.to_json()
+                         for r in parsexml.parse_articles(StringIO(text))],
+                        Equals([parsexml.parse_element_tree(
+                            parsexml.file_to_element_tree(StringIO(text))
+                        )]))
+
+    def test_document_without_articles_parsed_as_one(self):
+        """4.5.3.4 Document with no article elements gives one record."""
+        stream = StringIO("<html></html>")
+        stderr = StringIO()
+        self.patch(sys, "stderr", stderr)
+        self.assertThat(len(list(parsexml.parse_articles(stream))),
+                        Equals(1))
+
+
+def parse_with_backend(backend, text):
+    """Parse all articles in text using backend."""
+    return list(parsexml.parse_articles(io.BytesIO(text.encode("utf-8")),
+                                        backend=parsexml.select_backend(
+                                            backend
+                                        )))
+
+
+@skipIf(parsexml.lxml_etree is None, "lxml is not installed")
+class TestLxmlBackend(TestCase):
+    """Test that the lxml backend behaves like the ElementTree backend."""
+
+    @parameterized.expand(CORRESPONDING_ENTRIES.items())
+    def test_same_record_for_field(self, field, entry):
+        """4.5.3.1 Both backends parse the same field value."""
+        del entry
+        text = wrap_document_text(construct_document_from(**{
+            k: v for k, v in POSSIBLE_MOCK_FIELDS.items() if k == field
+        }))
+        self.assertThat(parse_with_backend("lxml", text),
+                        Equals(parse_with_backend("etree", text)))
+
+    def test_same_records_for_all_fields(self):
+        """4.5.3.1 Both backends parse the same record for all fields."""
+        text = wrap_document_text(construct_document_from(
+            **append_slash_n_to_values(POSSIBLE_MOCK_FIELDS)
+        ))
+        self.assertThat(parse_with_backend("lxml", text),
+                        Equals(parse_with_backend("etree", text)))
+
+    def test_same_records_for_many_articles(self):
+        """4.5.3.1 Both backends parse the same records from a set."""
+        text = "<PubmedArticleSet>{}</PubmedArticleSet>".format("".join([
+            "<PubmedArticle>{}<MeshHeadingList><MeshHeading>"
+            "<DescriptorName>{}</DescriptorName></MeshHeading>"
+            "</MeshHeadingList></PubmedArticle>".format(
+                construct_document_from(MedlineCitation={"PMID": p}),
+                "Topic " + p
+            )
+            for p in ["1", "2", "3"]
+        ]))
+        self.assertThat(parse_with_backend("lxml", text),
+                        Equals(parse_with_backend("etree", text)))
+
+    def test_invalid_date_throws(self):
+        """4.5.3.6 Parsing invalid date throws exception with lxml."""
+        text = wrap_document_text(construct_document_from(**{
+            "DateCompleted": {
+                "Year": "2011",
+                "Day": "1"
+            }
+        }))
+        with ExpectedException(parsexml.InvalidCombinationExpection):
+            parse_with_backend("lxml", text)
+
+    def test_contradictory_date_entries_warn(self):
+        """4.8.5.3 Emit warning on contradictory date entries with lxml."""
+        text = wrap_document_text(construct_document_from(**{
+            "DateCompleted": {
+                "Year": "2011"
+            },
+            "DateRevised": {
+                "Year": "2010"
+            }
+        }))
+        stderr = StringIO()
+        self.patch(sys, "stderr", stderr)
+        result = parse_with_backend("lxml", text)
+        self.assertThat(result[0].pub_date, Is(None))
+        self.assertThat(stderr.getvalue(), Contains("is greater than"))
+
+    def test_auto_backend_is_lxml(self):
+        """4.5.3.1 lxml is used if it is installed."""
+        self.assertThat(parsexml.select_backend().name, Equals("lxml"))
+
+
+class TestBackendSelection(TestCase):
+    """Test selecting a parser backend."""
+
+    def test_fall_back_to_element_tree(self):
+        """4.5.3.1 ElementTree is used if lxml is not installed."""
+        self.patch(parsexml, "lxml_etree", None)
+        self.assertThat(parsexml.select_backend().name, Equals("etree"))
+
+    def test_unavailable_backend_throws(self):
+        """4.5.3.1 Asking for lxml when it is not installed throws."""
+        self.patch(parsexml, "lxml_etree", None)
+        with ExpectedException(ValueError):
+            parsexml.select_backend("lxml")
+
+
+PARSE_DOCUMENT = parsexml.parse_document
+
+
+def parse_document_slowly(backend_name, article):
+    """Parse a stored document, taking a second for 1.xml."""
+    if article[0] == "1.xml":
+        time.sleep(1)
+
+    return PARSE_DOCUMENT(backend_name, article)
+
+
+class ListStore(object):
+    """Store yielding a list of (name, document) tuples."""
+
+    def __init__(self, articles):
+        """Initialize this ListStore with articles."""
+        self._articles = articles
+
+    def articles(self):
+        """Yield each (name, document) tuple."""
+        return iter(self._articles)
+
+
+class TestParallelParse(TestCase):
+    """Test parsing a directory with several processes."""
+
+    def setUp(self):
+        """Create a directory of articles."""
+        super(TestParallelParse, self).setUp()
+        self.location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.location)
+        directory = store.DirectoryStore(self.location)
+        for pmid in range(1, 21):
+            directory.write(str(pmid), wrap_document_text(
+                construct_document_from(
+                    MedlineCitation={"PMID": str(pmid)},
+                    MedlineJournalInfo={"Country": "Australia"}
+                )
+            ).encode("utf-8"))
+
+    def parse(self, *args):
+        """Parse the directory with args, returning the records."""
+        stdout = StringIO()
+        self.patch(sys, "stdout", stdout)
+        parsexml.main([self.location] + list(args))
+        return json.loads(stdout.getvalue())
+
+    def test_parallel_sorted_output_same_as_serial(self):
+        """4.5.3.1 Sorted output is the same for any number of jobs."""
+        self.assertThat(self.parse("--jobs", "3", "--chunk-size", "2",
+                                   "--sort"),
+                        Equals(self.parse("--sort")))
+
+    def test_slow_documents_do_not_hold_up_others(self):
+        """Records are yielded from whichever chunk is parsed first."""
+        self.patch(parsexml, "parse_document", parse_document_slowly)
+        articles = [("{}.xml".format(p), store.DirectoryStore(
+            self.location
+        ).read(str(p))) for p in range(1, 21)]
+        records = list(parsexml.parse_store(ListStore(articles),
+                                            parsexml.select_backend("etree"),
+                                            jobs=2,
+                                            chunk_size=1))
+        self.assertThat(len(records), Equals(20))
+        self.assertThat(records[0].pmid, Not(Equals("1")))
+
+    def test_sorted_by_pmid(self):
+        """4.5.3.1 Sorted output is in numeric PMID order."""
+        self.assertThat([r["pmid"] for r in self.parse("--jobs", "2",
+                                                       "--sort")],
+                        Equals([str(p) for p in range(1, 21)]))
+
+    def test_warnings_tagged_with_filename(self):
+        """4.8.5.3 Warnings from parsing a document name the document."""
+        stderr = StringIO()
+        self.patch(sys, "stderr", stderr)
+        parsexml.parse_document("etree", ("12.xml", wrap_document_text(
+            construct_document_from(DateCompleted={"Year": "2011"},
+                                    DateRevised={"Year": "2010"})
+        ).encode("utf-8")))
+        self.assertThat(stderr.getvalue(), Contains("12.xml: "))
+
+    def test_parse_errors_can_be_sent_from_workers(self):
+        """4.5.3.6 Parse errors survive being sent between processes."""
+        error = pickle.loads(pickle.dumps(
+            parsexml.InvalidCombinationExpection("DateCompleted",
+                                                 parsexml.DATE_COMBINATIONS)
+        ))
+        self.assertThat(str(error), Contains("DateCompleted"))
+
+    def test_ndjson_output_same_records_as_json(self):
+        """4.5.3.1 NDJSON output has one record per line, same as JSON."""
+        stdout = StringIO()
+        self.patch(sys, "stdout", stdout)
+        parsexml.main([self.location, "--sort", "--format", "ndjson"])
+        lines = stdout.getvalue().splitlines()
+        self.assertThat([json.loads(line) for line in lines],
+                        Equals(self.parse("--sort")))
+
+    def test_ndjson_end_marker_written_last(self):
+        """4.5.3.1 NDJSON output ends with an end marker if asked to."""
+        stdout = StringIO()
+        self.patch(sys, "stdout", stdout)
+        parsexml.main([self.location, "--format", "ndjson", "--end-marker"])
+        lines = stdout.getvalue().splitlines()
+        self.assertThat(json.loads(lines[-1]), Equals(END_OF_STREAM))
+
+    def test_cached_parse_same_as_uncached(self):
+        """4.5.3.1 Records from the parse cache are the same as parsing."""
+        self.parse("--cache")
+        self.assertThat(self.parse("--cache", "--jobs", "2", "--sort"),
+                        Equals(self.parse("--sort")))
+
+    def test_only_changed_documents_parsed_again(self):
+        """4.5.3.1 Only documents changed since caching are parsed."""
+        stderr = StringIO()
+        self.patch(sys, "stderr", stderr)
+        self.parse("--cache")
+        store.DirectoryStore(self.location).write("3", wrap_document_text(
+            construct_document_from(MedlineCitation={"PMID": "3"},
+                                    MedlineJournalInfo={"Country": "Fiji"})
+        ).encode("utf-8"))
+        records = self.parse("--cache", "--sort")
+        self.assertThat(records[2]["country"], Equals("Fiji"))
+        self.assertThat(stderr.getvalue().splitlines(),
+                        Equals(["Parse cache: 0 hits, 20 misses",
+                                "Parse cache: 19 hits, 1 misses"]))
+
+    def test_unchanged_documents_not_read(self):
+        """4.5.3.1 Documents not modified since caching are not read."""
+        for pmid in range(1, 21):
+            path = store.DirectoryStore(self.location).path(str(pmid))
+            os.utime(path, (0, 0))
+
+        self.patch(sys, "stderr", StringIO())
+        records = self.parse("--cache", "--sort")
+        self.patch(store, "read_file", lambda path: self.fail(path))
+        self.assertThat(self.parse("--cache", "--sort"), Equals(records))
+
+    def test_metrics_counted_in_worker_processes(self):
+        """4.5.3.1 Articles and warnings from every process are counted."""
+        stderr = StringIO()
+        self.patch(sys, "stderr", stderr)
+        store.DirectoryStore(self.location).write("21", wrap_document_text(
+            construct_document_from(MedlineCitation={"PMID": "21"},
+                                    DateCompleted={"Year": "2011"},
+                                    DateRevised={"Year": "2010"})
+        ).encode("utf-8"))
+        path = os.path.join(self.location, "metrics.json")
+        self.parse("--jobs", "2", "--metrics-file", path)
+        with open(path) as metrics_file:
+            counters = json.load(metrics_file)["counters"]
+        self.assertThat((counters["articles"], counters["warnings"]),
+                        Equals((21, 1)))
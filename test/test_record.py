@@ -0,0 +1,114 @@
+# /test/test_record.py
+#
+# Tests for the compact article record.
+#
+# See /LICENCE.md for Copyright information
+"""Tests for the compact article record."""
+
+import json
+
+import pickle
+
+from importer import record
+
+from nose_parameterized import parameterized
+
+from testtools import TestCase
+from testtools.matchers import (Equals, Is)
+
+
+ENTRY = {
+    "pmid": "111111",
+    "pubDate": {
+        "date": "2011-11-01",
+        "components": {"Year": True, "Month": True, "Day": False}
+    },
+    "reviseDate": {
+        "date": "2012-11-11",
+        "components": {"Year": True, "Month": True, "Day": True}
+    },
+    "ISSN": "0",
+    "country": "UNITED STATES",
+    "Author": ["fore_name last_name"],
+    "Topic": []
+}
+
+
+class TestArticleRecord(TestCase):
+    """Test converting and comparing ArticleRecords."""
+
+    def test_round_trip_json(self):
+        """Records convert back to the same JSON."""
+        self.assertThat(record.ArticleRecord.from_json(ENTRY).to_json(),
+                        Equals(ENTRY))
+
+    def test_missing_fields_are_none(self):
+        """Fields missing from the JSON are None."""
+        article = record.ArticleRecord.from_json({"pmid": "1"})
+        self.assertThat(article.fields(), Equals(()))
+        self.assertThat(article.to_json()["Topic"], Is(None))
+
+    def test_fields_with_values(self):
+        """The names of fields with values are listed."""
+        self.assertThat(record.ArticleRecord.from_json(ENTRY).fields(),
+                        Equals(("pubDate",
+                                "reviseDate",
+                                "ISSN",
+                                "country",
+                                "Author",
+                                "Topic")))
+
+    def test_dimension_strings_shared(self):
+        """Equal dimension strings from different records are shared."""
+        first, second = [
+            record.ArticleRecord.from_json(json.loads(json.dumps(ENTRY)))
+            for _ in range(2)
+        ]
+        self.assertThat(first.country, Is(second.country))
+        self.assertThat(first.authors[0], Is(second.authors[0]))
+
+    def test_strings_shared_after_unpickling(self):
+        """Records sent from another process share strings again."""
+        article = record.ArticleRecord.from_json(ENTRY)
+        copy = pickle.loads(pickle.dumps(article))
+        self.assertThat(copy, Equals(article))
+        self.assertThat(copy.country, Is(article.country))
+
+
+class TestPackedDates(TestCase):
+    """Test packing dates into integers."""
+
+    @parameterized.expand([
+        ("0001-01-01", 0),
+        ("2011-01-01", 1),
+        ("2011-02-01", 2),
+        ("2011-02-03", 3)
+    ])
+    def test_round_trip_date(self, date, precision):
+        """Dates keep their value and precision."""
+        entry = {
+            "date": date,
+            "components": {
+                "Year": precision > 0,
+                "Month": precision > 1,
+                "Day": precision == 3
+            }
+        }
+        self.assertThat(record.date_to_json(record.date_from_json(entry)),
+                        Equals(entry))
+
+    def test_dates_compare_in_order(self):
+        """Packed date values compare in date order."""
+        self.assertThat(record.date_value(record.encode_date(2011, 1, 2, 3)) >
+                        record.date_value(record.encode_date(2010, 12, 31)),
+                        Equals(True))
+
+    def test_year_and_month(self):
+        """The year and month can be read from a packed date."""
+        packed = record.encode_date(2011, 11, 5)
+        self.assertThat((record.date_year(packed), record.date_month(packed)),
+                        Equals((2011, 11)))
+
+    def test_invalid_date_raises(self):
+        """Packing an invalid date raises ValueError."""
+        self.assertRaises(ValueError, record.encode_date, 2011, 2, 30)
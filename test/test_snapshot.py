@@ -0,0 +1,87 @@
+# /test/test_snapshot.py
+#
+# Tests for the snapshot of loaded articles.
+#
+# See /LICENCE.md for Copyright information
+"""Tests for the snapshot of loaded articles."""
+
+import os
+
+import shutil
+
+import tempfile
+
+from importer.snapshot import LoadSnapshot
+
+from testtools import TestCase
+from testtools.matchers import Equals
+
+
+def article(pmid, country="Australia"):
+    """Get the JSON form of an article."""
+    return {"pmid": pmid, "country": country}
+
+
+class TestLoadSnapshot(TestCase):
+    """Test finding changed and removed articles."""
+
+    def setUp(self):
+        """Create a snapshot with two loaded articles."""
+        super(TestLoadSnapshot, self).setUp()
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, "snapshot.sqlite")
+        snapshot = LoadSnapshot(self.path)
+        for record in (article("1"), article("2")):
+            snapshot.is_changed(record)
+        snapshot.mark_loaded(["1", "2"])
+        snapshot.close()
+
+    def open_snapshot(self):
+        """Open the snapshot for another load."""
+        snapshot = LoadSnapshot(self.path)
+        self.addCleanup(snapshot.close)
+        return snapshot
+
+    def test_unchanged_articles_not_loaded(self):
+        """Articles with the same contents are not loaded again."""
+        snapshot = self.open_snapshot()
+        self.assertThat(snapshot.is_changed(article("1")), Equals(False))
+
+    def test_changed_articles_loaded(self):
+        """New articles and articles with new contents are loaded."""
+        snapshot = self.open_snapshot()
+        self.assertThat([snapshot.is_changed(article("1", "Japan")),
+                         snapshot.is_changed(article("3"))],
+                        Equals([True, True]))
+
+    def test_failed_articles_loaded_again(self):
+        """Changed articles which were not loaded are loaded next time."""
+        self.open_snapshot().is_changed(article("1", "Japan"))
+        snapshot = self.open_snapshot()
+        self.assertThat(snapshot.is_changed(article("1", "Japan")),
+                        Equals(True))
+
+    def test_articles_not_seen_removed(self):
+        """Loaded articles which are not seen again are removed."""
+        snapshot = self.open_snapshot()
+        snapshot.is_changed(article("1"))
+        self.assertThat(snapshot.removed(), Equals(["2"]))
+        snapshot.forget(["2"])
+        self.assertThat(len(snapshot), Equals(1))
+
+    def test_snapshot_without_database_does_not_match(self):
+        """A snapshot which does not record its database never matches."""
+        self.assertThat(self.open_snapshot().matches("bolt://a", 2),
+                        Equals(False))
+
+    def test_cleared_snapshot_matches_its_database(self):
+        """A cleared snapshot only matches its database, if it is empty."""
+        snapshot = self.open_snapshot()
+        snapshot.clear("bolt://a")
+        snapshot = self.open_snapshot()
+        self.assertThat([len(snapshot),
+                         snapshot.matches("bolt://a", 0),
+                         snapshot.matches("bolt://b", 0),
+                         snapshot.matches("bolt://a", 2)],
+                        Equals([0, True, False, False]))
@@ -0,0 +1,131 @@
+# /test/test_sqlitesink.py
+#
+# Tests for storing the article graph in SQLite.
+#
+# See /LICENCE.md for Copyright information
+"""Tests for storing the article graph in SQLite."""
+
+import os
+
+import shutil
+
+import tempfile
+
+from importer.sqlitesink import SQLiteSink
+
+from testtools import ExpectedException
+from testtools import TestCase
+from testtools.matchers import Equals
+
+
+def article(pmid, country="Australia", topics=None, date="2011-11-11"):
+    """Get the JSON form of an article."""
+    return {
+        "pmid": pmid,
+        "pubDate": {"date": date},
+        "country": country,
+        "Author": ["A Author"],
+        "Topic": topics or ["Topic"]
+    }
+
+
+class TestSQLiteSink(TestCase):
+    """Test loading articles into SQLite and querying charts."""
+
+    def setUp(self):
+        """Create a sink in a temporary directory."""
+        super(TestSQLiteSink, self).setUp()
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, "graph.sqlite")
+        self.sink = SQLiteSink(self.path)
+        self.addCleanup(self.sink.close)
+
+    def test_top_names_by_article_count(self):
+        """Names are counted by the articles related to them."""
+        self.sink.load([article("1"),
+                        article("2", "Japan"),
+                        article("3", "Japan")])
+        self.assertThat(self.sink.top("countryRetraction"),
+                        Equals([("Japan", 2), ("Australia", 1)]))
+
+    def test_top_names_limited(self):
+        """Only limit names are returned."""
+        self.sink.load([article("1"), article("2", "Japan")])
+        self.assertThat(self.sink.top("countryRetraction", limit=1),
+                        Equals([("Australia", 1)]))
+
+    def test_filtered_top_names(self):
+        """Only articles related to the filter node are counted."""
+        self.sink.load([article("1", topics=["A", "B"]),
+                        article("2", topics=["A"]),
+                        article("3", topics=["C"], date="2012-01-01")])
+        self.assertThat(self.sink.top("topicRetraction", "2011", "year"),
+                        Equals([("A", 2), ("B", 1)]))
+
+    def test_filter_node_not_counted(self):
+        """The filter node is not counted against itself."""
+        self.sink.load([article("1", topics=["A", "B"]),
+                        article("2", topics=["A"])])
+        self.assertThat(self.sink.top("topicRetraction", "A", "topic"),
+                        Equals([("B", 1)]))
+
+    def test_edges_stored_once(self):
+        """Loading an article again does not count it twice."""
+        self.sink.load([article("1")])
+        self.sink.load([article("1")])
+        self.assertThat(self.sink.top("retractionsOverTime"),
+                        Equals([("2011", 1)]))
+
+    def test_issn_kept_if_missing(self):
+        """An article loaded again without an ISSN keeps its old ISSN."""
+        record = article("1")
+        record["ISSN"] = "1234-5678"
+        self.sink.load([record])
+        self.sink.load([article("1")])
+        self.sink.close()
+
+        sink = SQLiteSink(self.path)
+        self.addCleanup(sink.close)
+        self.assertThat(
+            sink._connection.execute("SELECT issn FROM articles").fetchall(),
+            Equals([("1234-5678",)])
+        )
+
+    def test_reset_deletes_articles(self):
+        """Resetting the sink deletes every article."""
+        self.sink.load([article("1")])
+        self.sink.reset()
+        self.assertThat(self.sink.top("countryRetraction"), Equals([]))
+
+    def test_transaction_committed_at_once(self):
+        """Other readers only see articles once a transaction commits."""
+        reader = SQLiteSink(self.path)
+        self.addCleanup(reader.close)
+        with self.sink.transaction():
+            self.sink.reset()
+            self.sink.load([article("1")])
+            self.assertThat(reader.top("countryRetraction"), Equals([]))
+        self.assertThat(reader.top("countryRetraction"),
+                        Equals([("Australia", 1)]))
+
+    def test_transaction_rolled_back_on_error(self):
+        """Nothing done in a transaction which fails is kept."""
+        self.sink.load([article("1")])
+        with ExpectedException(RuntimeError):
+            with self.sink.transaction():
+                self.sink.reset()
+                self.sink.load([article("2", "Japan")])
+                raise RuntimeError("Input stopped")
+        self.assertThat(self.sink.top("countryRetraction"),
+                        Equals([("Australia", 1)]))
+
+    def test_unknown_chart(self):
+        """A ValueError is raised for charts which do not exist."""
+        with ExpectedException(ValueError):
+            self.sink.top("unknown")
+
+    def test_unknown_filter_type(self):
+        """A ValueError is raised for filter types which do not exist."""
+        with ExpectedException(ValueError):
+            self.sink.top("topicRetraction", "A", "unknown")
@@ -0,0 +1,275 @@
+# /test/test_store.py
+#
+# Tests for article storage.
+#
+# See /LICENCE.md for Copyright information
+"""Tests for article storage."""
+
+import json
+
+import os
+
+import shutil
+
+import sys
+
+import tempfile
+
+import time
+
+from importer import parsexml, store
+
+from six.moves import StringIO
+
+from testtools import (ExpectedException, TestCase)
+from testtools.matchers import (Equals,
+                                FileExists,
+                                IsInstance,
+                                Not)
+
+
+def article_document(pmid):
+    """Generate an article set document for pmid."""
+    return ("<PubmedArticleSet><PubmedArticle><MedlineCitation>"
+            "<PMID>{}</PMID></MedlineCitation></PubmedArticle>"
+            "</PubmedArticleSet>").format(pmid).encode("utf-8")
+
+
+class TestPackStore(TestCase):
+    """Test storing articles in a pack file."""
+
+    def setUp(self):
+        """Create a directory for the pack."""
+        super(TestPackStore, self).setUp()
+        self.location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.location)
+
+    def write_pack(self, articles):
+        """Write (pmid, document) tuples in articles to a pack."""
+        pack = store.PackStore(self.location)
+        for pmid, document in articles:
+            pack.write(pmid, document)
+        pack.close()
+
+    def test_read_articles_sequentially(self):
+        """Articles are read back in the order they were written."""
+        articles = [(p, article_document(p)) for p in ["3", "1", "2"]]
+        self.write_pack(articles)
+        self.assertThat(list(store.PackStore(self.location).articles()),
+                        Equals(articles))
+
+    def test_read_article_by_pmid(self):
+        """Articles can be read by PMID using the index."""
+        self.write_pack([(p, article_document(p)) for p in ["1", "2"]])
+        pack = store.PackStore(self.location)
+        self.assertThat(pack.read("2"), Equals(article_document("2")))
+        self.assertThat("1" in pack, Equals(True))
+        self.assertThat("3" in pack, Equals(False))
+
+    def test_rewritten_article_supersedes_old(self):
+        """Writing an article again replaces the old record."""
+        self.write_pack([("1", b"old"), ("2", b"other"), ("1", b"new")])
+        pack = store.PackStore(self.location)
+        self.assertThat(list(pack.articles()),
+                        Equals([("2", b"other"), ("1", b"new")]))
+        self.assertThat(len(pack), Equals(2))
+
+    def test_appends_across_sessions(self):
+        """Opening an existing pack appends to it."""
+        self.write_pack([("1", b"one")])
+        self.write_pack([("2", b"two")])
+        self.assertThat(list(store.PackStore(self.location).articles()),
+                        Equals([("1", b"one"), ("2", b"two")]))
+
+    def test_truncated_pack_raises(self):
+        """Reading a truncated pack raises CorruptPackError."""
+        self.write_pack([("1", article_document("1"))])
+        pack_path = os.path.join(self.location, store.PACK_FILE)
+        with open(pack_path, "rb+") as pack:
+            pack.truncate(os.path.getsize(pack_path) - 1)
+
+        with ExpectedException(store.CorruptPackError):
+            list(store.PackStore(self.location).articles())
+
+    def test_torn_record_not_read(self):
+        """A record torn by an interrupted write is not read."""
+        self.write_pack([("1", b"one")])
+        with open(os.path.join(self.location, store.PACK_FILE), "ab") as pack:
+            pack.write(store.RECORD_HEADER.pack(1, 100) + b"2xx")
+
+        self.assertThat(list(store.PackStore(self.location).articles()),
+                        Equals([("1", b"one")]))
+
+    def test_torn_record_cut_off_before_appending(self):
+        """Records written after a torn record and index line are read."""
+        self.write_pack([("1", b"one")])
+        with open(os.path.join(self.location, store.PACK_FILE), "ab") as pack:
+            pack.write(store.RECORD_HEADER.pack(1, 100) + b"2xx")
+        with open(os.path.join(self.location, store.INDEX_FILE), "a") as idx:
+            idx.write("2\t1")
+
+        self.write_pack([("3", b"three")])
+        pack = store.PackStore(self.location)
+        self.assertThat(list(pack.articles()),
+                        Equals([("1", b"one"), ("3", b"three")]))
+        self.assertThat(pack.read("3"), Equals(b"three"))
+        self.assertThat("2" in pack, Equals(False))
+
+    def test_torn_indexed_record_cut_off_before_appending(self):
+        """Indexed records torn because the pack was not synced are cut off.
+
+        Their index entries are dropped, so that they do not point at
+        the records written over them.
+        """
+        self.write_pack([("1", b"one"), ("2", b"two")])
+        pack_path = os.path.join(self.location, store.PACK_FILE)
+        with open(pack_path, "rb+") as pack:
+            pack.truncate(os.path.getsize(pack_path) - 1)
+
+        self.write_pack([("3", b"three")])
+        pack = store.PackStore(self.location)
+        self.assertThat(list(pack.articles()),
+                        Equals([("1", b"one"), ("3", b"three")]))
+        self.assertThat(pack.read("3"), Equals(b"three"))
+        self.assertThat("2" in pack, Equals(False))
+
+    def test_corrupt_indexed_record_cut_off_before_appending(self):
+        """Indexed records which cannot be decompressed are cut off."""
+        self.write_pack([("1", b"one"), ("2", b"two")])
+        offset = store.PackStore(self.location)._index["2"]
+        pack_path = os.path.join(self.location, store.PACK_FILE)
+        with open(pack_path, "rb+") as pack:
+            pack.seek(offset + store.RECORD_HEADER.size + 2)
+            pack.write(b"xx")
+
+        self.write_pack([("2", b"two")])
+        self.assertThat(list(store.PackStore(self.location).articles()),
+                        Equals([("1", b"one"), ("2", b"two")]))
+
+    def test_corrupt_record_raises(self):
+        """Records which cannot be decompressed raise CorruptPackError."""
+        self.write_pack([("1", b"one")])
+        pack_path = os.path.join(self.location, store.PACK_FILE)
+        with open(pack_path, "rb+") as pack:
+            pack.seek(store.RECORD_HEADER.size + 1)
+            pack.write(b"xx")
+
+        with ExpectedException(store.CorruptPackError):
+            list(store.PackStore(self.location).articles())
+
+    def test_stamps_change_with_records(self):
+        """Stamps of articles in a pack only change if they are rewritten."""
+        self.write_pack([(p, article_document(p)) for p in ["1", "2"]])
+        before = dict((p, stamp) for p, stamp, _ in store.PackStore(
+            self.location
+        ).stamped_articles())
+        self.write_pack([("1", article_document("11"))])
+        after = dict((p, stamp) for p, stamp, _ in store.PackStore(
+            self.location
+        ).stamped_articles())
+        self.assertThat((before["1"] == after["1"],
+                         before["2"] == after["2"]),
+                        Equals((False, True)))
+
+    def test_stamped_articles_read(self):
+        """Stamped articles in a pack read the document when asked to."""
+        self.write_pack([("1", article_document("1"))])
+        self.assertThat([
+            (pmid, read()) for pmid, _, read
+            in store.PackStore(self.location).stamped_articles()
+        ], Equals([("1", article_document("1"))]))
+
+    def test_open_store_detects_pack(self):
+        """open_store uses a pack if there is one in the directory."""
+        self.assertThat(store.open_store(self.location),
+                        IsInstance(store.DirectoryStore))
+        self.write_pack([("1", b"one")])
+        self.assertThat(store.open_store(self.location),
+                        IsInstance(store.PackStore))
+
+
+class TestDirectoryStore(TestCase):
+    """Test storing articles as files in a directory."""
+
+    def setUp(self):
+        """Create a directory with an article which is an hour old."""
+        super(TestDirectoryStore, self).setUp()
+        self.location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.location)
+        self.directory = store.DirectoryStore(self.location)
+        self.directory.write("1", article_document("1"))
+        self.age("1", 3600)
+
+    def age(self, pmid, seconds):
+        """Set the modification time of pmid to seconds ago."""
+        modified = time.time() - seconds
+        os.utime(self.directory.path(pmid), (modified, modified))
+
+    def stamp(self):
+        """Get the stamp of the article."""
+        return [stamp for _, stamp, _ in self.directory.stamped_articles()]
+
+    def test_stamp_changes_when_modified(self):
+        """The stamp of an article changes when its file is modified."""
+        before = self.stamp()
+        self.directory.write("1", article_document("11"))
+        self.age("1", 60)
+        self.assertThat(self.stamp(), Not(Equals(before)))
+
+    def test_recently_modified_files_not_stamped(self):
+        """Files which were just modified have no stamp."""
+        self.directory.write("1", article_document("1"))
+        self.assertThat(self.stamp(), Equals([None]))
+
+    def test_stamped_articles_read(self):
+        """Stamped articles read the document when asked to."""
+        self.assertThat([
+            (name, read()) for name, _, read
+            in self.directory.stamped_articles()
+        ], Equals([("1.xml", article_document("1"))]))
+
+
+class TestMigrateDirectory(TestCase):
+    """Test migrating a directory of articles into a pack."""
+
+    def setUp(self):
+        """Create a directory of articles."""
+        super(TestMigrateDirectory, self).setUp()
+        self.location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.location)
+        directory = store.DirectoryStore(self.location)
+        for pmid in ["1", "2", "3"]:
+            directory.write(pmid, article_document(pmid))
+
+    def test_migrate_articles(self):
+        """All articles in the directory are added to the pack."""
+        self.assertThat(store.migrate_directory(self.location), Equals(3))
+        pack = store.PackStore(self.location)
+        self.assertThat(sorted(pack.articles()),
+                        Equals([(p, article_document(p))
+                                for p in ["1", "2", "3"]]))
+        self.assertThat(os.path.join(self.location, "1.xml"), FileExists())
+
+    def test_migrate_again_adds_nothing(self):
+        """Articles already in the pack are not added again."""
+        store.migrate_directory(self.location)
+        self.assertThat(store.migrate_directory(self.location), Equals(0))
+
+    def test_migrate_and_remove(self):
+        """Files can be removed once they are packed."""
+        store.migrate_directory(self.location, remove=True)
+        self.assertThat(sorted(os.listdir(self.location)),
+                        Equals([store.INDEX_FILE, store.PACK_FILE]))
+
+    def test_parse_pack_same_as_directory(self):
+        """Parsing a pack gives the same records as the directory."""
+        def _parse(kind):
+            """Parse articles in the store of kind."""
+            stdout = StringIO()
+            self.patch(sys, "stdout", stdout)
+            parsexml.main([self.location, "--store", kind])
+            return sorted(json.loads(stdout.getvalue()),
+                          key=lambda r: r["pmid"])
+
+        store.migrate_directory(self.location)
+        self.assertThat(_parse("pack"), Equals(_parse("directory")))
@@ -75,7 +75,7 @@ function seedDatabaseWith(data) {
         parsed = JSON.parse(info.output[1].toString());
 
         /* Here we put each request to seed an individual part of the
-         * database in series, by calling reduce on the parsed commands
+         * database in series, by calling reduce on the parsed statements
          * and then 'then'ing them in a chain.
          *
          * Once we're all done, we can resolve the head promise which
@@ -85,7 +85,8 @@ function seedDatabaseWith(data) {
             return new Promise(function nextRequest(resolveNext) {
               request.post(url, {
                 json: {
-                  query: cmd.trim()
+                  query: cmd.statement,
+                  params: cmd.parameters
                 }
               }, function onDonePostCmd(error, response, body) {
                 if (error) {